@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Compares the memory and lookup cost of the AttrTree stat store against the OrderedDict of
+  full paramiko SFTPAttributes that the mirrorer used to keep, on a synthetic tree.
+
+Example:
+    python -m benchmark.attr_tree_benchmark --entries 1000000
+"""
+
+import json
+import tracemalloc
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict, deque
+from stat import S_IFDIR, S_IFREG
+from time import perf_counter
+
+from paramiko import SFTPAttributes
+
+from durasftp.common.sftp.attr_tree import AttrTree
+
+EPILOG = __doc__
+
+
+def synthetic_entries(entry_count, files_per_dir=100, dirs_per_dir=10):
+    """
+    Generates (remote path, SFTPAttributes) pairs for a tree of entry_count entries,
+      breadth first, so that the tree stays shallow like real trees do
+    """
+    generated = 0
+    dir_num = 0
+    pending_dirs = deque(["/"])
+    while pending_dirs and generated < entry_count:
+        dir_path = pending_dirs.popleft()
+        for file_num in range(files_per_dir):
+            if generated >= entry_count:
+                return
+            file_name = "file_{:06d}.csv".format(file_num)
+            file_path = dir_path.rstrip("/") + "/" + file_name
+            yield file_path, synthetic_attributes(file_name, S_IFREG | 0o644, generated)
+            generated += 1
+        for sub_dir_num in range(dirs_per_dir):
+            if generated >= entry_count:
+                return
+            dir_num += 1
+            sub_dir_name = "dir_{:06d}".format(dir_num)
+            sub_dir_path = dir_path.rstrip("/") + "/" + sub_dir_name
+            yield sub_dir_path, synthetic_attributes(
+                sub_dir_name, S_IFDIR | 0o755, generated
+            )
+            generated += 1
+            pending_dirs.append(sub_dir_path)
+
+
+def synthetic_attributes(file_name, st_mode, seed):
+    attrs = SFTPAttributes()
+    attrs.filename = file_name
+    attrs.st_mode = st_mode
+    attrs.st_size = seed * 7
+    attrs.st_uid = 1000
+    attrs.st_gid = 1000
+    attrs.st_atime = 1500000000 + seed
+    attrs.st_mtime = 1500000000 + seed
+    attrs.longname = "-rw-r--r--    1 1000     1000     {:>8} Jul 14  2017 {}".format(
+        attrs.st_size, file_name
+    )
+    return attrs
+
+
+def measure_store(store_class, entry_count):
+    """
+    Fills a store with synthetic entries, then looks every path up again
+    :return: A dict of results
+    """
+    tracemalloc.start()
+    started_at = perf_counter()
+    store = store_class()
+    for remote_path, attrs in synthetic_entries(entry_count):
+        store[remote_path] = attrs
+    load_seconds = perf_counter() - started_at
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started_at = perf_counter()
+    for remote_path, attrs in synthetic_entries(entry_count):
+        store[remote_path].st_size
+    lookup_seconds = perf_counter() - started_at
+
+    started_at = perf_counter()
+    for remote_path, entry in store.items():
+        entry.st_mode
+    iterate_seconds = perf_counter() - started_at
+    return OrderedDict(
+        [
+            ("store", store_class.__name__),
+            ("entries", len(store)),
+            ("retained_bytes", current_bytes),
+            ("peak_bytes", peak_bytes),
+            ("bytes_per_entry", round(current_bytes / max(len(store), 1), 1)),
+            ("load_seconds", round(load_seconds, 3)),
+            ("lookup_seconds", round(lookup_seconds, 3)),
+            ("iterate_seconds", round(iterate_seconds, 3)),
+        ]
+    )
+
+
+def run_benchmark(entry_counts):
+    results = []
+    for entry_count in entry_counts:
+        for store_class in [OrderedDict, AttrTree]:
+            results.append(measure_store(store_class, entry_count))
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, epilog=EPILOG)
+    parser.add_argument(
+        "--entries",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="The number of entries in each synthetic tree",
+    )
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.entries), indent=2))
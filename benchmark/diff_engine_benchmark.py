@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+Compares planning a mirror path by path against planning it with the vectorized diff engine,
+  on synthetic trees where most files are unchanged and some are newer, resized or missing.
+
+Example:
+    python -m benchmark.diff_engine_benchmark --entries 1000000
+"""
+
+import json
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmark.attr_tree_benchmark import synthetic_entries
+from durasftp.common.sftp import diff_engine
+from durasftp.common.sftp.attr_tree import AttrTree
+from durasftp.common.sftp.mirrorer import Mirrorer
+
+EPILOG = __doc__
+
+
+class OfflineConnection:
+    """
+    Stands in for a connection, since planning never talks to the server
+    """
+
+    _transport = None
+
+    def listdir(self, remote_path):
+        return []
+
+    def close(self):
+        pass
+
+
+def synthetic_trees(entry_count):
+    """
+    Builds a remote tree, and a local tree where 1 in 20 files is newer remotely,
+      1 in 20 has a different size, and 1 in 20 is missing
+    """
+    remote_tree = AttrTree()
+    local_tree = AttrTree()
+    for entry_num, (remote_path, attrs) in enumerate(synthetic_entries(entry_count)):
+        remote_tree[remote_path] = attrs
+        variation = entry_num % 20
+        if variation == 1:
+            continue
+        local_size = attrs.st_size + (1 if variation == 2 else 0)
+        local_mtime = attrs.st_mtime - (60 if variation == 3 else 0)
+        local_tree.set(remote_path, attrs.st_mode, local_size, local_mtime)
+    return remote_tree, local_tree
+
+
+def plan(mirrorer, use_diff_engine):
+    mirrorer.use_diff_engine = use_diff_engine
+    started_at = perf_counter()
+    if use_diff_engine:
+        actions = list(mirrorer.actions_by_diff(from_remote=True))
+    else:
+        actions = [
+            mirrorer.action_from_remote_by_path(remote_path)
+            for remote_path in mirrorer.remote_attr_tree.keys()
+        ]
+    return actions, perf_counter() - started_at
+
+
+def run_benchmark(entry_counts):
+    results = []
+    with TemporaryDirectory() as local_dir:
+        mirrorer = Mirrorer(local_dir, conn=OfflineConnection())
+        for entry_count in entry_counts:
+            remote_tree, local_tree = synthetic_trees(entry_count)
+            mirrorer.remote_attr_tree = remote_tree
+            mirrorer.local_attr_tree = local_tree
+
+            per_path_actions, per_path_seconds = plan(mirrorer, False)
+            diff_actions, diff_seconds = plan(mirrorer, True)
+            started_at = perf_counter()
+            diff_engine.diff_trees(remote_tree, local_tree)
+            codes_seconds = perf_counter() - started_at
+
+            same_actions = [
+                (action.remote_path, action.action_code) for action in per_path_actions
+            ] == [(action.remote_path, action.action_code) for action in diff_actions]
+            results.append(
+                OrderedDict(
+                    [
+                        ("entries", entry_count),
+                        ("per_path_seconds", round(per_path_seconds, 3)),
+                        ("diff_engine_seconds", round(diff_seconds, 3)),
+                        ("diff_codes_seconds", round(codes_seconds, 3)),
+                        ("speedup", round(per_path_seconds / diff_seconds, 1)),
+                        ("same_actions", same_actions),
+                    ]
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, epilog=EPILOG)
+    parser.add_argument(
+        "--entries",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="The number of entries in each synthetic tree",
+    )
+    args = parser.parse_args()
+    if not diff_engine.is_available():
+        parser.error("The diff engine needs NumPy: pip install durasftp[fast]")
+    print(json.dumps(run_benchmark(args.entries), indent=2))
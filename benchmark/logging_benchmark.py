@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""
+Measures what logging costs per action: running dry-run actions with logging off, at INFO
+  and DEBUG as text, and at DEBUG as JSON lines, next to what a disabled event costs
+  and what formatting the messages eagerly, as the actions used to, cost with logging off.
+  The events of an action with logging off are compared to downloading a 1KB file from
+  an in-process server, and formatting a 64KB forwarded payload to a disabled event.
+
+Example:
+    python -m benchmark.logging_benchmark --actions 100000
+"""
+
+import io
+import json
+import logging
+import os
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging import DEBUG, INFO, WARNING
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmark.diff_engine_benchmark import OfflineConnection
+from benchmark.mirror_benchmark import write_tree
+from benchmark.sftp_server import LocalSFTPServer
+from durasftp.common import ONE_KB
+from durasftp.common.log import (
+    FORMAT_STRING,
+    get_event_logger,
+    get_log_level,
+    get_project_logger,
+    set_log_level,
+)
+from durasftp.common.log.log_formatter import JsonLinesFormatter, LogFormatter
+from durasftp.common.sftp.action import SFTPAction
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.mirrorer import Mirrorer
+
+EPILOG = __doc__
+
+events = get_event_logger(__name__)
+
+
+@contextmanager
+def logging_to(level, formatter=None):
+    """
+    Logs at level into memory with formatter, or nowhere, for the code run inside of this context
+    """
+    project_logger = get_project_logger()
+    handlers = project_logger.handlers[:]
+    old_level = get_log_level()
+    for handler in handlers:
+        project_logger.removeHandler(handler)
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    if formatter is not None:
+        handler.setFormatter(formatter)
+    project_logger.addHandler(handler)
+    set_log_level(level)
+    try:
+        yield stream
+    finally:
+        project_logger.removeHandler(handler)
+        for handler in handlers:
+            project_logger.addHandler(handler)
+        set_log_level(old_level)
+
+
+def dry_run_actions(mirrorer, action_count):
+    """
+    :return: GET actions that replace a local file, the action that logs the most
+    """
+    remote_entry = AttrEntry("file.txt", 0o100644, ONE_KB, 1500000000)
+    local_entry = AttrEntry("file.txt", 0o100644, 0, 1400000000)
+    return [
+        SFTPAction(
+            mirrorer,
+            SFTPActionCodes.GET,
+            "/dir_{:03d}/file_{:06d}.txt".format(action_num % 100, action_num),
+            local_entry=local_entry,
+            remote_entry=remote_entry,
+        )
+        for action_num in range(action_count)
+    ]
+
+
+def time_per_item(fn, items):
+    started_at = perf_counter()
+    for item in items:
+        fn(item)
+    return (perf_counter() - started_at) / len(items)
+
+
+def eager_messages(action):
+    """
+    Formats the messages that running a GET used to, before checking the log level
+    """
+    for _ in range(4):
+        "Running: {}".format(action.__repr__())
+    "run_get: {}".format(action.remote_path)
+    "Removing: {}".format(action.local_path)
+    "Downloading: {}".format(action.remote_path)
+
+
+def run_benchmark(action_count, transfer_count, repeat=3):
+    results = OrderedDict([("actions", action_count)])
+    with TemporaryDirectory() as local_dir:
+        mirrorer = Mirrorer(local_dir, conn=OfflineConnection())
+        actions = dry_run_actions(mirrorer, action_count)
+
+        def run(action):
+            action.run(dry_run=True)
+
+        with logging_to(DEBUG) as stream:
+            run(actions[0])
+            events_per_action = stream.getvalue().count("\n")
+        results["events_per_action"] = events_per_action
+
+        runs = [
+            ("off", WARNING, None),
+            ("info_text", INFO, LogFormatter(FORMAT_STRING)),
+            ("debug_text", DEBUG, LogFormatter(FORMAT_STRING)),
+            ("debug_json", DEBUG, JsonLinesFormatter()),
+        ]
+        for name, level, formatter in runs:
+            with logging_to(level, formatter):
+                results["run_{}_us".format(name)] = round(
+                    min(time_per_item(run, actions) for _ in range(repeat)) * 1e6, 3
+                )
+
+        with logging_to(WARNING):
+            disabled_event_seconds = min(
+                time_per_item(
+                    lambda action: events.info("action_done", action=action), actions
+                )
+                for _ in range(repeat)
+            )
+            eager_seconds = min(
+                time_per_item(eager_messages, actions) for _ in range(repeat)
+            )
+            results["disabled_event_us"] = round(disabled_event_seconds * 1e6, 3)
+            results["disabled_events_per_action_us"] = round(
+                disabled_event_seconds * events_per_action * 1e6, 3
+            )
+            results["eager_formatting_per_action_us"] = round(eager_seconds * 1e6, 3)
+
+            payloads = [bytes(64 * ONE_KB)] * 1000
+            results["payload_eager_format_us"] = round(
+                time_per_item(
+                    lambda payload: "Sending string: {}".format(payload), payloads
+                )
+                * 1e6,
+                3,
+            )
+            results["payload_disabled_event_us"] = round(
+                time_per_item(
+                    lambda payload: events.debug("forward", size=len(payload)),
+                    payloads,
+                )
+                * 1e6,
+                3,
+            )
+
+        with logging_to(WARNING):
+            get_seconds = time_downloads(transfer_count)
+        results["download_off_us"] = round(get_seconds * 1e6, 3)
+        results["logging_off_overhead_percent"] = round(
+            100 * disabled_event_seconds * events_per_action / get_seconds, 3
+        )
+    return results
+
+
+def time_downloads(transfer_count):
+    """
+    :return: The seconds that downloading one 1KB file from an in-process server takes
+    """
+    with TemporaryDirectory() as server_dir, TemporaryDirectory() as local_dir:
+        write_tree(
+            server_dir,
+            (
+                ("/files/file_{:05d}.txt".format(num), ONE_KB)
+                for num in range(transfer_count)
+            ),
+        )
+        with LocalSFTPServer(server_dir) as server:
+            mirrorer = Mirrorer(
+                local_dir,
+                host=server.host,
+                port=server.port,
+                username="bench",
+                password="bench",
+            )
+            try:
+                mirrorer.load_remote_dir_listing("/")
+                os.makedirs(join(local_dir, "files"))
+                remote_tree = mirrorer.remote_attr_tree
+                actions = [
+                    SFTPAction(
+                        mirrorer,
+                        SFTPActionCodes.GET,
+                        remote_path,
+                        remote_entry=remote_tree[remote_path],
+                    )
+                    for remote_path in remote_tree.keys()
+                    if remote_path.endswith(".txt")
+                ]
+                return time_per_item(lambda action: action.run(), actions)
+            finally:
+                mirrorer.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, epilog=EPILOG)
+    parser.add_argument(
+        "--actions",
+        type=int,
+        default=100000,
+        help="The number of dry-run actions to time",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Time each case this many times, and keep the fastest",
+    )
+    parser.add_argument(
+        "--transfers",
+        type=int,
+        default=500,
+        help="The number of real downloads to compare the overhead of logging to",
+    )
+    args = parser.parse_args()
+    print(
+        json.dumps(run_benchmark(args.actions, args.transfers, args.repeat), indent=2)
+    )
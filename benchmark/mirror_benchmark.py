@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+"""
+Measures listing, planning and transfer throughput of whole mirrors, in both directions,
+  against an in-process SFTP server on a temporary directory, so no Docker or network is
+  needed. Each scenario generates a synthetic tree, mirrors it to an empty directory,
+  mirrors it again with nothing left to do, and does the same towards the server.
+  The results are JSON, to compare across commits.
+
+Example:
+    python -m benchmark.mirror_benchmark --scale 4 --output results.json
+"""
+
+import json
+import os
+import platform
+import subprocess
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+from os.path import dirname, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmark.sftp_server import LocalSFTPServer
+from durasftp.common import ONE_KB, ONE_MB
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.metrics import ConnectionMetrics
+from durasftp.common.sftp.mirrorer import Mirrorer
+from durasftp.common.sftp.profiler import RunProfiler
+
+EPILOG = __doc__
+
+logger = get_logger(__name__)
+
+
+def tiny_files(scale):
+    """
+    Many tiny files, where the per-file round trips dominate
+    """
+    for file_num in range(2000 * scale):
+        yield "/dir_{:03d}/file_{:05d}.txt".format(file_num % 50, file_num), 100
+
+
+def huge_files(scale):
+    """
+    A few huge files, where the throughput of a single transfer dominates
+    """
+    for file_num in range(3):
+        yield "/huge/file_{}.bin".format(file_num), 32 * ONE_MB * scale
+
+
+def deep_nesting(scale):
+    """
+    One small file in each directory of a single, very deep chain of directories
+    """
+    dir_path = ""
+    for depth in range(50 * scale):
+        dir_path += "/level_{:03d}".format(depth)
+        yield dir_path + "/file.txt", ONE_KB
+
+
+def wide_directories(scale):
+    """
+    Thousands of files in a single directory, where listing one directory dominates
+    """
+    for file_num in range(5000 * scale):
+        yield "/wide/file_{:06d}.csv".format(file_num), ONE_KB
+
+
+SCENARIOS = OrderedDict(
+    [
+        ("tiny_files", tiny_files),
+        ("huge_files", huge_files),
+        ("deep_nesting", deep_nesting),
+        ("wide_directories", wide_directories),
+    ]
+)
+
+
+def write_tree(base_dir, files):
+    """
+    Writes a synthetic tree below base_dir
+    :param files: The (relative path, size) of each file
+    :return: The number of files and bytes written
+    """
+    file_count = byte_count = 0
+    # Incompressible, but cheap to generate
+    block = os.urandom(ONE_MB)
+    for relative_path, size in files:
+        file_path = base_dir + relative_path
+        os.makedirs(dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as bench_file:
+            remaining = size
+            while remaining > 0:
+                remaining -= bench_file.write(block[: min(remaining, len(block))])
+        file_count += 1
+        byte_count += size
+    return file_count, byte_count
+
+
+def measure_run(mirrorer, run, **kwargs):
+    """
+    Runs one mirror, and summarizes its phases
+    :return: A dict of results
+    """
+    metrics = mirrorer.metrics
+    bytes_before = metrics.bytes_in + metrics.bytes_out
+    started_at = perf_counter()
+    run(**kwargs)
+    wall_seconds = perf_counter() - started_at
+    phases = OrderedDict(
+        (phase.name, round(phase.wall_seconds, 3)) for phase in mirrorer.profiler.phases
+    )
+    transfer_seconds = phases.get("do_actions", phases.get("pipeline", wall_seconds))
+    transferred_bytes = metrics.bytes_in + metrics.bytes_out - bytes_before
+    transferred_files = len(
+        mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.GET, SFTPActionCodes.PUT]
+        )
+    )
+    return OrderedDict(
+        [
+            ("wall_seconds", round(wall_seconds, 3)),
+            ("phases", phases),
+            ("files", transferred_files),
+            ("bytes", transferred_bytes),
+            (
+                "files_per_second",
+                round(transferred_files / max(transfer_seconds, 1e-9), 1),
+            ),
+            (
+                "mb_per_second",
+                round(transferred_bytes / ONE_MB / max(transfer_seconds, 1e-9), 3),
+            ),
+        ]
+    )
+
+
+def open_mirrorer(server, local_dir, workers, root="/", find_listing=False):
+    return Mirrorer(
+        local_dir,
+        host=server.host,
+        port=server.port,
+        username="bench",
+        password="bench",
+        workers=workers,
+        root=root,
+        profiler=RunProfiler(),
+        metrics=ConnectionMetrics(),
+        find_listing=find_listing,
+    )
+
+
+def run_scenario(
+    name, scale, workers, streaming, find_listing=False, bulk_download=False
+):
+    """
+    Mirrors a synthetic tree from the server to an empty directory and back again,
+      each followed by a mirror with nothing left to do
+    :return: A dict of results
+    """
+    results = OrderedDict([("scenario", name)])
+    with TemporaryDirectory() as server_dir, TemporaryDirectory() as download_dir:
+        with TemporaryDirectory() as upload_dir:
+            file_count, byte_count = write_tree(server_dir, SCENARIOS[name](scale))
+            results["files"] = file_count
+            results["bytes"] = byte_count
+            allow_exec = find_listing or bulk_download
+            with LocalSFTPServer(server_dir, allow_exec=allow_exec) as server:
+                mirrorer = open_mirrorer(
+                    server, download_dir, workers, find_listing=find_listing
+                )
+                try:
+                    for run_name in ["from_remote", "unchanged_from_remote"]:
+                        results[run_name] = measure_run(
+                            mirrorer,
+                            mirrorer.mirror_from_remote,
+                            streaming=streaming,
+                            bulk_download=bulk_download,
+                        )
+                finally:
+                    mirrorer.close()
+
+                # Uploads go to their own, empty directory on the server
+                write_tree(join(upload_dir, "upload"), SCENARIOS[name](scale))
+                os.mkdir(join(server_dir, "upload"))
+                mirrorer = open_mirrorer(
+                    server,
+                    upload_dir,
+                    workers,
+                    root="/upload",
+                    find_listing=find_listing,
+                )
+                try:
+                    for run_name in ["to_remote", "unchanged_to_remote"]:
+                        results[run_name] = measure_run(
+                            mirrorer,
+                            mirrorer.mirror_to_remote,
+                            streaming=streaming,
+                        )
+                finally:
+                    mirrorer.close()
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=dirname(__file__),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    scenario_names,
+    scale=1,
+    workers=4,
+    streaming=False,
+    find_listing=False,
+    bulk_download=False,
+):
+    results = []
+    for name in scenario_names:
+        logger.info("Running {}".format(name))
+        results.append(
+            run_scenario(name, scale, workers, streaming, find_listing, bulk_download)
+        )
+    return OrderedDict(
+        [
+            ("commit", current_commit()),
+            ("python", platform.python_version()),
+            ("scale", scale),
+            ("workers", workers),
+            ("streaming", streaming),
+            ("find_listing", find_listing),
+            ("bulk_download", bulk_download),
+            ("scenarios", results),
+        ]
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, epilog=EPILOG)
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="The synthetic trees to mirror",
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="Multiplies the number of files, or the size of the huge files",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="The number of files to transfer at the same time",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        default=False,
+        help="Mirror each directory as soon as it is listed",
+    )
+    parser.add_argument(
+        "--find-listing",
+        action="store_true",
+        default=False,
+        help="Let the server run exec commands, and list the remote tree with find",
+    )
+    parser.add_argument(
+        "--bulk-download",
+        action="store_true",
+        default=False,
+        help="Let the server run exec commands, and download small files as tar streams",
+    )
+    parser.add_argument(
+        "--output", help="A file to write the JSON results to, instead of stdout"
+    )
+    args = parser.parse_args()
+    results = json.dumps(
+        run_benchmark(
+            args.scenarios,
+            args.scale,
+            args.workers,
+            args.streaming,
+            args.find_listing,
+            args.bulk_download,
+        ),
+        indent=2,
+    )
+    if args.output is None:
+        print(results)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(results + "\n")
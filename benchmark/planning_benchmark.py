@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""
+Times and memory-profiles each step of planning a mirror, with no network, on synthetic
+  trees where most files are unchanged: building the stat trees, calculating the actions
+  path by path and with the diff engine, adding them to an SFTPActionList, and reading
+  them back with items() and filtered_items().
+
+Pass the JSON results of an earlier commit as --baseline to fail when any step got slower.
+
+Example:
+    python -m benchmark.planning_benchmark --entries 10000 100000 1000000 5000000 --output planning.json
+    python -m benchmark.planning_benchmark --baseline planning.json --tolerance 1.25
+"""
+
+import json
+import sys
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+
+from benchmark.diff_engine_benchmark import OfflineConnection, synthetic_trees
+from durasftp.common.sftp import diff_engine
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.action_list import SFTPActionList
+from durasftp.common.sftp.mirrorer import Mirrorer
+from durasftp.common.sftp.profiler import RunProfiler
+
+EPILOG = __doc__
+
+# Phases faster than this are too noisy to compare against a baseline
+MIN_COMPARED_SECONDS = 0.05
+
+
+def plan(mirrorer, profiler, entry_count, per_path=True):
+    """
+    Plans a mirror of synthetic trees of entry_count entries, recording each step as a phase
+    :return: The number of actions planned
+    """
+    with profiler.phase("build_trees"):
+        remote_tree, local_tree = synthetic_trees(entry_count)
+        mirrorer.remote_attr_tree = remote_tree
+        mirrorer.local_attr_tree = local_tree
+    if per_path:
+        with profiler.phase("plan_per_path"):
+            actions = [
+                mirrorer.action_from_remote_by_path(remote_path)
+                for remote_path in remote_tree.keys()
+            ]
+        del actions
+    if diff_engine.is_available():
+        with profiler.phase("plan_diff_engine"):
+            actions = list(mirrorer.actions_by_diff(from_remote=True))
+    else:
+        actions = [
+            mirrorer.action_from_remote_by_path(remote_path)
+            for remote_path in remote_tree.keys()
+        ]
+    action_list = SFTPActionList(mirrorer)
+    with profiler.phase("add_to_action_list"):
+        for action in actions:
+            if action is not None:
+                action_list.add(action)
+    del actions
+    with profiler.phase("items"):
+        items = action_list.items()
+    with profiler.phase("filtered_items"):
+        action_list.filtered_items(codes=[SFTPActionCodes.GET])
+    return len(items)
+
+
+def run_benchmark(entry_counts, trace_memory=False, per_path=True, repeat=3):
+    """
+    Plans each size repeat times, and keeps the fastest run of each phase, which is the one
+      least disturbed by the rest of the machine
+    """
+    results = []
+    with TemporaryDirectory() as local_dir:
+        mirrorer = Mirrorer(local_dir, conn=OfflineConnection())
+        for entry_count in entry_counts:
+            fastest_phases = OrderedDict()
+            for _ in range(repeat):
+                profiler = RunProfiler(trace_memory=trace_memory, top_allocators=3)
+                profiler.start_run("plan_{}".format(entry_count))
+                action_count = plan(mirrorer, profiler, entry_count, per_path)
+                profiler.finish_run()
+                for phase in profiler.to_dict()["phases"]:
+                    fastest = fastest_phases.get(phase["name"])
+                    if (
+                        fastest is None
+                        or phase["wall_seconds"] < fastest["wall_seconds"]
+                    ):
+                        fastest_phases[phase["name"]] = phase
+            results.append(
+                OrderedDict(
+                    [
+                        ("entries", entry_count),
+                        ("actions", action_count),
+                        ("repeat", repeat),
+                        ("phases", list(fastest_phases.values())),
+                    ]
+                )
+            )
+    return results
+
+
+def slower_phases(results, baseline, tolerance):
+    """
+    :return: A description of each phase that took more than tolerance times as long as in
+      the baseline, for the entry counts that both have
+    """
+    baseline_runs = {run["entries"]: run for run in baseline}
+    regressions = []
+    for run in results:
+        baseline_run = baseline_runs.get(run["entries"])
+        if baseline_run is None:
+            continue
+        baseline_seconds = {
+            phase["name"]: phase["wall_seconds"] for phase in baseline_run["phases"]
+        }
+        for phase in run["phases"]:
+            before = baseline_seconds.get(phase["name"])
+            if (
+                before is None
+                or max(before, phase["wall_seconds"]) < MIN_COMPARED_SECONDS
+            ):
+                continue
+            if phase["wall_seconds"] > before * tolerance:
+                regressions.append(
+                    "{} at {} entries: {:.3f}s, was {:.3f}s".format(
+                        phase["name"], run["entries"], phase["wall_seconds"], before
+                    )
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, epilog=EPILOG)
+    parser.add_argument(
+        "--entries",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="The number of entries in each synthetic tree",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        default=False,
+        help="Report the peak traced memory and top allocators of each step, which is much slower",
+    )
+    parser.add_argument(
+        "--skip-per-path",
+        action="store_true",
+        default=False,
+        help="Only plan with the diff engine, since planning millions of paths one by one takes minutes",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Plan each size this many times, and keep the fastest time of each step",
+    )
+    parser.add_argument(
+        "--output", help="A file to write the JSON results to, instead of stdout"
+    )
+    parser.add_argument(
+        "--baseline", help="The JSON results of an earlier run, to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="How many times slower than the baseline a step may get",
+    )
+    args = parser.parse_args()
+    results = run_benchmark(
+        args.entries,
+        trace_memory=args.trace_memory,
+        per_path=not args.skip_per_path,
+        repeat=args.repeat,
+    )
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = slower_phases(
+                results, json.load(baseline_file), args.tolerance
+            )
+        for regression in regressions:
+            print("Slower: {}".format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,274 @@
+"""
+A paramiko SFTP server that runs in-process, serving a local directory as its root, so that
+  mirrors can be benchmarked without Docker or a network. Any username and password is
+  accepted, and every remote path is resolved below the root directory. Exec requests are
+  refused unless allow_exec is set.
+
+Example:
+    with LocalSFTPServer(root_dir) as server:
+        mirrorer = Mirrorer(local_dir, host="127.0.0.1", port=server.port, username="bench", password="bench")
+"""
+
+import os
+import socket
+import subprocess
+from threading import Thread
+
+import paramiko
+from paramiko import (
+    AUTH_SUCCESSFUL,
+    OPEN_SUCCEEDED,
+    SFTP_FAILURE,
+    SFTP_OK,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+from durasftp.common import ONE_MB
+
+
+def sftp_errors(fn):
+    """
+    Answers the SFTP request with the error code of any OSError that the handler raises
+    """
+
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    return wrapper
+
+
+class AcceptEveryone(paramiko.ServerInterface):
+    def __init__(self, root_dir, allow_exec=False):
+        """
+        :param root_dir: The directory that exec commands start in
+        :param allow_exec: Run the commands of exec requests in a local shell, instead of
+          refusing them
+        """
+        self.root_dir = root_dir
+        self.allow_exec = allow_exec
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.allow_exec:
+            return False
+        Thread(
+            target=run_command, args=(channel, command, self.root_dir), daemon=True
+        ).start()
+        return True
+
+
+def run_command(channel, command, cwd):
+    """
+    Runs an exec request in a local shell, streaming its input and output over the channel
+    """
+    process = subprocess.Popen(
+        command.decode("utf-8"),
+        shell=True,
+        cwd=cwd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    Thread(target=forward_input, args=(channel, process), daemon=True).start()
+    try:
+        for chunk in iter(lambda: process.stdout.read1(ONE_MB), b""):
+            channel.sendall(chunk)
+        channel.sendall_stderr(process.stderr.read())
+        channel.send_exit_status(process.wait())
+    except OSError:
+        # The client went away
+        process.kill()
+    finally:
+        channel.close()
+
+
+def forward_input(channel, process):
+    try:
+        for chunk in iter(lambda: channel.recv(ONE_MB), b""):
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except OSError:
+        # The command exited without reading all of its input
+        pass
+
+
+class LocalFileHandle(SFTPHandle):
+    @sftp_errors
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    @sftp_errors
+    def chattr(self, attr):
+        SFTPServer.set_file_attr(self.filename, attr)
+        return SFTP_OK
+
+
+class RootedSFTPInterface(SFTPServerInterface):
+    """
+    Serves the files below one local directory, as if it were the root of the server
+    """
+
+    def __init__(self, server, root_dir):
+        super().__init__(server)
+        self.root_dir = root_dir.rstrip("/")
+
+    def local_path(self, remote_path):
+        return self.root_dir + self.canonicalize(remote_path)
+
+    @sftp_errors
+    def list_folder(self, path):
+        local_dir = self.local_path(path)
+        entries = []
+        for file_name in os.listdir(local_dir):
+            attrs = SFTPAttributes.from_stat(
+                os.lstat(os.path.join(local_dir, file_name))
+            )
+            attrs.filename = file_name
+            entries.append(attrs)
+        return entries
+
+    @sftp_errors
+    def stat(self, path):
+        return SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+
+    @sftp_errors
+    def lstat(self, path):
+        return SFTPAttributes.from_stat(os.lstat(self.local_path(path)))
+
+    @sftp_errors
+    def open(self, path, flags, attr):
+        local_path = self.local_path(path)
+        flags |= getattr(os, "O_BINARY", 0)
+        mode = getattr(attr, "st_mode", None)
+        fd = os.open(local_path, flags, 0o666 if mode is None else mode)
+        if (flags & os.O_CREAT) and attr is not None:
+            attr._flags &= ~attr.FLAG_PERMISSIONS
+            SFTPServer.set_file_attr(local_path, attr)
+        if flags & os.O_WRONLY:
+            file_mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            file_mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            file_mode = "rb"
+        handle = LocalFileHandle(flags)
+        handle.filename = local_path
+        handle.readfile = handle.writefile = os.fdopen(fd, file_mode)
+        return handle
+
+    @sftp_errors
+    def remove(self, path):
+        os.remove(self.local_path(path))
+        return SFTP_OK
+
+    @sftp_errors
+    def rename(self, oldpath, newpath):
+        if os.path.exists(self.local_path(newpath)):
+            return SFTP_FAILURE
+        os.rename(self.local_path(oldpath), self.local_path(newpath))
+        return SFTP_OK
+
+    @sftp_errors
+    def posix_rename(self, oldpath, newpath):
+        os.rename(self.local_path(oldpath), self.local_path(newpath))
+        return SFTP_OK
+
+    @sftp_errors
+    def mkdir(self, path, attr):
+        local_path = self.local_path(path)
+        os.mkdir(local_path)
+        if attr is not None:
+            SFTPServer.set_file_attr(local_path, attr)
+        return SFTP_OK
+
+    @sftp_errors
+    def rmdir(self, path):
+        os.rmdir(self.local_path(path))
+        return SFTP_OK
+
+    @sftp_errors
+    def chattr(self, path, attr):
+        SFTPServer.set_file_attr(self.local_path(path), attr)
+        return SFTP_OK
+
+    @sftp_errors
+    def symlink(self, target_path, path):
+        os.symlink(target_path, self.local_path(path))
+        return SFTP_OK
+
+    @sftp_errors
+    def readlink(self, path):
+        return os.readlink(self.local_path(path))
+
+
+class LocalSFTPServer:
+    """
+    Listens on a free port of 127.0.0.1, and serves each connection from its own threads
+    """
+
+    def __init__(self, root_dir, allow_exec=False):
+        """
+        :param root_dir: The local directory to serve as the root of the server
+        :param allow_exec: Run exec requests in a local shell that starts in root_dir, so
+          that they see the same tree as SFTP does, as long as they use relative paths
+        """
+        self.root_dir = root_dir
+        self.allow_exec = allow_exec
+        self.host = "127.0.0.1"
+        self.port = None
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._sock = None
+        self._transports = []
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, 0))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        Thread(target=self._accept_connections, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept_connections(self):
+        while True:
+            try:
+                client_sock, _ = self._sock.accept()
+            except OSError:
+                # Stopped
+                return
+            transport = paramiko.Transport(client_sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", SFTPServer, RootedSFTPInterface, self.root_dir
+            )
+            transport.start_server(
+                server=AcceptEveryone(self.root_dir, self.allow_exec)
+            )
+            self._transports.append(transport)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
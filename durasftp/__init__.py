@@ -1,4 +1,11 @@
 from durasftp.common.sftp.connection import DurableSFTPConnection
+from durasftp.common.sftp.filters import PathFilter
+from durasftp.common.sftp.hash_cache import HashCache
+from durasftp.common.sftp.journal import MirrorJournal
+from durasftp.common.sftp.listing_cache import ListingCache
+from durasftp.common.sftp.metadata_cache import MetadataCache
+from durasftp.common.sftp.metrics import ConnectionMetrics
 from durasftp.common.sftp.mirrorer import Mirrorer
+from durasftp.common.sftp.profiler import RunProfiler
 
 __version__ = "1.0.0"
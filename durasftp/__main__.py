@@ -4,9 +4,30 @@ CLI for durable SFTP communications
 """
 
 import os
+import sys
 from argparse import RawDescriptionHelpFormatter, ArgumentParser
 
-from durasftp import Mirrorer
+from durasftp import (
+    ConnectionMetrics,
+    HashCache,
+    ListingCache,
+    MetadataCache,
+    Mirrorer,
+    MirrorJournal,
+)
+from durasftp.common.log import add_logger_args
+from durasftp.common.sftp.filters import add_filter_args, path_filter_from_args
+from durasftp.common.sftp.hashing import (
+    COMPARE_MODES,
+    COMPARE_SIZE_MTIME,
+    HASH_COMMANDS,
+    VerifyStates,
+)
+from durasftp.common.sftp.profiler import (
+    add_profiler_args,
+    cprofiled,
+    profiler_from_args,
+)
 
 EPILOG = __doc__
 
@@ -21,15 +42,74 @@ def main(args):
     if args.password is not None:
         auth_args["password"] = args.password
 
+    listing_cache = None
+    if args.listing_cache is not None:
+        listing_cache = ListingCache(args.listing_cache, args.full_rescan_every)
+    hash_cache = None
+    if args.hash_cache is not None:
+        hash_cache = HashCache(args.hash_cache)
+    metadata_cache = None
+    if args.metadata_cache_ttl is not None:
+        metadata_cache = MetadataCache(ttl=args.metadata_cache_ttl)
+    metrics = None
+    if args.metrics_file is not None or args.metrics_port is not None:
+        metrics = ConnectionMetrics()
+    if args.metrics_port is not None:
+        metrics.serve_prometheus(args.metrics_port)
     mirrorer = Mirrorer(
         local_base=args.local_base,
         host=args.host,
         username=args.username,
         port=args.port,
         timeout=args.timeout,
+        workers=args.workers,
+        listing_cache=listing_cache,
+        root=args.root,
+        path_filter=path_filter_from_args(args),
+        segment_threshold=args.segment_threshold,
+        segment_connections=args.segment_connections,
+        channels=args.channels,
+        find_listing=args.find_listing,
+        compare=args.compare,
+        hash_cache=hash_cache,
+        detect_moves=args.detect_moves,
+        metadata_cache=metadata_cache,
+        health_check_interval=args.health_check_interval,
+        metrics=metrics,
+        profiler=profiler_from_args(args),
         **auth_args
     )
-    mirrorer.mirror_from_remote(lambda action: print(action), dry_run=args.dry_run)
+    journal = None if args.journal is None else MirrorJournal(args.journal)
+    with cprofiled(args.profile):
+        if args.resume:
+            mirrorer.resume(journal, lambda action: print(action), dry_run=args.dry_run)
+        else:
+            mirrorer.mirror_from_remote(
+                lambda action: print(action),
+                dry_run=args.dry_run,
+                streaming=args.streaming,
+                journal=journal,
+                bulk_download=args.bulk_download,
+            )
+    failed_paths = []
+    if args.verify:
+        for remote_path, state in mirrorer.verify(args.hash_algorithm).items():
+            if state != VerifyStates.MATCH:
+                print("{} {}".format(state, remote_path))
+            if state in VerifyStates.FAILED_STATES:
+                failed_paths.append(remote_path)
+    if args.profile_report is not None:
+        print(mirrorer.profiler.report(), file=sys.stderr)
+    if args.metrics_file is not None:
+        metrics.write_prometheus(args.metrics_file)
+    if journal is not None:
+        journal.close()
+    if listing_cache is not None:
+        listing_cache.close()
+    if hash_cache is not None:
+        hash_cache.close()
+    if failed_paths:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -47,11 +127,120 @@ if __name__ == "__main__":
     )
     parser.add_argument("--port", help="The remote SFTP port", type=int, default=22)
     parser.add_argument("--timeout", help="The connection timeout", type=int, default=5)
+    parser.add_argument(
+        "--workers",
+        help="The number of files to transfer at the same time, each over its own connection",
+        type=int,
+        default=1,
+    )
     parser.add_argument(
         "--dry-run",
         help="Do not actually do anything, only print the things that would have been done",
         action="store_true",
     )
+    parser.add_argument(
+        "--streaming",
+        help="Start transferring each directory as soon as it is listed, instead of listing everything first",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--journal",
+        help="An SQLite file to record the progress of the mirror in, so that it can be resumed",
+        type=str,
+    )
+    parser.add_argument(
+        "--resume",
+        help="Only finish the actions that the journal recorded as unfinished",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--listing-cache",
+        help="An SQLite file to keep directory listings in, so that unchanged directories are not listed again",
+        type=str,
+    )
+    parser.add_argument(
+        "--full-rescan-every",
+        help="List every directory again on every Nth run that uses the listing cache",
+        type=int,
+    )
+    parser.add_argument(
+        "--channels",
+        help="Multiplex the workers as SFTP channels over a single SSH connection, for servers that limit connections per user",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--find-listing",
+        action="store_true",
+        default=False,
+        help="List the remote tree with a single find command over exec, when the server allows it",
+    )
+    parser.add_argument(
+        "--bulk-download",
+        action="store_true",
+        default=False,
+        help="Download the small files of each directory as a single tar stream over exec, when the server allows it",
+    )
+    parser.add_argument(
+        "--compare",
+        help="Compare files by size and mtime, or by hashing the files of the same size on both sides",
+        choices=COMPARE_MODES,
+        default=COMPARE_SIZE_MTIME,
+    )
+    parser.add_argument(
+        "--hash-cache",
+        help="SQLite file to keep the hashes of local files in between runs",
+        type=str,
+    )
+    parser.add_argument(
+        "--detect-moves",
+        help="Rename the files that were moved on the remote, instead of downloading them again",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--verify",
+        help="Once the mirror is done, compare the contents of every file on both sides",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--hash-algorithm",
+        help="The hash algorithm to verify files with",
+        choices=sorted(HASH_COMMANDS),
+        default="sha1",
+    )
+    parser.add_argument(
+        "--metadata-cache-ttl",
+        help="Answer repeated stat and listing questions from memory, for this many seconds",
+        type=float,
+    )
+    parser.add_argument(
+        "--health-check-interval",
+        help="Check idle connections every this many seconds, and reconnect dead ones ahead of time",
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write connection metrics to this file in the Prometheus text format, once the mirror is done",
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve connection metrics in the Prometheus text format on this local port, while the mirror runs",
+        type=int,
+    )
+    parser.add_argument(
+        "--segment-threshold",
+        help="Transfer files of at least this many bytes in segments, over several connections at once",
+        type=int,
+    )
+    parser.add_argument(
+        "--segment-connections",
+        help="The most connections to transfer each segmented file over",
+        type=int,
+        default=4,
+    )
+    add_filter_args(parser)
+    add_profiler_args(parser)
+    add_logger_args(parser)
     parser.add_argument(
         "--username", help="The remote SFTP username", type=str, required=True
     )
@@ -64,4 +253,6 @@ if __name__ == "__main__":
     )
 
     parsed_arguments = parser.parse_args()
+    if parsed_arguments.resume and parsed_arguments.journal is None:
+        parser.error("--resume requires --journal")
     main(parsed_arguments)
@@ -20,7 +20,15 @@ def empty_dir(local_path):
 
 
 def generate_file_sha1(fetch_file_path, blocksize=2 ** 16):
-    m = hashlib.sha1()
+    return generate_file_hash(fetch_file_path, "sha1", blocksize)
+
+
+def generate_file_hash(fetch_file_path, algorithm="sha1", blocksize=2 ** 16):
+    """
+    :param algorithm: The name of a hashlib algorithm, such as "sha1" or "sha256"
+    :return: The hex digest of a local file
+    """
+    m = hashlib.new(algorithm)
     with open(fetch_file_path, "rb") as f:
         while True:
             buf = f.read(blocksize)
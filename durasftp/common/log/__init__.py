@@ -3,7 +3,8 @@ from argparse import ArgumentParser
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
 from os import environ
 
-from durasftp.common.log.log_formatter import LogFormatter
+from durasftp.common.log.events import EventLogger
+from durasftp.common.log.log_formatter import JsonLinesFormatter, LogFormatter
 
 NAME_TO_LOG_LEVEL = {
     "CRITICAL": CRITICAL,
@@ -18,9 +19,19 @@ FORMAT_STRING = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
 log_level_string = environ.get("LOG_LEVEL", "WARNING")
 log_level = NAME_TO_LOG_LEVEL[log_level_string]
 log_file_path = None
+# LOG_FORMAT=json writes one JSON object per line, for log shippers
+log_json = environ.get("LOG_FORMAT", "text").lower() == "json"
+
+
+def new_log_formatter():
+    if log_json:
+        return JsonLinesFormatter()
+    return LogFormatter(FORMAT_STRING)
+
+
 project_logger = logging.getLogger("mamba")
 project_handler = logging.StreamHandler()
-project_handler.setFormatter(LogFormatter(FORMAT_STRING))
+project_handler.setFormatter(new_log_formatter())
 for handler in project_logger.handlers:
     project_logger.removeHandler(handler)
 project_logger.addHandler(project_handler)
@@ -44,7 +55,7 @@ def set_log_file_path(new_log_file_path):
     for handler in project_logger.handlers:
         project_logger.removeHandler(handler)
     project_handler = logging.FileHandler(filename=log_file_path)
-    project_handler.setFormatter(LogFormatter(FORMAT_STRING))
+    project_handler.setFormatter(new_log_formatter())
     project_logger.addHandler(project_handler)
 
 
@@ -52,6 +63,16 @@ def get_log_file_path():
     return log_file_path
 
 
+def set_log_json(new_log_json):
+    global log_json
+    log_json = new_log_json
+    project_handler.setFormatter(new_log_formatter())
+
+
+def get_log_json():
+    return log_json
+
+
 def set_project_logger(new_project_logger):
     global project_logger
     project_logger = new_project_logger
@@ -62,8 +83,9 @@ def get_project_logger():
 
 
 def add_logger_args(parser):
-    from common.log.log_file_action import LogFileAction
-    from common.log.log_level_action import LogLevelAction
+    from durasftp.common.log.log_file_action import LogFileAction
+    from durasftp.common.log.log_json_action import LogJsonAction
+    from durasftp.common.log.log_level_action import LogLevelAction
 
     parser.add_argument(
         "-v",
@@ -78,6 +100,11 @@ def add_logger_args(parser):
         help="Less log output, -qqq for no logging",
     )
     parser.add_argument("--log-file", action=LogFileAction, help="Path for a log file")
+    parser.add_argument(
+        "--log-json",
+        action=LogJsonAction,
+        help="Write the logs as JSON lines, one object per record",
+    )
 
 
 def arg_parser_with_logs():
@@ -90,6 +117,13 @@ def get_logger(name):
     return logging.getLogger("mamba." + name)
 
 
+def get_event_logger(name):
+    """
+    :return: An EventLogger for structured, lazily formatted events, for the hot paths
+    """
+    return EventLogger(get_logger(name))
+
+
 if __name__ == "__main__":
     parser = arg_parser_with_logs()
     args = parser.parse_args()
@@ -0,0 +1,96 @@
+import json
+from collections import OrderedDict
+from logging import CRITICAL, DEBUG, ERROR, INFO, WARNING
+
+
+class Lazy:
+    """
+    A log field whose value is only computed if the event is actually written out:
+    Example:
+        events.debug("listing", entries=Lazy(lambda: len(attr_tree)))
+    """
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+class Event:
+    """
+    The message of a structured log record: an event name and its key/value fields.
+      Nothing is formatted until a handler formats the record, and values are rendered with
+      str() then, so objects such as actions can be passed as they are.
+    Example:
+        retry method=listdir delay=0.41 attempt=1 attempts=10 error="Socket is closed"
+    """
+
+    __slots__ = ("name", "fields", "_resolved_fields")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self._resolved_fields = None
+
+    def resolved_fields(self):
+        if self._resolved_fields is None:
+            self._resolved_fields = OrderedDict(
+                (key, value.fn() if isinstance(value, Lazy) else value)
+                for key, value in self.fields.items()
+            )
+        return self._resolved_fields
+
+    def __str__(self):
+        parts = [self.name]
+        for key, value in self.resolved_fields().items():
+            parts.append("{}={}".format(key, format_value(value)))
+        return " ".join(parts)
+
+
+def format_value(value):
+    """
+    Renders a field value as logfmt does, quoting it only when it would be ambiguous
+    """
+    text = value if isinstance(value, str) else str(value)
+    if text == "" or any(char in text for char in ' ="\n'):
+        return json.dumps(text)
+    return text
+
+
+class EventLogger:
+    """
+    Logs structured events on a standard logger. The level is checked before anything is
+      built, so a disabled event costs one method call and its keyword arguments.
+    """
+
+    __slots__ = ("logger",)
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def is_enabled_for(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, Event(event, fields), exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.log(DEBUG, Event(event, fields))
+
+    def info(self, event, **fields):
+        if self.logger.isEnabledFor(INFO):
+            self.logger.log(INFO, Event(event, fields))
+
+    def warning(self, event, **fields):
+        if self.logger.isEnabledFor(WARNING):
+            self.logger.log(WARNING, Event(event, fields))
+
+    def error(self, event, **fields):
+        if self.logger.isEnabledFor(ERROR):
+            self.logger.log(ERROR, Event(event, fields))
+
+    def critical(self, event, **fields):
+        if self.logger.isEnabledFor(CRITICAL):
+            self.logger.log(CRITICAL, Event(event, fields))
@@ -1,8 +1,12 @@
 import datetime
+import json
+from collections import OrderedDict
 from logging import Formatter
 
 import arrow
 
+from durasftp.common.log.events import Event
+
 LOCAL_TIMEZONE = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
 
 
@@ -22,3 +26,32 @@ class LogFormatter(Formatter):
         utc_timestamp = created_at.format("YYYY-MM-DDTHH:mm:ss") + "Z"
         local_timestamp = created_at_local.format("YYYY-MM-DDTHH:mm:ssZZ")
         return "[{}] [{}]".format(utc_timestamp, local_timestamp)
+
+
+class JsonLinesFormatter(Formatter):
+    """
+    This log formatter writes each record as one JSON object per line, with the fields of
+      structured events as keys of their own:
+    Example:
+        {"time": "2019-01-02T16:45:06.123Z", "level": "WARNING", "logger": "mamba.example", "event": "retry", "method": "listdir", "attempt": 1}
+    """
+
+    def format(self, record):
+        line = OrderedDict(
+            [
+                (
+                    "time",
+                    arrow.get(record.created).format("YYYY-MM-DDTHH:mm:ss.SSS") + "Z",
+                ),
+                ("level", record.levelname),
+                ("logger", record.name),
+            ]
+        )
+        if isinstance(record.msg, Event):
+            line["event"] = record.msg.name
+            line.update(record.msg.resolved_fields())
+        else:
+            line["message"] = record.getMessage()
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
@@ -0,0 +1,25 @@
+import argparse
+
+from durasftp.common.log import set_log_json
+
+
+class LogJsonAction(argparse.Action):
+    """
+    This argparse action allows for a command line argument to write the logs as JSON lines:
+    Example:
+      python <script> --log-json
+    """
+
+    def __init__(self, option_strings, dest, default=False, required=False, help=None):
+        super().__init__(
+            option_strings=option_strings,
+            dest=dest,
+            nargs=0,
+            default=default,
+            required=required,
+            help=help,
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        set_log_json(True)
+        setattr(namespace, self.dest, True)
@@ -0,0 +1,106 @@
+import errno
+import os
+import selectors
+import socket
+from collections import deque
+from time import monotonic
+
+from durasftp.common.log import get_logger
+
+logger = get_logger(__name__)
+
+# How long to wait for one address before also trying the next one, as recommended by RFC 8305
+ATTEMPT_DELAY = 0.25
+
+IN_PROGRESS_ERRORS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def resolve(host, port):
+    """
+    :return: The getaddrinfo results of every TCP address of a host, in the order to try them
+    """
+    return interleave_families(
+        socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    )
+
+
+def interleave_families(addresses):
+    """
+    Alternates between address families, starting with the family of the first address,
+      so that a broken IPv6 or IPv4 route only ever delays the other family by one attempt
+    """
+    families = {}
+    for address in addresses:
+        families.setdefault(address[0], deque()).append(address)
+    queues = list(families.values())
+    interleaved = []
+    while queues:
+        for queue in queues:
+            interleaved.append(queue.popleft())
+        queues = [queue for queue in queues if queue]
+    return interleaved
+
+
+def connect(addresses, timeout, attempt_delay=ATTEMPT_DELAY):
+    """
+    Connects to the first of several addresses to answer, Happy Eyeballs style. Each address
+      is tried attempt_delay seconds after the previous one, or as soon as the previous one
+      fails, and the attempts that are still pending once one succeeds are abandoned.
+    :param addresses: The getaddrinfo results to try, in order
+    :param timeout: The seconds to wait for any address to answer, which also becomes the
+      timeout of the connected socket
+    :param attempt_delay: The seconds to wait before also trying the next address
+    :return: A connected socket
+    :raises socket.timeout: If no address answered in time
+    :raises OSError: The error of the last address, if every address refused the connection
+    """
+    deadline = monotonic() + timeout
+    pending_addresses = deque(addresses)
+    attempts = {}
+    last_error = OSError("No addresses to connect to")
+    next_attempt_at = monotonic()
+    selector = selectors.DefaultSelector()
+    connected_sock = None
+    try:
+        while connected_sock is None:
+            now = monotonic()
+            if pending_addresses and (now >= next_attempt_at or not attempts):
+                family, sock_type, proto, _, sockaddr = pending_addresses.popleft()
+                sock = socket.socket(family, sock_type, proto)
+                sock.setblocking(False)
+                error_code = sock.connect_ex(sockaddr)
+                if error_code == 0:
+                    connected_sock = sock
+                    break
+                if error_code in IN_PROGRESS_ERRORS:
+                    attempts[sock] = sockaddr
+                    selector.register(sock, selectors.EVENT_WRITE)
+                else:
+                    last_error = OSError(error_code, os.strerror(error_code), sockaddr)
+                    sock.close()
+                next_attempt_at = monotonic() + attempt_delay
+                continue
+            if not attempts:
+                raise last_error
+            if now >= deadline:
+                raise socket.timeout("timed out")
+            wake_at = min(next_attempt_at, deadline) if pending_addresses else deadline
+            for key, _ in selector.select(max(wake_at - now, 0)):
+                sock = key.fileobj
+                selector.unregister(sock)
+                sockaddr = attempts.pop(sock)
+                error_code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error_code == 0:
+                    connected_sock = sock
+                    break
+                last_error = OSError(error_code, os.strerror(error_code), sockaddr)
+                sock.close()
+                # A failed attempt starts the next one at once
+                next_attempt_at = monotonic()
+    finally:
+        for sock in attempts:
+            sock.close()
+        selector.close()
+    connected_sock.setblocking(True)
+    connected_sock.settimeout(timeout)
+    return connected_sock
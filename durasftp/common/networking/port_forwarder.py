@@ -2,6 +2,7 @@
 
 import random
 import socket
+from logging import DEBUG
 from threading import Event
 from time import sleep
 
@@ -153,7 +154,6 @@ class ForwardingThread(StoppableThread):
                 and bytes_received
                 and self.server_socket.fileno() != -1
             ):
-                self.log_debug("Not stopped and socket is connected")
                 try:
                     bytes_received = self.client_socket.recv(self.packet_size)
                     if bytes_received:
@@ -161,12 +161,13 @@ class ForwardingThread(StoppableThread):
                             if self.kbps != INFINTE_SPEED:
                                 sleep(self.seconds_between_packets)
                             if not self.randomly_drop_packet():
-                                self.log_debug(
-                                    "Sending string: {}".format(bytes_received)
+                                # Formatting every payload costs more than sending it
+                                self.log_event(
+                                    DEBUG, "forward", size=len(bytes_received)
                                 )
                                 self.server_socket.sendall(bytes_received)
                             else:
-                                self.log_debug("Randomly dropped packet")
+                                self.log_event(DEBUG, "drop", size=len(bytes_received))
                 except socket.timeout as e:
                     self.log_debug("Timed out awaiting data")
                     bytes_received = b" "
@@ -1,14 +1,16 @@
 import signal
 import threading
+from logging import DEBUG, INFO
 from threading import Event, Lock
 
-from durasftp.common.log import get_logger
+from durasftp.common.log import get_event_logger, get_logger
 
 global_stop_event = Event()
 mutex = Lock()
 thread_count = 0
 
 logger = get_logger(__name__)
+events = get_event_logger(__name__)
 
 
 class StoppableThread(threading.Thread):
@@ -39,10 +41,24 @@ class StoppableThread(threading.Thread):
         return thread_is_stopped or program_is_stopped
 
     def log_info(self, msg):
-        logger.info("{}({}) {}".format(type(self).__name__, self.thread_num, msg))
+        if logger.isEnabledFor(INFO):
+            logger.info("{}({}) {}".format(type(self).__name__, self.thread_num, msg))
 
     def log_debug(self, msg):
-        logger.debug("{}({}) {}".format(type(self).__name__, self.thread_num, msg))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("{}({}) {}".format(type(self).__name__, self.thread_num, msg))
+
+    def log_event(self, level, event, **fields):
+        """
+        Logs a structured event tagged with this thread, only formatted if it is logged
+        """
+        if events.is_enabled_for(level):
+            events.log(
+                level,
+                event,
+                thread="{}({})".format(type(self).__name__, self.thread_num),
+                **fields
+            )
 
 
 def stop_all_threads(*args):
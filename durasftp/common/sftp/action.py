@@ -1,15 +1,28 @@
 from collections import OrderedDict
-from os import makedirs, remove
+from os import makedirs, remove, rename, stat as os_stat
 from shutil import rmtree
 from stat import S_ISDIR, S_ISREG
 
-from durasftp.common.log import get_logger
+from durasftp.common.log import get_event_logger
 from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.attr_tree import entry_attrs
+from durasftp.common.sftp.moves import fingerprint
 
-logger = get_logger(__name__)
+events = get_event_logger(__name__)
 
 
 class SFTPAction:
+    # Handlers are looked up by name when run, since millions of actions may be planned
+    HANDLER_NAMES = {
+        SFTPActionCodes.OK: "run_ok",
+        SFTPActionCodes.LMKDIR: "run_lmkdir",
+        SFTPActionCodes.GET: "run_get",
+        SFTPActionCodes.RMKDIR: "run_rmkdir",
+        SFTPActionCodes.PUT: "run_put",
+        SFTPActionCodes.LRENAME: "run_lrename",
+        SFTPActionCodes.RRENAME: "run_rrename",
+    }
+
     def __init__(
         self,
         mirrorer,
@@ -24,13 +37,6 @@ class SFTPAction:
         self.remote_path = remote_path
         self.local_path = mirrorer.local_path_from_remote(remote_path)
         self.kwargs = kwargs
-        self.handlers = {
-            SFTPActionCodes.OK: self.run_ok,
-            SFTPActionCodes.LMKDIR: self.run_lmkdir,
-            SFTPActionCodes.GET: self.run_get,
-            SFTPActionCodes.RMKDIR: self.run_rmkdir,
-            SFTPActionCodes.PUT: self.run_put,
-        }
         if local_entry is None:
             self.local_entry = None
             self.local_is_dir = False
@@ -53,67 +59,108 @@ class SFTPAction:
             self.remote_is_file = S_ISREG(self.remote_entry.st_mode)
             self.remote_exists = True
 
-    def run(self, callback=None, dry_run=False):
-        logger.info("Running: {}".format(self.__repr__()))
-        self.handlers[self.action_code](dry_run)
-        logger.info("Ran: {}".format(self.__repr__()))
+    def run(self, callback=None, dry_run=False, conn=None):
+        """
+        Performs the action
+        :param callback: Called with this action once it has been performed
+        :param dry_run: Only log what would have been done
+        :param conn: The connection to perform the action on, defaults to the mirrorer's connection
+        """
+        if conn is None:
+            conn = self.mirrorer.conn
+        # The action is only rendered with __repr__ if the event is written out
+        events.debug("action_start", action=self, dry_run=dry_run)
+        getattr(self, self.HANDLER_NAMES[self.action_code])(dry_run, conn)
+        events.info("action_done", action=self, dry_run=dry_run)
         if callback is not None:
-            logger.info("Running CB for: {}".format(self.__repr__()))
             callback(self)
-            logger.info("Ran CB for: {}".format(self.__repr__()))
+            events.debug("action_callback_done", action=self)
 
-    def run_ok(self, dry_run):
-        logger.debug("OK: {}".format(self.remote_path))
+    def run_ok(self, dry_run, conn):
+        events.debug("ok", path=self.remote_path)
 
-    def run_lmkdir(self, dry_run):
+    def run_lmkdir(self, dry_run, conn):
         if self.local_is_file:
-            logger.info("Removing: {}".format(self.local_path))
+            events.info("remove_local", path=self.local_path)
             if not dry_run:
                 remove(self.local_path)
-        logger.info("Making directory: {}".format(self.local_path))
+        events.info("mkdir_local", path=self.local_path)
         if not dry_run:
             makedirs(self.local_path, exist_ok=True)
 
-    def run_get(self, dry_run):
-        logger.info("run_get: {}".format(self.remote_path))
+    def run_get(self, dry_run, conn):
         if self.local_is_file:
-            logger.info("Removing: {}".format(self.local_path))
+            events.info("remove_local", path=self.local_path)
             if not dry_run:
                 remove(self.local_path)
         elif self.local_is_dir:
-            logger.info("Removing Directory: {}".format(self.local_path))
+            events.info("remove_local_dir", path=self.local_path)
             if not dry_run:
                 rmtree(self.local_path)
-        logger.info("Downloading: {}".format(self.remote_path))
+        events.info("download", path=self.remote_path)
         if not dry_run:
-            self.mirrorer.conn.get(
-                self.remote_path, self.local_path, preserve_mtime=True
+            self.mirrorer.download(
+                conn, self.remote_path, self.local_path, self.remote_entry.st_size
             )
 
-    def run_rmkdir(self, dry_run):
+    def run_rmkdir(self, dry_run, conn):
         if self.remote_is_file:
-            logger.info("Removing: {}".format(self.remote_path))
+            events.info("remove_remote", path=self.remote_path)
             if not dry_run:
-                self.mirrorer.conn.remove(self.remote_path)
-        logger.info("Making directory: {}".format(self.remote_path))
+                conn.remove(self.remote_path)
+        events.info("mkdir_remote", path=self.remote_path)
         if not dry_run:
-            self.mirrorer.conn.makedirs(self.remote_path)
+            conn.makedirs(self.remote_path)
 
-    def run_put(self, dry_run):
+    def run_put(self, dry_run, conn):
         if self.remote_is_file:
-            logger.info("Removing: {}".format(self.remote_path))
+            events.info("remove_remote", path=self.remote_path)
             if not dry_run:
-                self.mirrorer.conn.remove(self.remote_path)
+                conn.remove(self.remote_path)
         elif self.remote_is_dir:
-            logger.info("Removing Directory: {}".format(self.remote_path))
+            events.info("remove_remote_dir", path=self.remote_path)
             if not dry_run:
-                self.mirrorer.rmtree(self.remote_path)
-        logger.info("Downloading: {}".format(self.remote_path))
+                self.mirrorer.rmtree(self.remote_path, conn=conn)
+        events.info("upload", path=self.remote_path)
         if not dry_run:
-            self.mirrorer.conn.put(
-                self.local_path, self.remote_path, preserve_mtime=True
+            self.mirrorer.upload(
+                conn,
+                self.local_path,
+                self.remote_path,
+                entry_attrs(self.local_entry)[1],
             )
 
+    def run_lrename(self, dry_run, conn):
+        rename_from = self.kwargs["rename_from"]
+        local_source_path = self.mirrorer.local_path_from_remote(rename_from)
+        try:
+            moved_fingerprint = fingerprint(os_stat(local_source_path))
+        except FileNotFoundError:
+            moved_fingerprint = None
+        if moved_fingerprint != fingerprint(self.remote_entry):
+            # Changed or gone since it was listed, so it cannot stand in for the download
+            events.info("rename_stale", path=local_source_path)
+            self.run_get(dry_run, conn)
+            return
+        events.info("rename_local", path=self.local_path, source=local_source_path)
+        if not dry_run:
+            rename(local_source_path, self.local_path)
+
+    def run_rrename(self, dry_run, conn):
+        rename_from = self.kwargs["rename_from"]
+        try:
+            moved_fingerprint = fingerprint(conn.stat(rename_from))
+        except FileNotFoundError:
+            moved_fingerprint = None
+        if moved_fingerprint != fingerprint(self.local_entry):
+            # Changed or gone since it was listed, so it cannot stand in for the upload
+            events.info("rename_stale", path=rename_from)
+            self.run_put(dry_run, conn)
+            return
+        events.info("rename_remote", path=self.remote_path, source=rename_from)
+        if not dry_run:
+            conn.rename_into_place(rename_from, self.remote_path)
+
     def to_json(self):
         return self.to_dict()
 
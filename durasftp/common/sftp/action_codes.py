@@ -3,7 +3,9 @@ class SFTPActionCodes:
     RMKDIR = "RMKDIR"
     GET = "GET"
     PUT = "PUT"
+    LRENAME = "LRENAME"
+    RRENAME = "RRENAME"
     OK = "OK"
 
     DIR_ACTION_CODES = [LMKDIR, RMKDIR]
-    FILE_ACTION_CODES = [GET, PUT]
+    FILE_ACTION_CODES = [GET, PUT, LRENAME, RRENAME]
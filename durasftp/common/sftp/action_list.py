@@ -1,8 +1,12 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from operator import itemgetter
+from threading import Lock
 
 from durasftp.common.sftp.action import SFTPAction
 from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.bulk_download import BulkDownloader
+from durasftp.common.sftp.journal import ActionStates
 
 
 class SFTPActionList:
@@ -11,6 +15,7 @@ class SFTPActionList:
         self.ok_actions = OrderedDict()
         self.dir_actions = OrderedDict()
         self.file_actions = OrderedDict()
+        self.journal = None
 
     def add(self, action):
         if action.action_code == SFTPActionCodes.OK:
@@ -24,9 +29,101 @@ class SFTPActionList:
         action = SFTPAction(self.mirrorer, action_code, remote_path, **kwargs)
         self.add(action)
 
-    def do_actions(self, callback=None, dry_run=False):
+    def save(self, journal, from_remote):
+        """
+        Saves every action that changes something to a journal, and records the progress of
+          each of them there from now on
+        :param journal: The MirrorJournal to save to
+        :param from_remote: Whether the actions mirror the remote onto the local, or the other way
+        """
+        actions = [
+            action
+            for remote_path, action in self.items()
+            if action.action_code != SFTPActionCodes.OK
+        ]
+        journal.save_plan(self.mirrorer.local_base, from_remote, actions)
+        self.journal = journal
+
+    def run_action(self, action, callback=None, dry_run=False, conn=None):
+        """
+        Performs a single action, recording its progress in the journal if there is one
+        """
+        if self.journal is None or dry_run or action.action_code == SFTPActionCodes.OK:
+            action.run(callback=callback, dry_run=dry_run, conn=conn)
+            return
+        self.journal.mark(action.remote_path, ActionStates.IN_PROGRESS)
+        try:
+            action.run(callback=callback, dry_run=dry_run, conn=conn)
+        except Exception as e:
+            self.journal.mark(action.remote_path, ActionStates.FAILED, error=repr(e))
+            raise
+        self.journal.mark(action.remote_path, ActionStates.DONE)
+
+    def do_actions(self, callback=None, dry_run=False, workers=1, bulk_download=False):
+        """
+        Performs every action. Directory actions always finish before any file action starts,
+          file actions are spread over the mirrorer's connection pool when workers > 1
+        :param callback: Called with each action once it has been performed
+        :param dry_run: Only log what would have been done
+        :param workers: The number of file actions to run at the same time
+        :param bulk_download: Download the small files of each directory as a single tar
+          stream, when the server allows it, and everything else file by file
+        """
+        bulk_download = bulk_download and not dry_run
+        if workers <= 1 and not bulk_download:
+            for remote_path, action in self.items():
+                self.run_action(action, callback=callback, dry_run=dry_run)
+            return
+
+        file_actions = []
         for remote_path, action in self.items():
-            action.run(callback=callback, dry_run=dry_run)
+            if action.action_code in SFTPActionCodes.FILE_ACTION_CODES:
+                file_actions.append(action)
+            else:
+                self.run_action(action, callback=callback, dry_run=dry_run)
+        if bulk_download:
+            file_actions = BulkDownloader(self.mirrorer, journal=self.journal).run(
+                file_actions, callback=callback, workers=workers
+            )
+        if workers <= 1:
+            for action in file_actions:
+                self.run_action(action, callback=callback, dry_run=dry_run)
+            return
+        self.do_actions_concurrently(file_actions, callback, dry_run, workers)
+
+    def do_actions_concurrently(self, actions, callback, dry_run, workers):
+        """
+        Runs actions on a pool of threads, each borrowing its own connection from the mirrorer's pool.
+          Callbacks are never called concurrently. The first failure cancels the actions that have
+          not started yet, and is raised once the running actions are done.
+        """
+        callback_lock = Lock()
+
+        def locked_callback(action):
+            with callback_lock:
+                callback(action)
+
+        def run_pooled_action(action):
+            with self.mirrorer.pool.connection() as conn:
+                self.run_action(
+                    action,
+                    callback=None if callback is None else locked_callback,
+                    dry_run=dry_run,
+                    conn=conn,
+                )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_pooled_action, action) for action in actions]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+        for future in futures:
+            if (
+                future.done()
+                and not future.cancelled()
+                and future.exception() is not None
+            ):
+                raise future.exception()
 
     def items(self):
         sorted_ok_actions = sorted(self.ok_actions.items(), key=itemgetter(0))
@@ -0,0 +1,198 @@
+from array import array
+from stat import S_ISDIR, S_ISREG
+from sys import intern
+
+ROOT_INDEX = 0
+NO_PARENT = -1
+
+
+class AttrEntry:
+    """
+    A lightweight view of one path in an AttrTree. It offers the parts of both paramiko's
+      SFTPAttributes and os.DirEntry that the mirrorer relies on, so it can stand in for either.
+    """
+
+    __slots__ = ("filename", "st_mode", "st_size", "st_mtime")
+
+    def __init__(self, filename, st_mode, st_size, st_mtime):
+        self.filename = filename
+        self.st_mode = st_mode
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+
+    @property
+    def name(self):
+        return self.filename
+
+    def is_dir(self):
+        return S_ISDIR(self.st_mode)
+
+    def is_file(self):
+        return S_ISREG(self.st_mode)
+
+    def stat(self):
+        return self
+
+    def __repr__(self):
+        return "AttrEntry(filename={},st_mode={:o},st_size={},st_mtime={})".format(
+            self.filename, self.st_mode, self.st_size, self.st_mtime
+        )
+
+
+def entry_attrs(entry):
+    """
+    Reads the mode, size and mtime of an SFTPAttributes, os.DirEntry or AttrEntry
+    :return: A (mode, size, mtime) tuple, with zeros for anything that is unknown
+    """
+    if not hasattr(entry, "st_mode"):
+        # An os.DirEntry, which follows symlinks like is_dir() and is_file() do
+        try:
+            entry = entry.stat()
+        except OSError:
+            # A broken symlink is neither a file nor a directory
+            return 0, 0, 0.0
+    return entry.st_mode or 0, entry.st_size or 0, entry.st_mtime or 0.0
+
+
+def entry_name(entry):
+    """
+    Reads the name of an SFTPAttributes, os.DirEntry or AttrEntry
+    """
+    if hasattr(entry, "filename"):
+        return entry.filename
+    return entry.name
+
+
+class AttrTree:
+    """
+    A compact, insertion ordered mapping of remote paths to file attributes, meant to hold
+      millions of entries. Paths are stored as a prefix trie of interned name components,
+      and the mode, size and mtime of each path are kept in typed arrays, rather than
+      keeping a full path string and attributes object per path.
+    Lookups and iteration return AttrEntry views, which are built on demand.
+    """
+
+    def __init__(self):
+        self._names = [""]
+        self._parents = array("i", [NO_PARENT])
+        self._modes = array("I", [0])
+        self._sizes = array("q", [0])
+        self._mtimes = array("d", [0.0])
+        # Child lookup tables, only for nodes that have children: {node: {name: child node}}
+        self._children = {}
+        # The nodes that were set as keys, in insertion order
+        self._order = array("i")
+        self._is_key = bytearray(1)
+
+    def _find_node(self, path, create=False):
+        node = ROOT_INDEX
+        for name in path.split("/"):
+            if not name:
+                continue
+            children = self._children.get(node)
+            child = None if children is None else children.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = self._add_node(node, name)
+            node = child
+        return node
+
+    def _add_node(self, parent, name):
+        name = intern(name)
+        node = len(self._names)
+        self._names.append(name)
+        self._parents.append(parent)
+        self._modes.append(0)
+        self._sizes.append(0)
+        self._mtimes.append(0.0)
+        self._is_key.append(0)
+        self._children.setdefault(parent, {})[name] = node
+        return node
+
+    def _entry(self, node):
+        return AttrEntry(
+            self._names[node], self._modes[node], self._sizes[node], self._mtimes[node]
+        )
+
+    def _path(self, node, dir_paths=None):
+        parent = self._parents[node]
+        if parent == NO_PARENT:
+            return "/"
+        if dir_paths is not None and parent in dir_paths:
+            parent_path = dir_paths[parent]
+        else:
+            parent_path = self._path(parent)
+            if dir_paths is not None:
+                dir_paths[parent] = parent_path
+        if parent_path == "/":
+            return "/" + self._names[node]
+        return parent_path + "/" + self._names[node]
+
+    def set(self, path, st_mode, st_size, st_mtime):
+        """
+        Sets the attributes of a path, keeping its original position if it was already set
+        """
+        node = self._find_node(path, create=True)
+        self._modes[node] = st_mode
+        self._sizes[node] = st_size
+        self._mtimes[node] = st_mtime
+        if not self._is_key[node]:
+            self._is_key[node] = 1
+            self._order.append(node)
+
+    def __setitem__(self, path, entry):
+        self.set(path, *entry_attrs(entry))
+
+    def __getitem__(self, path):
+        node = self._find_node(path)
+        if node is None or not self._is_key[node]:
+            raise KeyError(path)
+        return self._entry(node)
+
+    def get(self, path, default=None):
+        node = self._find_node(path)
+        if node is None or not self._is_key[node]:
+            return default
+        return self._entry(node)
+
+    def entry_at(self, position):
+        """
+        Looks up the entry that was set at a given position, in insertion order
+        """
+        return self._entry(self._order[position])
+
+    def columns(self):
+        """
+        Exposes the raw arrays behind the tree, for bulk consumers like the diff engine
+        :return: The key nodes in insertion order, followed by the mode, size and mtime arrays,
+          which are indexed by node
+        """
+        return self._order, self._modes, self._sizes, self._mtimes
+
+    def __contains__(self, path):
+        node = self._find_node(path)
+        return node is not None and bool(self._is_key[node])
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        dir_paths = {}
+        for node in self._order:
+            yield self._path(node, dir_paths)
+
+    def values(self):
+        for node in self._order:
+            yield self._entry(node)
+
+    def items(self):
+        dir_paths = {}
+        for node in self._order:
+            yield self._path(node, dir_paths), self._entry(node)
+
+    def __repr__(self):
+        return "AttrTree({} paths)".format(len(self))
@@ -0,0 +1,192 @@
+import os
+import tarfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, normpath
+from threading import Lock
+
+from paramiko import SSHException
+
+from durasftp.common import ONE_MB
+from durasftp.common.log import get_event_logger, get_logger
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.connection import PARTIAL_SUFFIX, TRANSFER_CHUNK_SIZE
+from durasftp.common.sftp.journal import ActionStates
+
+logger = get_logger(__name__)
+events = get_event_logger(__name__)
+
+# Larger files gain little from sharing a stream, and are better resumed on their own
+BULK_MAX_FILE_SIZE = ONE_MB
+# Directories with fewer files to download than this are downloaded file by file
+BULK_MIN_FILES = 2
+# The most files in one tar stream, which bounds what a failure re-queues. Their names
+#   are all sent before the output is read, so they must fit in the channel's window.
+BULK_BATCH_FILES = 1000
+
+# Reads the NUL terminated names to archive from its input, as GNU tar and bsdtar can
+TAR_COMMAND = "tar -cf - --null -T -"
+
+
+def bulk_batches(actions, max_file_size=BULK_MAX_FILE_SIZE):
+    """
+    Groups the downloads of small files by directory, into batches to download together
+    :param actions: SFTPActions of any kind
+    :param max_file_size: The largest file to download in a batch
+    :return: The batches of GET actions, and the actions to run one by one
+    """
+    by_dir = OrderedDict()
+    singles = []
+    for action in actions:
+        if (
+            action.action_code == SFTPActionCodes.GET
+            and action.remote_is_file
+            and not action.local_is_dir
+            and action.remote_entry.st_size <= max_file_size
+        ):
+            by_dir.setdefault(dirname(action.remote_path), []).append(action)
+        else:
+            singles.append(action)
+    batches = []
+    for dir_actions in by_dir.values():
+        if len(dir_actions) < BULK_MIN_FILES:
+            singles.extend(dir_actions)
+            continue
+        for start in range(0, len(dir_actions), BULK_BATCH_FILES):
+            batches.append(dir_actions[start : start + BULK_BATCH_FILES])
+    return batches, singles
+
+
+class BulkDownloader:
+    """
+    Downloads the small files of each directory as a single tar stream run over exec,
+      and unpacks it on the fly, instead of opening, reading, closing and timestamping
+      each file with SFTP round trips of its own. It needs exec and tar on the server.
+    Whatever is not downloaded this way is left to be downloaded file by file: files
+      that changed since they were listed, and the rest of any batch that failed.
+    """
+
+    def __init__(self, mirrorer, journal=None, max_file_size=BULK_MAX_FILE_SIZE):
+        """
+        :param mirrorer: The Mirrorer whose connection pool to download over
+        :param journal: A MirrorJournal to mark each downloaded file as done in
+        :param max_file_size: The largest file to download in a batch
+        """
+        self.mirrorer = mirrorer
+        self.journal = journal
+        self.max_file_size = max_file_size
+        # Cleared once the server has shown that it cannot stream tars
+        self.available = True
+        self._callback_lock = Lock()
+
+    def run(self, actions, callback=None, workers=1):
+        """
+        Downloads the batches of small files among actions, several at the same time
+          when workers > 1, each over its own connection
+        :param actions: SFTPActions of any kind
+        :param callback: Called with each action once its file has been downloaded
+        :return: The actions that are left to run one by one
+        """
+        batches, singles = bulk_batches(actions, self.max_file_size)
+
+        def run_batch(batch):
+            if not self.available:
+                return batch
+            with self.mirrorer.pool.connection() as conn:
+                return self.download_batch(conn, batch, callback)
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for remaining in executor.map(run_batch, batches):
+                singles.extend(remaining)
+        return singles
+
+    def download_batch(self, conn, batch, callback=None):
+        """
+        Downloads one batch of files from the same directory as a single tar stream
+        :param conn: The connection to run tar over, which the caller holds
+        :return: The actions of the batch whose files were not downloaded
+        """
+        remote_dir = dirname(batch[0].remote_path)
+        pending = OrderedDict(
+            (basename(action.remote_path), action) for action in batch
+        )
+        try:
+            channel = conn.exec_command(TAR_COMMAND, cwd=remote_dir)
+        except SSHException as ex:
+            logger.warning(
+                "Downloading file by file, the server refused exec: {}".format(ex)
+            )
+            self.available = False
+            return batch
+        try:
+            # Relative to the directory, so that names starting with "-" are not options
+            channel.sendall(
+                b"".join(
+                    "./{}\0".format(file_name).encode("utf-8") for file_name in pending
+                )
+            )
+            channel.shutdown_write()
+            with tarfile.open(fileobj=channel.makefile("rb"), mode="r|") as tar:
+                for member in tar:
+                    action = pending.get(normpath(member.name))
+                    if (
+                        action is None
+                        or not member.isfile()
+                        or member.size != action.remote_entry.st_size
+                        or member.mtime != int(action.remote_entry.st_mtime)
+                    ):
+                        # Unexpected, or changed since it was listed
+                        continue
+                    self.extract(tar, member, action)
+                    del pending[normpath(member.name)]
+                    self.done(action, callback)
+        except tarfile.TarError as ex:
+            logger.warning(
+                "Downloading {} files of {} file by file, tar failed: {}".format(
+                    len(pending), remote_dir, ex
+                )
+            )
+            if len(pending) == len(batch):
+                # Nothing came through, so the server cannot stream tars at all
+                self.available = False
+        except (SSHException, EOFError, OSError) as ex:
+            logger.warning(
+                "Downloading {} files of {} file by file: {}".format(
+                    len(pending), remote_dir, ex
+                )
+            )
+        finally:
+            channel.close()
+        return list(pending.values())
+
+    def extract(self, tar, member, action):
+        """
+        Unpacks one file of the stream into a partial file next to its local path, and
+          moves it into place with the mtime that it has remotely
+        """
+        partial_path = action.local_path + PARTIAL_SUFFIX
+        member_file = tar.extractfile(member)
+        try:
+            with open(partial_path, "wb") as local_file:
+                while True:
+                    data = member_file.read(TRANSFER_CHUNK_SIZE)
+                    if not data:
+                        break
+                    local_file.write(data)
+        except BaseException:
+            # Unlike a partial GET, a partial file from a stream cannot be resumed
+            os.remove(partial_path)
+            raise
+        os.replace(partial_path, action.local_path)
+        os.utime(action.local_path, (member.mtime, member.mtime))
+        metrics = self.mirrorer.metrics
+        if metrics is not None:
+            metrics.add_bytes_in(member.size)
+        events.info("bulk_download", path=action.remote_path, size=member.size)
+
+    def done(self, action, callback):
+        if self.journal is not None:
+            self.journal.mark(action.remote_path, ActionStates.DONE)
+        if callback is not None:
+            with self._callback_lock:
+                callback(action)
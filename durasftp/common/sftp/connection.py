@@ -1,20 +1,99 @@
+import binascii
+import errno
+import json
+import os
+import posixpath
+import random
+import shlex
 import socket
+from collections import OrderedDict
+from contextlib import contextmanager
+from stat import S_ISDIR, S_ISREG
+from threading import RLock, Thread
+from weakref import WeakSet
+from time import monotonic, perf_counter, sleep
 
 import paramiko
 import pysftp
 from paramiko import SSHException
 from pysftp import ConnectionException
 
-from durasftp.common.log import get_logger
+from durasftp.common.log import get_event_logger, get_logger
+from durasftp.common.networking import happy_eyeballs
+from durasftp.common.sftp.exec_output import read_records
+from durasftp.common.sftp.hashing import (
+    CHECK_FILE_ATTEMPTS,
+    COMMAND_NOT_RUN,
+    HASH_BATCH_FILES,
+    HASH_COMMANDS,
+    HASH_IDLE_TIMEOUT,
+    hash_base_path,
+    hash_command,
+    parse_hash_record,
+    send_names,
+)
+from durasftp.common.sftp.health_monitor import HealthMonitor
+from durasftp.common.sftp.metadata_cache import (
+    LISTDIR,
+    LSTAT,
+    NOT_FOUND,
+    STAT,
+    cache_key_path,
+)
 
 logger = get_logger(__name__)
+events = get_event_logger(__name__)
+
+PARTIAL_SUFFIX = ".durasftp-partial"
+PARTIAL_STATE_SUFFIX = PARTIAL_SUFFIX + ".json"
+TRANSFER_CHUNK_SIZE = 32768
+
+
+def is_partial_path(path):
+    """
+    :return: True if the path is an unfinished transfer, left behind by an interrupted get or put
+    """
+    return path.endswith(PARTIAL_SUFFIX) or path.endswith(PARTIAL_STATE_SUFFIX)
+
+
+def backoff_delay(attempt_num, base, cap):
+    """
+    :param attempt_num: The number of the attempt that just failed, from 0
+    :param base: The seconds to wait before the second retry, doubled for every retry after
+    :param cap: The most seconds to ever wait
+    :return: The seconds to wait before retrying. The first retry is immediate, since most
+      failures are brief blips, and later waits are jittered so that connections which failed
+      together do not all retry at the same moment
+    """
+    if attempt_num == 0:
+        return 0
+    delay = min(cap, base * 2 ** (attempt_num - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
 def retry_on_fail(fn):
     def wrapper(self, *args, **kwargs):
+        # Keeps the health monitor from probing or reconnecting in the middle of an operation
+        with self._op_lock:
+            started_at = perf_counter()
+            failed = True
+            try:
+                result = retry(self, *args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.last_used_at = monotonic()
+                if self.metrics is not None:
+                    self.metrics.record_call(
+                        fn.__name__, perf_counter() - started_at, failed
+                    )
+
+    def retry(self, *args, **kwargs):
         for attempt_num in range(self.max_attempts):
+            # Channels that fail together on one transport only rebuild it once
+            generation = self.generation
             try:
-                logger.info("Running {}()".format(fn.__name__))
+                events.debug("call", method=fn.__name__)
                 return fn(self, *args, **kwargs)
             except (
                 AttributeError,
@@ -23,21 +102,61 @@ def retry_on_fail(fn):
                 socket.gaierror,
                 socket.timeout,
             ) as ex:
-                logger.warning(ex)
                 if attempt_num == self.max_attempts - 1:
-                    logger.error(
-                        "Failed {}(), attempt {} of {}".format(
-                            fn.__name__, attempt_num, self.max_attempts
-                        )
+                    events.error(
+                        "call_failed",
+                        method=fn.__name__,
+                        attempt=attempt_num,
+                        attempts=self.max_attempts,
+                        error=ex,
                     )
                     raise ex
                 else:
-                    logger.warning(
-                        "Retrying {}(), attempt {} of {}".format(
-                            fn.__name__, attempt_num, self.max_attempts
-                        )
+                    delay = backoff_delay(
+                        attempt_num, self.backoff_base, self.backoff_cap
+                    )
+                    events.warning(
+                        "retry",
+                        method=fn.__name__,
+                        delay=round(delay, 2),
+                        attempt=attempt_num,
+                        attempts=self.max_attempts,
+                        error=ex,
                     )
-                    self.reconnect()
+                    if self.metrics is not None:
+                        self.metrics.record_retry(fn.__name__)
+                    sleep(delay)
+                    reconnect(self, generation, attempt_num)
+            except (EOFError, OSError):
+                if attempt_num == self.max_attempts - 1:
+                    raise
+                if generation != self.transport_generation():
+                    # Another channel rebuilt the transport while this one was using it
+                    event_name = "transport_replaced"
+                elif self.transport_lost():
+                    # The shared transport died, and this channel is the first to notice
+                    event_name = "transport_lost"
+                else:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.record_retry(fn.__name__)
+                events.warning(
+                    event_name,
+                    method=fn.__name__,
+                    attempt=attempt_num,
+                    attempts=self.max_attempts,
+                )
+                if event_name == "transport_lost":
+                    reconnect(self, generation, attempt_num)
+
+    def reconnect(self, generation, attempt_num):
+        try:
+            self.reconnect(generation)
+        except (ConnectionException, SSHException, EOFError, OSError):
+            # Leave the remaining attempts to wait out the outage
+            if attempt_num == self.max_attempts - 2:
+                raise
+            events.warning("reconnect_failed", method=fn.__name__)
 
     return wrapper
 
@@ -57,7 +176,29 @@ class DurableSFTPConnection(pysftp.Connection):
         default_path=None,
         timeout=15,
         max_attempts=3,
+        resume_check_size=0,
+        backoff_base=0.5,
+        backoff_cap=30,
+        metadata_cache=None,
+        health_check_interval=None,
+        health_check_timeout=2,
+        metrics=None,
     ):
+        """
+        :param timeout: The socket timeout, in seconds
+        :param max_attempts: The number of times to attempt each operation, reconnecting in between
+        :param resume_check_size: The number of bytes to compare before resuming a transfer
+        :param backoff_base: The seconds to wait before the second retry, doubled for every
+          retry after, the first retry is immediate
+        :param backoff_cap: The most seconds to wait between retries
+        :param metadata_cache: A MetadataCache to answer stat, exists, isdir, isfile and
+          listdir_attr from, which can be shared with other connections
+        :param health_check_interval: The seconds of idleness after which to check that the
+          server still answers, and reconnect ahead of time if it doesn't, None to never check
+        :param health_check_timeout: The seconds after which a health check counts as stalled
+        :param metrics: A ConnectionMetrics to count calls, latencies, retries, reconnects and
+          bytes in, which can be shared with other connections
+        """
         logger.debug("New SFTPConnection for sftp://{}:{}".format(host, port))
         self._timeout = timeout
         self._sock = None
@@ -67,6 +208,35 @@ class DurableSFTPConnection(pysftp.Connection):
         self.password = password
         self.private_key = private_key
         self.private_key_pass = private_key_pass
+        self.resume_check_size = resume_check_size
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.metadata_cache = metadata_cache
+        self.metrics = metrics
+        # Resolved once, reconnects reuse them until none of them answers
+        self._addresses = None
+        # The seconds that each phase of the last connect took
+        self.connect_timings = OrderedDict()
+        # The local (size, mtime) of each upload in progress, keyed by remote partial path
+        self._partial_puts = {}
+        # Counts the transports this connection has built, so channels can tell a stale one
+        self.generation = 0
+        self._reconnect_lock = RLock()
+        # Held for the duration of each operation
+        self._op_lock = RLock()
+        self.last_used_at = monotonic()
+        # Set when a health check stalls or fails, until the connection is rebuilt
+        self.suspect = False
+        # Cleared once the server has shown that it cannot hash files that way
+        self.exec_hashing = True
+        self.check_file_hashing = True
+        self._check_file_failures = 0
+        self._check_file_hashed = False
+        self.health_check_interval = health_check_interval
+        self.health_monitor = None
+        self.channels = WeakSet()
+        # Set once channels run on this transport, so that its death is rebuilt, not raised
+        self.shares_transport = False
         super().__init__(
             host,
             username,
@@ -80,12 +250,25 @@ class DurableSFTPConnection(pysftp.Connection):
             default_path,
         )
         self.timeout = self._timeout
+        if health_check_interval is not None:
+            self._transport.set_keepalive(health_check_interval)
+            self.health_monitor = HealthMonitor(
+                self, health_check_interval, health_check_timeout
+            )
+            self.health_monitor.start()
 
     def _start_transport(self, host, port):
-        """start the transport and set the ciphers if specified."""
-
+        """
+        Connects to the first address of the host to answer, and starts the transport on it.
+          The host is only resolved again once none of its addresses answers.
+        """
+        self._sock = None
         try:
-            self._sock = socket.create_connection((host, port), self._timeout)
+            with self._timed("resolve"):
+                if self._addresses is None:
+                    self._addresses = happy_eyeballs.resolve(host, port)
+            with self._timed("connect"):
+                self._sock = happy_eyeballs.connect(self._addresses, self._timeout)
             self._transport = paramiko.Transport(self._sock)
             # Set security ciphers if set
             if self._cnopts.ciphers is not None:
@@ -100,21 +283,108 @@ class DurableSFTPConnection(pysftp.Connection):
         ) as ex:
             # couldn't connect
             logger.critical(ex)
+            # The host may have moved
+            self._addresses = None
             if isinstance(self._sock, socket.socket):
                 self._sock.close()
             raise ConnectionException(host, port)
 
-    def reconnect(self):
-        logger.warning("Reconnecting sftp://{}:{}".format(self.host, self.port))
-        # Begin the SSH transport.
-        self.close()
-        self._transport = None
-        self._start_transport(self.host, self.port)
-        self._transport.use_compression(self._cnopts.compression)
-        self._set_authentication(self.password, self.private_key, self.private_key_pass)
-        self._transport.connect(**self._tconnect)
+    def reconnect(self, generation=None):
+        """
+        Builds a new transport and SFTP session
+        :param generation: The generation of the transport that failed. If the transport has
+          been rebuilt since, by another channel that failed at the same time, nothing is done
+        """
+        with self._reconnect_lock:
+            if generation is not None and generation != self.generation:
+                logger.info(
+                    "Already reconnected sftp://{}:{}".format(self.host, self.port)
+                )
+                return
+            logger.warning("Reconnecting sftp://{}:{}".format(self.host, self.port))
+            started_at = perf_counter()
+            self.connect_timings = OrderedDict()
+            # Begin the SSH transport, without stopping the health monitor
+            super().close()
+            self._transport = None
+            self._start_transport(self.host, self.port)
+            self._transport.use_compression(self._cnopts.compression)
+            self._set_authentication(
+                self.password, self.private_key, self.private_key_pass
+            )
+            with self._timed("login"):
+                self._transport.connect(**self._tconnect)
+            if self.health_check_interval is not None:
+                self._transport.set_keepalive(self.health_check_interval)
+            self.generation += 1
+            with self._timed("sftp"):
+                self._sftp_connect()
+            self.timeout = self._timeout
+            self.suspect = False
+            reconnect_seconds = perf_counter() - started_at
+            if self.metrics is not None:
+                self.metrics.record_reconnect(reconnect_seconds)
+            logger.info(
+                "Reconnected sftp://{}:{} in {:.3f}s ({})".format(
+                    self.host,
+                    self.port,
+                    reconnect_seconds,
+                    ", ".join(
+                        "{} {:.3f}s".format(phase, seconds)
+                        for phase, seconds in self.connect_timings.items()
+                    ),
+                )
+            )
+
+    def _set_authentication(self, password, private_key, private_key_pass):
+        """
+        Reads and parses the private key file the first time only, reconnects reuse the parsed key
+        """
+        if self._tconnect["pkey"] is None:
+            super()._set_authentication(password, private_key, private_key_pass)
+
+    @contextmanager
+    def _timed(self, phase):
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.connect_timings[phase] = perf_counter() - started_at
+
+    def transport_generation(self):
+        """
+        :return: The generation of the transport that is currently open
+        """
+        return self.generation
+
+    def transport_lost(self):
+        """
+        :return: Whether an EOFError or OSError came from a transport that channels share,
+          and that has died, so that it should be rebuilt for all of them. Without channels,
+          a dead transport is raised as it always was.
+        """
+        return self.shares_transport and (
+            self._transport is None or not self._transport.is_active()
+        )
+
+    def open_channel(self):
+        """
+        Opens another SFTP session on this connection's transport, which saves a TCP connection,
+          a key exchange and an authentication, and counts as a single connection to the server
+        :rtype: DurableSFTPChannel
+        """
+        channel = DurableSFTPChannel(self)
+        # Lets the health monitor tell when the transport is idle
+        self.channels.add(channel)
+        self.shares_transport = True
+        return channel
+
+    def probe(self):
+        """
+        A cheap round trip to the server, without any retries, for the health monitor
+        """
         self._sftp_connect()
-        self.timeout = self._timeout
+        self._sftp.normalize(".")
 
     @retry_on_fail
     def pwd(self):
@@ -122,7 +392,115 @@ class DurableSFTPConnection(pysftp.Connection):
 
     @retry_on_fail
     def get(self, remotepath, localpath=None, callback=None, preserve_mtime=False):
-        return super().get(remotepath, localpath, callback, preserve_mtime)
+        """
+        Downloads into a partial file next to localpath, and moves it into place once complete.
+          If the download is interrupted, the retry continues from the end of the partial file,
+          as long as the size and mtime of the remote file have not changed.
+        """
+        if not localpath:
+            localpath = os.path.split(remotepath)[1]
+        self._sftp_connect()
+        remote_attrs = self._sftp.stat(remotepath)
+        file_size = remote_attrs.st_size
+        partial_path = localpath + PARTIAL_SUFFIX
+        state_path = localpath + PARTIAL_STATE_SUFFIX
+        source_state = {"size": file_size, "mtime": remote_attrs.st_mtime}
+
+        offset = self._get_resume_offset(
+            remotepath, partial_path, state_path, source_state
+        )
+        if offset == 0:
+            with open(state_path, "w") as state_file:
+                json.dump(source_state, state_file)
+
+        with self._sftp.open(remotepath, "rb") as remote_file:
+            with open(partial_path, "ab" if offset else "wb") as local_file:
+                remote_file.seek(offset)
+                remote_file.prefetch(file_size)
+                while True:
+                    data = remote_file.read(TRANSFER_CHUNK_SIZE)
+                    if not data:
+                        break
+                    local_file.write(data)
+                    offset += len(data)
+                    if self.metrics is not None:
+                        self.metrics.add_bytes_in(len(data))
+                    if callback is not None:
+                        callback(offset, file_size)
+
+        os.replace(partial_path, localpath)
+        os.remove(state_path)
+        if preserve_mtime:
+            os.utime(localpath, (remote_attrs.st_atime, remote_attrs.st_mtime))
+
+    def _get_resume_offset(self, remotepath, partial_path, state_path, source_state):
+        """
+        :return: The offset to continue an interrupted download from, or 0 to start over
+        """
+        if not os.path.isfile(partial_path):
+            return 0
+        offset = os.stat(partial_path).st_size
+        try:
+            with open(state_path) as state_file:
+                recorded_state = json.load(state_file)
+        except (OSError, ValueError):
+            recorded_state = None
+        if recorded_state != source_state or offset > source_state["size"]:
+            logger.warning("Remote changed, restarting download: {}".format(remotepath))
+            return 0
+        if self.resume_check_size and offset:
+            check_size = min(self.resume_check_size, offset)
+            with open(partial_path, "rb") as local_file:
+                local_file.seek(offset - check_size)
+                local_overlap = local_file.read(check_size)
+            with self._sftp.open(remotepath, "rb") as remote_file:
+                remote_file.seek(offset - check_size)
+                remote_overlap = remote_file.read(check_size)
+            if local_overlap != remote_overlap:
+                logger.warning(
+                    "Overlap differs, restarting download: {}".format(remotepath)
+                )
+                return 0
+        logger.info("Resuming download of {} at byte {}".format(remotepath, offset))
+        return offset
+
+    @retry_on_fail
+    def get_range(self, remotepath, localpath, offset, length, callback=None):
+        """
+        Downloads one byte range of a remote file into the same range of an existing local file.
+          A retry downloads the whole range again, so ranges should be kept reasonably small.
+        :param remotepath: The remote file to read from
+        :param localpath: The local file to write into, which must already exist
+        :param offset: The first byte of the range
+        :param length: The number of bytes in the range
+        :param callback: Called with the bytes downloaded so far and the length of the range
+        :return: The number of bytes written
+        """
+        self._sftp_connect()
+        end = offset + length
+        transferred = 0
+        with self._sftp.open(remotepath, "rb") as remote_file:
+            with open(localpath, "r+b") as local_file:
+                remote_file.seek(offset)
+                local_file.seek(offset)
+                remote_file.prefetch(end)
+                while transferred < length:
+                    data = remote_file.read(
+                        min(TRANSFER_CHUNK_SIZE, length - transferred)
+                    )
+                    if not data:
+                        raise IOError(
+                            "Unexpected end of {} at byte {}".format(
+                                remotepath, offset + transferred
+                            )
+                        )
+                    local_file.write(data)
+                    transferred += len(data)
+                    if self.metrics is not None:
+                        self.metrics.add_bytes_in(len(data))
+                    if callback is not None:
+                        callback(transferred, length)
+        return transferred
 
     @retry_on_fail
     def get_d(self, remotedir, localdir, preserve_mtime=False):
@@ -145,23 +523,393 @@ class DurableSFTPConnection(pysftp.Connection):
         confirm=True,
         preserve_mtime=False,
     ):
-        return super().put(localpath, remotepath, callback, confirm, preserve_mtime)
+        """
+        Uploads into a partial file next to remotepath, and renames it into place once complete.
+          If the upload is interrupted, the retry continues from the end of the remote partial file,
+          as long as the size and mtime of the local file have not changed.
+        """
+        if not remotepath:
+            remotepath = os.path.split(localpath)[1]
+        self._sftp_connect()
+        local_stat = os.stat(localpath)
+        file_size = local_stat.st_size
+        partial_path = remotepath + PARTIAL_SUFFIX
+        source_state = (file_size, local_stat.st_mtime)
+
+        self._invalidate(partial_path)
+        self._invalidate(remotepath)
+        offset = self._put_resume_offset(localpath, partial_path, source_state)
+        self._partial_puts[partial_path] = source_state
+
+        with open(localpath, "rb") as local_file:
+            with self._sftp.open(
+                partial_path, "r+b" if offset else "wb"
+            ) as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.seek(offset)
+                local_file.seek(offset)
+                while True:
+                    data = local_file.read(TRANSFER_CHUNK_SIZE)
+                    if not data:
+                        break
+                    remote_file.write(data)
+                    offset += len(data)
+                    if self.metrics is not None:
+                        self.metrics.add_bytes_out(len(data))
+                    if callback is not None:
+                        callback(offset, file_size)
+
+        if confirm:
+            partial_size = self._sftp.stat(partial_path).st_size
+            if partial_size != file_size:
+                raise IOError(
+                    "size mismatch in put!  {} != {}".format(partial_size, file_size)
+                )
+        self._rename_into_place(partial_path, remotepath)
+        del self._partial_puts[partial_path]
+        if preserve_mtime:
+            self._sftp.utime(remotepath, (local_stat.st_atime, local_stat.st_mtime))
+        self._invalidate(partial_path)
+        self._invalidate(remotepath)
+        return self._sftp.stat(remotepath)
+
+    def _put_resume_offset(self, localpath, partial_path, source_state):
+        """
+        :return: The offset to continue an interrupted upload from, or 0 to start over
+        """
+        try:
+            offset = self._sftp.stat(partial_path).st_size
+        except IOError:
+            return 0
+        recorded_state = self._partial_puts.get(partial_path)
+        if offset > source_state[0]:
+            return 0
+        if recorded_state is None and not self.resume_check_size:
+            # Without an overlap check, only trust partial files that this connection wrote
+            return 0
+        if recorded_state is not None and recorded_state != source_state:
+            logger.warning("Local changed, restarting upload: {}".format(localpath))
+            return 0
+        if self.resume_check_size and offset:
+            check_size = min(self.resume_check_size, offset)
+            with open(localpath, "rb") as local_file:
+                local_file.seek(offset - check_size)
+                local_overlap = local_file.read(check_size)
+            with self._sftp.open(partial_path, "rb") as remote_file:
+                remote_file.seek(offset - check_size)
+                remote_overlap = remote_file.read(check_size)
+            if local_overlap != remote_overlap:
+                logger.warning(
+                    "Overlap differs, restarting upload: {}".format(localpath)
+                )
+                return 0
+        logger.info("Resuming upload of {} at byte {}".format(localpath, offset))
+        return offset
+
+    @retry_on_fail
+    def put_range(self, localpath, remotepath, offset, length, callback=None):
+        """
+        Uploads one byte range of a local file into the same range of an existing remote file.
+          A retry uploads the whole range again, so ranges should be kept reasonably small.
+        :param localpath: The local file to read from
+        :param remotepath: The remote file to write into, which must already exist
+        :param offset: The first byte of the range
+        :param length: The number of bytes in the range
+        :param callback: Called with the bytes uploaded so far and the length of the range
+        :return: The number of bytes written
+        """
+        self._sftp_connect()
+        self._invalidate(remotepath)
+        transferred = 0
+        with open(localpath, "rb") as local_file:
+            with self._sftp.open(remotepath, "r+b") as remote_file:
+                remote_file.set_pipelined(True)
+                local_file.seek(offset)
+                remote_file.seek(offset)
+                while transferred < length:
+                    data = local_file.read(
+                        min(TRANSFER_CHUNK_SIZE, length - transferred)
+                    )
+                    if not data:
+                        raise IOError(
+                            "Unexpected end of {} at byte {}".format(
+                                localpath, offset + transferred
+                            )
+                        )
+                    remote_file.write(data)
+                    transferred += len(data)
+                    if self.metrics is not None:
+                        self.metrics.add_bytes_out(len(data))
+                    if callback is not None:
+                        callback(transferred, length)
+        return transferred
+
+    @retry_on_fail
+    def create_sized(self, remotepath, size):
+        """
+        Creates an empty remote file of the given size, replacing any file at that path
+        """
+        self._sftp_connect()
+        try:
+            with self._sftp.open(remotepath, "wb"):
+                pass
+            self._sftp.truncate(remotepath, size)
+        finally:
+            self._invalidate(remotepath)
+
+    @retry_on_fail
+    def rename_into_place(self, remote_src, remote_dest):
+        """
+        Renames a remote file, replacing anything at the destination
+        """
+        self._sftp_connect()
+        try:
+            self._rename_into_place(remote_src, remote_dest)
+        finally:
+            self._invalidate(remote_src)
+            self._invalidate(remote_dest, recursive=True)
+
+    @retry_on_fail
+    def utime(self, remotepath, times):
+        """
+        Sets the access and modified times of a remote file
+        :param times: An (atime, mtime) tuple
+        """
+        self._sftp_connect()
+        try:
+            self._sftp.utime(remotepath, times)
+        finally:
+            self._invalidate(remotepath)
+
+    def _rename_into_place(self, remote_src, remote_dest):
+        """
+        Renames a remote file, replacing anything at the destination
+        """
+        try:
+            self._sftp.posix_rename(remote_src, remote_dest)
+        except IOError:
+            # The server does not support the posix-rename@openssh.com extension
+            try:
+                self._sftp.remove(remote_dest)
+            except IOError:
+                pass
+            self._sftp.rename(remote_src, remote_dest)
+
+    def _cache_key_path(self, remotepath):
+        """
+        :return: The path to cache remotepath under, or None if it can't be cached
+        """
+        if self.metadata_cache is None:
+            return None
+        return cache_key_path(remotepath)
+
+    def _cached_attrs(self, kind, remotepath, fetch):
+        """
+        :param kind: STAT or LSTAT
+        :param fetch: Asks the server for the attributes of remotepath, when they are not cached
+        :return: The SFTPAttributes of remotepath
+        """
+        key_path = self._cache_key_path(remotepath)
+        if key_path is None:
+            return fetch(remotepath)
+        attrs = self.metadata_cache.get(kind, key_path)
+        if attrs is NOT_FOUND:
+            raise FileNotFoundError(errno.ENOENT, "No such file", remotepath)
+        if attrs is None:
+            try:
+                attrs = fetch(remotepath)
+            except FileNotFoundError:
+                self.metadata_cache.put(kind, key_path, NOT_FOUND)
+                raise
+            self.metadata_cache.put(kind, key_path, attrs)
+        return attrs
+
+    def _cached_attrs_or_none(self, kind, remotepath, fetch):
+        """
+        :return: The SFTPAttributes of remotepath, or None if it does not exist
+        """
+        try:
+            return self._cached_attrs(kind, remotepath, fetch)
+        except IOError:
+            return None
+
+    def _invalidate(self, remotepath, recursive=False):
+        """
+        Forgets the cached metadata of a path that this connection changed
+        :param remotepath: The path that changed, or None if anything may have changed
+        :param recursive: Also forget everything below the path
+        """
+        if self.metadata_cache is None:
+            return
+        key_path = None if remotepath is None else cache_key_path(remotepath)
+        if key_path is None:
+            self.metadata_cache.clear()
+        else:
+            self.metadata_cache.invalidate(key_path, recursive=recursive)
 
     @retry_on_fail
     def put_d(self, localpath, remotepath, confirm=True, preserve_mtime=False):
-        return super().put_d(localpath, remotepath, confirm, preserve_mtime)
+        try:
+            return super().put_d(localpath, remotepath, confirm, preserve_mtime)
+        finally:
+            self._invalidate(None)
 
     @retry_on_fail
     def put_r(self, localpath, remotepath, confirm=True, preserve_mtime=False):
-        return super().put_r(localpath, remotepath, confirm, preserve_mtime)
+        try:
+            return super().put_r(localpath, remotepath, confirm, preserve_mtime)
+        finally:
+            self._invalidate(None)
 
     @retry_on_fail
     def putfo(self, flo, remotepath=None, file_size=0, callback=None, confirm=True):
-        return super().putfo(flo, remotepath, file_size, callback, confirm)
+        try:
+            return super().putfo(flo, remotepath, file_size, callback, confirm)
+        finally:
+            self._invalidate(remotepath)
 
     @retry_on_fail
     def execute(self, command):
-        return super().execute(command)
+        try:
+            return super().execute(command)
+        finally:
+            self._invalidate(None)
+
+    def exec_command(self, command, cwd=None):
+        """
+        Starts a command on the server without reading its output, so that it can be streamed.
+          This is not retried, since a server that refuses exec raises an SSHException too.
+        :param command: The shell command to run
+        :param cwd: A remote directory to run the command in, as SFTP sees it. The shell
+          starts in the home directory, which is where SFTP's "." is too, so the command
+          changes to it relative to there. That way, it also finds the same directory on
+          servers whose SFTP sessions see a different root than their shells.
+        :return: The paramiko Channel that the command runs on, with the connection's timeout
+        """
+        if cwd is not None:
+            command = "cd -- {} && {}".format(
+                shlex.quote(posixpath.relpath(cwd, self.normalize("."))), command
+            )
+        with self._op_lock:
+            try:
+                channel = self._transport.open_session()
+                channel.settimeout(self._timeout)
+                channel.exec_command(command)
+                return channel
+            finally:
+                self.last_used_at = monotonic()
+
+    @property
+    def can_hash(self):
+        """
+        Whether the server may still hash files for hash_many, one way or the other
+        """
+        return self.exec_hashing or self.check_file_hashing
+
+    def hash_many(self, paths, algo="sha1"):
+        """
+        Hashes remote files on the server, so that they can be compared without being
+          downloaded. A coreutils command such as sha1sum run over exec hashes thousands of
+          files at a time, streaming a result for each. Servers that refuse exec, or lack the
+          command, are asked for one file at a time with the check-file extension instead.
+        :param paths: Absolute remote file paths
+        :param algo: A hash algorithm of HASH_COMMANDS, such as "sha1" or "sha256"
+        :return: A dict of the hex digest of each path, without the paths that could not be
+          hashed, because they cannot be read or because the server cannot hash files
+        """
+        if algo not in HASH_COMMANDS:
+            raise ValueError("Unknown hash algorithm: {}".format(algo))
+        paths = list(paths)
+        hashes = {}
+        for start in range(0, len(paths), HASH_BATCH_FILES):
+            if not self.exec_hashing:
+                break
+            hashes.update(
+                self._hash_batch_with_exec(
+                    paths[start : start + HASH_BATCH_FILES], algo
+                )
+            )
+        if self.exec_hashing:
+            # The files that it did not hash cannot be read
+            return hashes
+        for path in paths:
+            if not self.check_file_hashing:
+                break
+            if path not in hashes:
+                self._hash_with_check_file(path, algo, hashes)
+        return hashes
+
+    def _hash_batch_with_exec(self, paths, algo):
+        """
+        Hashes a batch of files with a single command, reading its results while the names
+          of the files are still being sent to it
+        :return: A dict of the hex digest of each path that was hashed
+        """
+        base_path = hash_base_path(paths)
+        # Relative to the base path, so that names starting with "-" are not options
+        names = {"./" + posixpath.relpath(path, base_path): path for path in paths}
+        try:
+            channel = self.exec_command(hash_command(algo), cwd=base_path)
+        except SSHException as ex:
+            logger.warning("Cannot hash files over exec, it was refused: {}".format(ex))
+            self.exec_hashing = False
+            return {}
+        channel.settimeout(max(self._timeout, HASH_IDLE_TIMEOUT))
+        sender = Thread(target=send_names, args=(channel, list(names)), daemon=True)
+        sender.start()
+        hashes = {}
+        try:
+            for record in read_records(channel):
+                name, digest = parse_hash_record(record)
+                if name in names:
+                    hashes[names[name]] = digest
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+            sender.join()
+        if exit_status in COMMAND_NOT_RUN or (exit_status != 0 and not hashes):
+            logger.warning(
+                "Cannot hash files over exec, {} exited with {}".format(
+                    HASH_COMMANDS[algo], exit_status
+                )
+            )
+            self.exec_hashing = False
+        events.info("hash_many", files=len(paths), hashed=len(hashes), algo=algo)
+        return hashes
+
+    def _hash_with_check_file(self, path, algo, hashes):
+        """
+        Hashes one file with the check-file extension into hashes, unless it fails
+        """
+        try:
+            hashes[path] = self.check_file(path, algo)
+        except IOError as ex:
+            if ex.errno is not None:
+                # The file cannot be read, which says nothing about the server
+                return
+            self._check_file_failures += 1
+            if (
+                not self._check_file_hashed
+                and self._check_file_failures >= CHECK_FILE_ATTEMPTS
+            ):
+                logger.warning(
+                    "Cannot hash files with check-file, it failed: {}".format(ex)
+                )
+                self.check_file_hashing = False
+            return
+        self._check_file_hashed = True
+
+    @retry_on_fail
+    def check_file(self, remotepath, algo="sha1"):
+        """
+        Hashes a remote file on the server, with the check-file extension
+        :return: The hex digest of the file
+        :raises IOError: If the server does not support the extension or the algorithm,
+          or cannot read the file
+        """
+        self._sftp_connect()
+        with self._sftp.open(remotepath, "rb") as remote_file:
+            return binascii.hexlify(remote_file.check(algo)).decode("ascii")
 
     @retry_on_fail
     def cd(self, remotepath=None):
@@ -173,11 +921,17 @@ class DurableSFTPConnection(pysftp.Connection):
 
     @retry_on_fail
     def chmod(self, remotepath, mode=777):
-        return super().chmod(remotepath, mode)
+        try:
+            return super().chmod(remotepath, mode)
+        finally:
+            self._invalidate(remotepath)
 
     @retry_on_fail
     def chown(self, remotepath, uid=None, gid=None):
-        return super().chown(remotepath, uid, gid)
+        try:
+            return super().chown(remotepath, uid, gid)
+        finally:
+            self._invalidate(remotepath)
 
     @retry_on_fail
     def getcwd(self):
@@ -189,11 +943,21 @@ class DurableSFTPConnection(pysftp.Connection):
 
     @retry_on_fail
     def listdir_attr(self, remotepath="."):
-        return super().listdir_attr(remotepath)
+        key_path = self._cache_key_path(remotepath)
+        if key_path is None:
+            return super().listdir_attr(remotepath)
+        entries = self.metadata_cache.get(LISTDIR, key_path)
+        if entries is None:
+            entries = super().listdir_attr(remotepath)
+            self.metadata_cache.put_listing(key_path, entries)
+        return list(entries)
 
     @retry_on_fail
     def mkdir(self, remotepath, mode=777):
-        return super().mkdir(remotepath, mode)
+        try:
+            return super().mkdir(remotepath, mode)
+        finally:
+            self._invalidate(remotepath)
 
     @retry_on_fail
     def normalize(self, remotepath):
@@ -201,11 +965,17 @@ class DurableSFTPConnection(pysftp.Connection):
 
     @retry_on_fail
     def isdir(self, remotepath):
-        return super().isdir(remotepath)
+        if self.metadata_cache is None:
+            return super().isdir(remotepath)
+        attrs = self._cached_attrs_or_none(STAT, remotepath, super().stat)
+        return attrs is not None and S_ISDIR(attrs.st_mode)
 
     @retry_on_fail
     def isfile(self, remotepath):
-        return super().isfile(remotepath)
+        if self.metadata_cache is None:
+            return super().isfile(remotepath)
+        attrs = self._cached_attrs_or_none(STAT, remotepath, super().stat)
+        return attrs is not None and S_ISREG(attrs.st_mode)
 
     @retry_on_fail
     def makedirs(self, remotedir, mode=777):
@@ -217,51 +987,91 @@ class DurableSFTPConnection(pysftp.Connection):
 
     @retry_on_fail
     def remove(self, remotefile):
-        return super().remove(remotefile)
+        try:
+            return super().remove(remotefile)
+        finally:
+            self._invalidate(remotefile)
 
     @retry_on_fail
     def rmdir(self, remotepath):
-        return super().rmdir(remotepath)
+        try:
+            return super().rmdir(remotepath)
+        finally:
+            self._invalidate(remotepath, recursive=True)
 
     @retry_on_fail
     def rename(self, remote_src, remote_dest):
-        return super().rename(remote_src, remote_dest)
+        try:
+            return super().rename(remote_src, remote_dest)
+        finally:
+            self._invalidate(remote_src, recursive=True)
+            self._invalidate(remote_dest, recursive=True)
 
     @retry_on_fail
     def stat(self, remotepath):
-        return super().stat(remotepath)
+        return self._cached_attrs(STAT, remotepath, super().stat)
 
     @retry_on_fail
     def lstat(self, remotepath):
-        return super().lstat(remotepath)
+        return self._cached_attrs(LSTAT, remotepath, super().lstat)
 
     @retry_on_fail
     def close(self):
+        if self.health_monitor is not None:
+            self.health_monitor.stop()
         return super().close()
 
     @retry_on_fail
     def open(self, remote_file, mode="r", bufsize=-1):
+        if set(mode) & set("wax+"):
+            # The file changes through the returned file object, which the cache can't see
+            self._invalidate(remote_file)
         return super().open(remote_file, mode, bufsize)
 
     @retry_on_fail
     def exists(self, remotepath):
-        return super().exists(remotepath)
+        if self.metadata_cache is None:
+            return super().exists(remotepath)
+        return self._cached_attrs_or_none(STAT, remotepath, super().stat) is not None
 
     @retry_on_fail
     def lexists(self, remotepath):
-        return super().lexists(remotepath)
+        if self.metadata_cache is None:
+            return super().lexists(remotepath)
+        return self._cached_attrs_or_none(LSTAT, remotepath, super().lstat) is not None
 
     @retry_on_fail
     def symlink(self, remote_src, remote_dest):
-        return super().symlink(remote_src, remote_dest)
+        try:
+            return super().symlink(remote_src, remote_dest)
+        finally:
+            self._invalidate(remote_dest)
 
     @retry_on_fail
     def truncate(self, remotepath, size):
-        return super().truncate(remotepath, size)
+        try:
+            return super().truncate(remotepath, size)
+        finally:
+            self._invalidate(remotepath)
 
     @retry_on_fail
     def walktree(self, remotepath, fcallback, dcallback, ucallback, recurse=True):
-        return super().walktree(remotepath, fcallback, dcallback, ucallback, recurse)
+        if self._cache_key_path(remotepath) is None:
+            return super().walktree(
+                remotepath, fcallback, dcallback, ucallback, recurse
+            )
+        # Walk the cached listings, instead of asking for the stat of every entry
+        for entry in self.listdir_attr(remotepath):
+            pathname = posixpath.join(remotepath, entry.filename)
+            mode = self.stat(pathname).st_mode
+            if S_ISDIR(mode):
+                dcallback(pathname)
+                if recurse:
+                    self.walktree(pathname, fcallback, dcallback, ucallback)
+            elif S_ISREG(mode):
+                fcallback(pathname)
+            else:
+                ucallback(pathname)
 
     @retry_on_fail
     def sftp_client(self):
@@ -286,3 +1096,88 @@ class DurableSFTPConnection(pysftp.Connection):
     @retry_on_fail
     def remote_server_key(self):
         return super().remote_server_key()
+
+
+class DurableSFTPChannel(DurableSFTPConnection):
+    """
+    An SFTP session on the transport of a parent DurableSFTPConnection. Channels are used like
+      connections, but share their parent's TCP connection, key exchange and authentication.
+    When a channel fails, it rebuilds its parent's transport, unless another channel already
+      did, then opens a new SFTP session on it. Every other channel opens its new session the
+      next time that it is used.
+    """
+
+    def __init__(self, parent):
+        """
+        :param parent: The DurableSFTPConnection whose transport to open a channel on
+        """
+        # The parent already holds the transport, so there is nothing to connect here
+        self.parent = parent
+        self.host = parent.host
+        self.port = parent.port
+        self.max_attempts = parent.max_attempts
+        self.resume_check_size = parent.resume_check_size
+        self.backoff_base = parent.backoff_base
+        self.backoff_cap = parent.backoff_cap
+        # Channels change the same server, so they share the parent's cache
+        self.metadata_cache = parent.metadata_cache
+        self.metrics = parent.metrics
+        self._timeout = parent._timeout
+        self._cnopts = parent._cnopts
+        self._default_path = parent._default_path
+        self._partial_puts = {}
+        self._sftp = None
+        self._sftp_live = False
+        self._transport = None
+        self.generation = parent.generation
+        self.exec_hashing = parent.exec_hashing
+        self.check_file_hashing = parent.check_file_hashing
+        self._check_file_failures = 0
+        self._check_file_hashed = False
+        self._op_lock = RLock()
+        self.last_used_at = monotonic()
+        self.health_monitor = None
+        self._sftp_connect()
+
+    def _sftp_connect(self):
+        if self.generation != self.parent.generation or not self._sftp_live:
+            self._close_channel()
+            self.generation = self.parent.generation
+            self._transport = self.parent._transport
+            super()._sftp_connect()
+            self._sftp.get_channel().settimeout(self._timeout)
+
+    def transport_generation(self):
+        return self.parent.generation
+
+    def transport_lost(self):
+        transport = self.parent._transport
+        return transport is None or not transport.is_active()
+
+    def reconnect(self, generation=None):
+        """
+        Rebuilds the parent's transport, unless another channel already did, and opens
+          a new SFTP session on it
+        :param generation: The generation of the transport that failed
+        """
+        if generation is None:
+            generation = self.generation
+        self.parent.reconnect(generation)
+        logger.warning("Reopening channel on sftp://{}:{}".format(self.host, self.port))
+        self._close_channel()
+        self._sftp_connect()
+
+    def close(self):
+        """
+        Closes this channel only, the parent's transport stays open
+        """
+        self._close_channel()
+
+    def _close_channel(self):
+        if self._sftp_live:
+            self._sftp_live = False
+            try:
+                self._sftp.close()
+            except (OSError, EOFError, SSHException):
+                # The transport is already gone
+                pass
@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+from queue import Queue, Empty
+from threading import Lock
+
+from durasftp.common.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class DurableSFTPConnectionPool:
+    """
+    A bounded pool of DurableSFTPConnections. Every connection in the pool reconnects
+      on its own, so a retry on one connection does not stall the others.
+    Connections are opened lazily, only once every idle connection is already in use.
+    """
+
+    def __init__(self, size, connection_factory, connections=None):
+        """
+        :param size: The maximum number of connections to open
+        :param connection_factory: A callable that opens a new DurableSFTPConnection
+        :param connections: Already open connections to seed the pool with
+        """
+        self.size = size
+        self.connection_factory = connection_factory
+        self.connections = []
+        self._idle_connections = Queue()
+        self._lock = Lock()
+        for conn in connections or []:
+            self.connections.append(conn)
+            self._idle_connections.put(conn)
+
+    def acquire(self, block=True):
+        """
+        Takes a connection out of the pool, opening a new one if the pool is not full yet
+        :param block: Wait for another thread to release a connection if the pool is full
+        :return: A connection, or None if block is False and no connection is available
+        :rtype: DurableSFTPConnection
+        """
+        try:
+            return self._idle_connections.get_nowait()
+        except Empty:
+            pass
+        conn = self._open_connection_if_room()
+        if conn is not None:
+            return conn
+        if not block:
+            return None
+        return self._idle_connections.get()
+
+    def release(self, conn):
+        """
+        Returns a connection to the pool
+        """
+        self._idle_connections.put(conn)
+
+    @contextmanager
+    def connection(self, block=True):
+        """
+        Borrows a connection for the duration of a with block:
+            with pool.connection() as conn:
+                conn.listdir("/")
+        """
+        conn = self.acquire(block=block)
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                self.release(conn)
+
+    def _open_connection_if_room(self):
+        with self._lock:
+            if len(self.connections) >= self.size:
+                return None
+            # Reserve the slot before connecting, so that slow handshakes can happen in parallel
+            self.connections.append(None)
+            slot_num = len(self.connections) - 1
+        logger.info(
+            "Opening pooled connection {} of {}".format(slot_num + 1, self.size)
+        )
+        try:
+            conn = self.connection_factory()
+        except Exception:
+            with self._lock:
+                self.connections.remove(None)
+            raise
+        with self._lock:
+            self.connections[self.connections.index(None)] = conn
+        return conn
+
+    def close(self):
+        """
+        Closes every connection that the pool has opened
+        """
+        with self._lock:
+            connections = [conn for conn in self.connections if conn is not None]
+            self.connections = []
+            self._idle_connections = Queue()
+        for conn in connections:
+            conn.close()
+
+    def __len__(self):
+        return len(self.connections)
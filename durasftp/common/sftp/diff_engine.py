@@ -0,0 +1,124 @@
+"""
+Diffs two whole AttrTrees at once, using NumPy arrays instead of comparing entries one
+  path at a time. NumPy is optional: when it is not installed, is_available() is False
+  and the mirrorer falls back to its per path comparison.
+"""
+
+from stat import S_IFDIR, S_IFREG
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+
+NOT_FOUND = -1
+# The file type bits of a mode, which stat.S_IFMT() masks out
+FILE_TYPE_MASK = 0o170000
+
+# Codes are computed as small integers, then mapped to action codes in one pass
+NO_ACTION = 0
+SAME = 1
+MAKE_DIR = 2
+TRANSFER = 3
+FROM_REMOTE_CODES = [
+    None,
+    SFTPActionCodes.OK,
+    SFTPActionCodes.LMKDIR,
+    SFTPActionCodes.GET,
+]
+TO_REMOTE_CODES = [
+    None,
+    SFTPActionCodes.OK,
+    SFTPActionCodes.RMKDIR,
+    SFTPActionCodes.PUT,
+]
+
+
+def is_available():
+    return numpy is not None
+
+
+def column_arrays(attr_tree):
+    """
+    Copies the modes, sizes and mtimes of an AttrTree into NumPy arrays
+    :return: A (modes, sizes, mtimes) tuple of arrays, in the tree's insertion order
+    """
+    order, modes, sizes, mtimes = attr_tree.columns()
+    nodes = numpy.frombuffer(order, dtype=order.typecode)
+    # Indexing copies, so the tree can keep growing after this
+    return tuple(
+        numpy.frombuffer(column, dtype=column.typecode)[nodes]
+        for column in (modes, sizes, mtimes)
+    )
+
+
+def align_paths(source_paths, dest_paths):
+    """
+    Finds every source path in dest_paths, with a binary search over a sorted index
+    :return: An array holding the position of each source path in dest_paths, or NOT_FOUND
+    """
+    positions = numpy.full(len(source_paths), NOT_FOUND, dtype=numpy.int64)
+    if not source_paths or not dest_paths:
+        return positions
+    sources = numpy.array(source_paths, dtype=object)
+    dests = numpy.array(dest_paths, dtype=object)
+    sorted_index = numpy.argsort(dests, kind="stable")
+    sorted_dests = dests[sorted_index]
+    candidates = numpy.searchsorted(sorted_dests, sources)
+    numpy.minimum(candidates, len(dests) - 1, out=candidates)
+    found = (sorted_dests[candidates] == sources).astype(bool)
+    positions[found] = sorted_index[candidates[found]]
+    return positions
+
+
+def file_types(modes):
+    """
+    :return: Two boolean arrays, telling which modes are directories and which are regular files
+    """
+    types = modes & FILE_TYPE_MASK
+    return types == S_IFDIR, types == S_IFREG
+
+
+def diff_trees(source_tree, dest_tree, from_remote=True):
+    """
+    Calculates the action required to mirror every path of source_tree onto dest_tree.
+      Entries are compared with the same rules as Mirrorer.entries_match: directories match
+      directories, and files match files with the same size and the same mtime in whole seconds.
+    :param source_tree: The AttrTree to mirror from
+    :param dest_tree: The AttrTree to mirror onto
+    :param from_remote: The source tree is the remote one, so GET and LMKDIR are required,
+      rather than PUT and RMKDIR
+    :return: The source paths in insertion order, the action code of each path, or None for
+      paths that are neither files nor directories, and the position of each path in
+      dest_tree, or NOT_FOUND
+    """
+    source_paths = list(source_tree.keys())
+    dest_paths = list(dest_tree.keys())
+    positions = align_paths(source_paths, dest_paths)
+    found = positions != NOT_FOUND
+    dest_index = positions[found]
+
+    source_modes, source_sizes, source_mtimes = column_arrays(source_tree)
+    dest_modes, dest_sizes, dest_mtimes = column_arrays(dest_tree)
+    source_is_dir, source_is_file = file_types(source_modes)
+
+    # Attributes of the matching destination entry, left as False where there is none
+    dest_is_dir = numpy.zeros(len(source_paths), dtype=bool)
+    dest_is_file = numpy.zeros(len(source_paths), dtype=bool)
+    same_contents = numpy.zeros(len(source_paths), dtype=bool)
+    dest_is_dir[found], dest_is_file[found] = file_types(dest_modes[dest_index])
+    same_contents[found] = (source_sizes[found] == dest_sizes[dest_index]) & (
+        numpy.trunc(source_mtimes[found]) == numpy.trunc(dest_mtimes[dest_index])
+    )
+
+    codes = numpy.full(len(source_paths), NO_ACTION, dtype=numpy.int8)
+    codes[source_is_dir] = MAKE_DIR
+    codes[source_is_file] = TRANSFER
+    codes[source_is_dir & dest_is_dir] = SAME
+    codes[source_is_file & dest_is_file & same_contents] = SAME
+
+    code_table = FROM_REMOTE_CODES if from_remote else TO_REMOTE_CODES
+    action_codes = numpy.array(code_table, dtype=object)[codes].tolist()
+    return source_paths, action_codes, positions.tolist()
@@ -0,0 +1,21 @@
+READ_SIZE = 64 * 1024
+
+
+def read_records(channel, cut_short_error=None):
+    """
+    Streams the NUL terminated records of a command's output as they arrive
+    :param channel: The channel that the command runs on
+    :param cut_short_error: The exception to raise if the output ends in the middle of a
+      record. Without one, the record that was cut short is left out.
+    :return: A generator of records, without their NULs
+    """
+    remainder = b""
+    while True:
+        chunk = channel.recv(READ_SIZE)
+        if not chunk:
+            break
+        records = (remainder + chunk).split(b"\0")
+        remainder = records.pop()
+        yield from records
+    if remainder and cut_short_error is not None:
+        raise cut_short_error
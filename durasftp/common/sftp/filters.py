@@ -0,0 +1,171 @@
+import re
+from fnmatch import translate
+from os.path import join
+from stat import S_ISREG
+
+import arrow
+
+from durasftp.common.sftp.attr_tree import entry_attrs, entry_name
+
+
+def compile_patterns(globs=None, regexes=None):
+    """
+    Compiles glob and regex patterns into a single list of regexes, to search paths with
+    """
+    # A glob must match the whole path, a regex only needs to match part of it
+    patterns = [re.compile(r"\A" + translate(glob)) for glob in globs or []]
+    patterns += [re.compile(regex) for regex in regexes or []]
+    return patterns
+
+
+def to_timestamp(moment):
+    """
+    :param moment: A number of seconds since the epoch, or anything else arrow can parse
+    :return: The number of seconds since the epoch
+    """
+    if isinstance(moment, (int, float)):
+        return moment
+    return arrow.get(moment).float_timestamp
+
+
+class PathFilter:
+    """
+    Decides which paths take part in a mirror. Rules match the full remote path, for example
+      "/archive/2019/report.csv". Globs use fnmatch rules, where "*" also matches "/", so
+      "*.tmp" matches temporary files at any depth.
+      - Excluded paths are left out, and excluded directories are never listed at all
+      - When there are include rules, only the files that match one of them are mirrored.
+        Directories are still walked, since an included file may be anywhere below them
+      - The size and modified since rules only apply to files
+    """
+
+    def __init__(
+        self,
+        include=None,
+        exclude=None,
+        include_regex=None,
+        exclude_regex=None,
+        min_size=None,
+        max_size=None,
+        modified_since=None,
+    ):
+        """
+        :param include: Globs of the files to mirror
+        :param exclude: Globs of the files and directories to leave out
+        :param include_regex: Regexes of the files to mirror
+        :param exclude_regex: Regexes of the files and directories to leave out
+        :param min_size: The smallest file size to mirror, in bytes
+        :param max_size: The largest file size to mirror, in bytes
+        :param modified_since: Only mirror files modified at or after this time, given in
+          seconds since the epoch, or in any format that arrow can parse
+        """
+        self.include_patterns = compile_patterns(include, include_regex)
+        self.exclude_patterns = compile_patterns(exclude, exclude_regex)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_since = None
+        if modified_since is not None:
+            self.modified_since = to_timestamp(modified_since)
+
+    def is_empty(self):
+        return not (
+            self.include_patterns
+            or self.exclude_patterns
+            or self.min_size is not None
+            or self.max_size is not None
+            or self.modified_since is not None
+        )
+
+    def is_excluded(self, remote_path):
+        return any(pattern.search(remote_path) for pattern in self.exclude_patterns)
+
+    def allows(self, remote_path, entry):
+        """
+        :param remote_path: The remote path of an entry
+        :param entry: An SFTPAttributes, os.DirEntry or AttrEntry
+        :return: True if the entry takes part in the mirror
+        """
+        if self.is_excluded(remote_path):
+            return False
+        st_mode, st_size, st_mtime = entry_attrs(entry)
+        if not S_ISREG(st_mode):
+            # Directories only need to escape the exclude rules
+            return True
+        if self.include_patterns and not any(
+            pattern.search(remote_path) for pattern in self.include_patterns
+        ):
+            return False
+        if self.min_size is not None and st_size < self.min_size:
+            return False
+        if self.max_size is not None and st_size > self.max_size:
+            return False
+        if self.modified_since is not None and st_mtime < self.modified_since:
+            return False
+        return True
+
+    def filter_entries(self, dir_path, entries):
+        """
+        :param dir_path: The remote path of the directory that was listed
+        :param entries: The listing of the directory
+        :return: The entries that take part in the mirror
+        """
+        if self.is_empty():
+            return entries
+        return [
+            entry
+            for entry in entries
+            if self.allows(join(dir_path, entry_name(entry)), entry)
+        ]
+
+
+def add_filter_args(parser):
+    parser.add_argument(
+        "--root",
+        default="/",
+        help="The remote directory to mirror, mirrored to the same path below the local base",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        help="A glob of files to mirror, like '*.csv'. Can be given more than once",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        help="A glob of files and directories to skip, like '/archive'. Can be given more than once",
+    )
+    parser.add_argument(
+        "--include-regex",
+        action="append",
+        help="A regex of files to mirror. Can be given more than once",
+    )
+    parser.add_argument(
+        "--exclude-regex",
+        action="append",
+        help="A regex of files and directories to skip. Can be given more than once",
+    )
+    parser.add_argument(
+        "--min-size", type=int, help="The smallest file size to mirror, in bytes"
+    )
+    parser.add_argument(
+        "--max-size", type=int, help="The largest file size to mirror, in bytes"
+    )
+    parser.add_argument(
+        "--modified-since",
+        help="Only mirror files modified since this ISO 8601 date/time",
+    )
+
+
+def path_filter_from_args(args):
+    """
+    Builds a PathFilter from the arguments added by add_filter_args
+    """
+    return PathFilter(
+        include=args.include,
+        exclude=args.exclude,
+        include_regex=args.include_regex,
+        exclude_regex=args.exclude_regex,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        modified_since=args.modified_since,
+    )
@@ -0,0 +1,188 @@
+import shlex
+from os.path import join
+from stat import (
+    S_IFBLK,
+    S_IFCHR,
+    S_IFDIR,
+    S_IFIFO,
+    S_IFLNK,
+    S_IFMT,
+    S_IFREG,
+    S_IFSOCK,
+    S_IMODE,
+)
+from time import perf_counter
+
+from paramiko import SSHException
+
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.connection import is_partial_path
+from durasftp.common.sftp.exec_output import READ_SIZE, read_records
+
+logger = get_logger(__name__)
+
+# The type, permissions, size, mtime and relative path of each entry, NUL terminated since
+#   file names may contain newlines. The path goes last, since it may contain spaces.
+FIND_PRINTF = "%y %m %s %T@ %P\\0"
+
+FILE_TYPES = {
+    "f": S_IFREG,
+    "d": S_IFDIR,
+    "l": S_IFLNK,
+    "p": S_IFIFO,
+    "s": S_IFSOCK,
+    "c": S_IFCHR,
+    "b": S_IFBLK,
+}
+
+
+class FindUnavailable(Exception):
+    """
+    The server refused to run find, or its find could not list the tree
+    """
+
+
+# Run in the root of the tree, so that %P is relative to it
+FIND_COMMAND = "find . -printf {}".format(shlex.quote(FIND_PRINTF))
+
+
+def parse_find_record(record):
+    """
+    :param record: One NUL terminated record of the find output, without its NUL
+    :return: The path of the entry relative to the root of the find, and its AttrEntry
+    """
+    file_type, perms, size, mtime, relative_path = record.decode("utf-8").split(" ", 4)
+    st_mode = FILE_TYPES.get(file_type, 0) | int(perms, 8)
+    # SFTP only has whole seconds, so the mtimes must compare equal to the ones it lists
+    st_mtime = int(float(mtime))
+    return (
+        relative_path,
+        AttrEntry(relative_path.rpartition("/")[2], st_mode, int(size), st_mtime),
+    )
+
+
+class FindLister:
+    """
+    Lists a whole remote tree with a single find command run over exec, streaming its output,
+      instead of listing each directory with its own SFTP round trip. This needs a server
+      that allows exec, and GNU find for -printf.
+    """
+
+    def __init__(self, conn, path_filter=None):
+        """
+        :param conn: The DurableSFTPConnection to run find over
+        :param path_filter: A PathFilter of the entries to leave out, along with everything
+          below excluded directories
+        """
+        self.conn = conn
+        self.path_filter = path_filter
+
+    def load_tree(self, remote_path, attr_tree):
+        """
+        Lists the whole tree under remote_path, and loads it into attr_tree depth first, as a
+          recursive walk would, though with each directory in the server's order, not sorted
+        :param remote_path: A remote directory path
+        :param attr_tree: The mapping of remote paths to entries to fill in
+        :raises FindUnavailable: If exec is refused, or find fails. Connection errors are
+          raised as they are.
+        """
+        logger.info("Loading remote with find: {}".format(remote_path))
+        started_at = perf_counter()
+        root_stat = self.conn.stat(remote_path)
+        try:
+            channel = self.conn.exec_command(FIND_COMMAND, cwd=remote_path)
+        except SSHException as ex:
+            raise FindUnavailable("The server refused exec: {}".format(ex))
+        try:
+            try:
+                entry_count = self.load_records(
+                    read_records(
+                        channel, FindUnavailable("The output of find was cut short")
+                    ),
+                    remote_path,
+                    root_stat,
+                    attr_tree,
+                )
+            except FindUnavailable:
+                # A find that failed outright explains why better
+                if channel.eof_received:
+                    self.check_exit_status(channel)
+                raise
+            self.check_exit_status(channel)
+        finally:
+            channel.close()
+        logger.info(
+            "Found {} entries under {} in {:.3f}s".format(
+                entry_count, remote_path, perf_counter() - started_at
+            )
+        )
+
+    def load_records(self, records, remote_path, root_stat, attr_tree):
+        """
+        Loads the parsed find records into attr_tree, leaving out unfinished transfers and
+          filtered entries. find lists each directory right before its contents, so everything
+          below a left out directory is skipped until the records leave it.
+        :return: The number of entries loaded
+        """
+        entry_count = 0
+        skipped_prefix = None
+        root_checked = False
+        for record in records:
+            try:
+                relative_path, entry = parse_find_record(record)
+            except ValueError:
+                raise FindUnavailable(
+                    "Could not parse the output of find: {}".format(record)
+                )
+            if relative_path == "":
+                self.check_root(remote_path, root_stat, entry)
+                root_checked = True
+                continue
+            if not root_checked:
+                raise FindUnavailable("find did not list {} first".format(remote_path))
+            if skipped_prefix is not None:
+                if relative_path.startswith(skipped_prefix):
+                    continue
+                skipped_prefix = None
+            entry_path = join(remote_path, relative_path)
+            if is_partial_path(entry.filename) or (
+                self.path_filter is not None
+                and not self.path_filter.allows(entry_path, entry)
+            ):
+                skipped_prefix = relative_path + "/"
+                continue
+            attr_tree[entry_path] = entry
+            entry_count += 1
+        if not root_checked:
+            raise FindUnavailable("find listed nothing under {}".format(remote_path))
+        return entry_count
+
+    @staticmethod
+    def check_exit_status(channel):
+        """
+        Waits for the command on channel to exit, which it has once its output has ended
+        """
+        exit_status = channel.recv_exit_status()
+        if exit_status != 0:
+            errors = channel.makefile_stderr("rb").read(READ_SIZE)
+            raise FindUnavailable(
+                "find exited with {}: {}".format(
+                    exit_status, errors.decode("utf-8", "replace").strip()
+                )
+            )
+
+    @staticmethod
+    def check_root(remote_path, root_stat, root_entry):
+        """
+        Makes sure that find listed the same directory that SFTP sees at remote_path, which
+          may not be the case on servers that map paths differently for shells
+        """
+        if (
+            S_IFMT(root_stat.st_mode) != S_IFMT(root_entry.st_mode)
+            or S_IMODE(root_stat.st_mode) != S_IMODE(root_entry.st_mode)
+            or int(root_stat.st_mtime) != root_entry.st_mtime
+        ):
+            raise FindUnavailable(
+                "find listed a different directory than {}".format(remote_path)
+            )
@@ -0,0 +1,117 @@
+import sqlite3
+from threading import Lock
+
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.listing_cache import RACY_SECONDS
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    hashed_at REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (inode, size, mtime_ns, algorithm)
+);
+"""
+
+
+def stat_key(local_stat, algorithm):
+    """
+    :param local_stat: The os.stat_result of a local file
+    :param algorithm: The hash algorithm, such as "sha1"
+    :return: The key of the file's hash in the cache
+    """
+    return local_stat.st_ino, local_stat.st_size, local_stat.st_mtime_ns, algorithm
+
+
+class HashCache:
+    """
+    An on-disk SQLite cache of the hashes of local files, kept between runs. A file's hash is
+      reused as long as its inode, size and mtime in nanoseconds are all unchanged, so that
+      unchanged files are never read again just to be compared.
+    A file that changed within RACY_SECONDS of being hashed may have changed again within the
+      same mtime, so its hash is never reused. Hashes of files that were not looked up during
+      a run are forgotten at the end of it.
+    """
+
+    def __init__(self, cache_path):
+        """
+        :param cache_path: The path of the SQLite database, created if it does not exist
+        """
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._lock = Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def start_run(self):
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+
+    def get(self, local_stat, algorithm="sha1"):
+        """
+        Looks up the cached hash of a local file
+        :param local_stat: The file's current os.stat_result
+        :param algorithm: The hash algorithm, such as "sha1"
+        :return: The hex digest of the file, or None if it must be hashed again
+        """
+        key = stat_key(local_stat, algorithm)
+        with self._lock:
+            self._seen.add(key)
+            row = self._db.execute(
+                "SELECT hashed_at, digest FROM hashes"
+                " WHERE inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                key,
+            ).fetchone()
+            if row is None or local_stat.st_mtime + RACY_SECONDS >= row[0]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[1]
+
+    def put(self, local_stat, digest, hashed_at, algorithm="sha1"):
+        """
+        Caches the hash of a local file. Hashes are only written to disk by finish_run.
+        :param local_stat: The file's os.stat_result, from before it was hashed
+        :param digest: The hex digest of the file
+        :param hashed_at: The time that the file was stat'ed at, before it was hashed
+        :param algorithm: The hash algorithm, such as "sha1"
+        """
+        key = stat_key(local_stat, algorithm)
+        with self._lock:
+            self._seen.add(key)
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes"
+                " (inode, size, mtime_ns, algorithm, hashed_at, digest)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                key + (hashed_at, digest),
+            )
+
+    def finish_run(self):
+        """
+        Forgets the hashes that were not looked up during this run, and saves the cache
+        """
+        with self._lock, self._db:
+            cached_keys = self._db.execute(
+                "SELECT inode, size, mtime_ns, algorithm FROM hashes"
+            ).fetchall()
+            self._db.executemany(
+                "DELETE FROM hashes"
+                " WHERE inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                [key for key in cached_keys if key not in self._seen],
+            )
+        logger.info(
+            "Hash cache: {} files reused, {} hashed".format(self.hits, self.misses)
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,167 @@
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import time
+
+from paramiko import SSHException
+
+from durasftp.common import generate_file_hash
+
+# Files match when their sizes and whole second mtimes do
+COMPARE_SIZE_MTIME = "size_mtime"
+# Files of the same size match when their contents hash the same, with SHA1
+COMPARE_HASH = "hash"
+COMPARE_MODES = (COMPARE_SIZE_MTIME, COMPARE_HASH)
+
+# Below this many files to hash, starting worker processes costs more than it saves
+HASH_POOL_MIN_FILES = 8
+# The most files hashed by one command. Their names are sent while the results are read,
+#   so this only bounds what a failure loses.
+HASH_BATCH_FILES = 10000
+# The number of names to send at a time
+SEND_NAMES = 500
+# A large file may take minutes to hash before the next result is printed
+HASH_IDLE_TIMEOUT = 600
+# The failures that the check-file extension may answer with before a server that has not
+#   hashed any file with it yet is taken not to support it
+CHECK_FILE_ATTEMPTS = 3
+
+# The coreutils command of each algorithm. With -z, each line that they print is NUL
+#   terminated, so that names are not escaped, which coreutils 8.30 or later can do.
+HASH_COMMANDS = {
+    "md5": "md5sum",
+    "sha1": "sha1sum",
+    "sha256": "sha256sum",
+    "sha512": "sha512sum",
+}
+# The exit statuses of xargs when it could not run its command at all
+COMMAND_NOT_RUN = (126, 127)
+
+
+def hash_or_none(local_path, algorithm="sha1"):
+    """
+    :return: The hex digest of a local file, or None if it cannot be read
+    """
+    try:
+        return generate_file_hash(local_path, algorithm)
+    except OSError:
+        return None
+
+
+class LocalHasher:
+    """
+    Hashes local files, reusing the hashes of unchanged files from a HashCache, and hashing
+      the rest in a pool of processes, so that large trees hash on every core
+    """
+
+    def __init__(self, hash_cache=None, processes=None):
+        """
+        :param hash_cache: A HashCache to reuse the hashes of unchanged files from
+        :param processes: The number of processes to hash with, by default one per core
+        """
+        self.hash_cache = hash_cache
+        self.processes = processes
+
+    def hash_files(self, local_paths, algorithm="sha1"):
+        """
+        :param local_paths: The local files to hash
+        :param algorithm: The name of a hashlib algorithm, such as "sha1" or "sha256"
+        :return: A dict of the hex digest of each file, without the files that cannot be read
+        """
+        hashes = {}
+        misses = []
+        for local_path in local_paths:
+            if self.hash_cache is None:
+                misses.append((local_path, None, None))
+                continue
+            try:
+                local_stat = os.stat(local_path)
+            except OSError:
+                continue
+            digest = self.hash_cache.get(local_stat, algorithm)
+            if digest is None:
+                misses.append((local_path, local_stat, time()))
+            else:
+                hashes[local_path] = digest
+        miss_paths = [local_path for local_path, _, _ in misses]
+        for (local_path, local_stat, hashed_at), digest in zip(
+            misses, self.hash_all(miss_paths, algorithm)
+        ):
+            if digest is None:
+                continue
+            hashes[local_path] = digest
+            if self.hash_cache is not None:
+                self.hash_cache.put(local_stat, digest, hashed_at, algorithm)
+        return hashes
+
+    def hash_all(self, local_paths, algorithm="sha1"):
+        """
+        :return: The hex digest of each file, or None for files that cannot be read, in order
+        """
+        hash_file = partial(hash_or_none, algorithm=algorithm)
+        if len(local_paths) < HASH_POOL_MIN_FILES or self.processes == 1:
+            return [hash_file(local_path) for local_path in local_paths]
+        processes = self.processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(
+                executor.map(
+                    hash_file,
+                    local_paths,
+                    chunksize=max(1, len(local_paths) // (processes * 4)),
+                )
+            )
+
+
+def hash_command(algorithm):
+    """
+    :param algorithm: A hash algorithm of HASH_COMMANDS, such as "sha1"
+    :return: The shell command that hashes the NUL terminated names read from its input
+    """
+    return "xargs -0 {} -z".format(HASH_COMMANDS[algorithm])
+
+
+def hash_base_path(remote_paths):
+    """
+    :return: The deepest remote directory that contains every one of remote_paths
+    """
+    return posixpath.commonpath([posixpath.dirname(path) for path in remote_paths])
+
+
+def parse_hash_record(record):
+    """
+    :param record: One NUL terminated line of sha1sum -z or the like, without its NUL
+    :return: The name that was hashed, and its hex digest
+    """
+    digest, _, name = record.partition(b" ")
+    # The name follows a space, or a "*" in binary mode
+    return name[1:].decode("utf-8"), digest.decode("ascii")
+
+
+def send_names(channel, names):
+    """
+    Sends NUL terminated names to the input of a command, then closes its input. Run on a
+      thread of its own, so that the command's output is read while its input is written.
+    """
+    try:
+        for start in range(0, len(names), SEND_NAMES):
+            channel.sendall(
+                b"".join(
+                    name.encode("utf-8") + b"\0"
+                    for name in names[start : start + SEND_NAMES]
+                )
+            )
+        channel.shutdown_write()
+    except (SSHException, EOFError, OSError):
+        # The reading side has failed or given up, and tells why
+        pass
+
+
+class VerifyStates:
+    MATCH = "MATCH"
+    MISMATCH = "MISMATCH"
+    MISSING_LOCAL = "MISSING_LOCAL"
+    MISSING_REMOTE = "MISSING_REMOTE"
+    UNVERIFIED = "UNVERIFIED"
+
+    FAILED_STATES = [MISMATCH, MISSING_LOCAL, MISSING_REMOTE]
@@ -0,0 +1,132 @@
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from time import monotonic
+
+from durasftp.common.log import get_logger
+from durasftp.common.networking.stoppable_thread import StoppableThread
+
+logger = get_logger(__name__)
+
+
+class HealthMonitor(StoppableThread):
+    """
+    Watches a DurableSFTPConnection from the background, so that a dead connection is found
+      while it sits idle, instead of by the next operation hanging for the full timeout.
+    Whenever the connection, and every channel on it, has been idle for an interval, the
+      monitor times a cheap SFTP round trip. If the round trip fails, or stalls for longer than
+      probe_timeout, the connection is marked suspect and reconnected ahead of time. Operations
+      wait for a probe or a reconnect in progress, and the monitor never interrupts one.
+    """
+
+    def __init__(self, conn, interval=5, probe_timeout=2):
+        """
+        :param conn: The DurableSFTPConnection to watch
+        :param interval: The seconds of idleness between probes
+        :param probe_timeout: The seconds after which a probe counts as stalled
+        """
+        super().__init__()
+        self.daemon = True
+        # Don't keep an abandoned connection alive
+        self._conn_ref = weakref.ref(conn)
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.probes = 0
+        self.stalls = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.last_probe_seconds = None
+        # Probes run on their own thread, so that a stalled one can be timed out
+        self._prober = ThreadPoolExecutor(1)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval) and not self.stopped():
+            conn = self._conn_ref()
+            if conn is None:
+                break
+            self.check(conn)
+            del conn
+        self._prober.shutdown(wait=False)
+
+    def check(self, conn):
+        """
+        Probes the connection if it is idle, and reconnects it if the probe fails or stalls
+        :return: False if the connection had to be reconnected
+        """
+        if monotonic() - self.last_used_at(conn) < self.interval:
+            # A connection in use proves its own health
+            return True
+        locks = self.lock_if_idle(conn)
+        if locks is None:
+            return True
+        try:
+            if self.probe(conn):
+                return True
+            conn.suspect = True
+            logger.warning(
+                "Reconnecting suspect sftp://{}:{} ahead of time".format(
+                    conn.host, conn.port
+                )
+            )
+            try:
+                conn.reconnect()
+            except Exception as ex:
+                # The next operation will retry on its own
+                logger.warning("Failed to reconnect ahead of time: {}".format(ex))
+                return False
+            self.reconnects += 1
+            conn.suspect = False
+            return False
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def probe(self, conn):
+        """
+        :return: True if a cheap round trip to the server completed within probe_timeout
+        """
+        self.probes += 1
+        started_at = monotonic()
+        future = self._prober.submit(conn.probe)
+        try:
+            future.result(timeout=self.probe_timeout)
+        except TimeoutError:
+            self.stalls += 1
+            # Don't queue the next probe behind the stalled one
+            self._prober.shutdown(wait=False)
+            self._prober = ThreadPoolExecutor(1)
+            logger.warning(
+                "sftp://{}:{} did not answer within {}s".format(
+                    conn.host, conn.port, self.probe_timeout
+                )
+            )
+            return False
+        except Exception as ex:
+            self.failures += 1
+            logger.warning(
+                "sftp://{}:{} failed its health check: {}".format(
+                    conn.host, conn.port, ex
+                )
+            )
+            return False
+        self.last_probe_seconds = monotonic() - started_at
+        conn.suspect = False
+        return True
+
+    @staticmethod
+    def last_used_at(conn):
+        return max([conn.last_used_at] + [c.last_used_at for c in list(conn.channels)])
+
+    @staticmethod
+    def lock_if_idle(conn):
+        """
+        Takes the operation locks of the connection and of every channel on it, without waiting
+        :return: The locks to release, or None if an operation is in progress
+        """
+        locks = []
+        for lock in [conn._op_lock] + [c._op_lock for c in list(conn.channels)]:
+            if not lock.acquire(blocking=False):
+                for taken_lock in locks:
+                    taken_lock.release()
+                return None
+            locks.append(lock)
+        return locks
@@ -0,0 +1,129 @@
+import sqlite3
+from threading import Lock
+from time import time
+
+from durasftp.common.log import get_logger
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS actions (
+    position INTEGER PRIMARY KEY,
+    remote_path TEXT UNIQUE NOT NULL,
+    action_code TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS actions_by_state ON actions (state);
+"""
+
+
+class ActionStates:
+    PENDING = "PENDING"
+    IN_PROGRESS = "IN_PROGRESS"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+    UNFINISHED_STATES = [PENDING, IN_PROGRESS, FAILED]
+
+
+class MirrorJournal:
+    """
+    An on-disk SQLite record of a planned mirror, and of how far each of its actions got.
+      If a mirror is interrupted, the unfinished actions can be resumed from the journal,
+      without listing both trees again.
+    A journal holds a single plan, saving a new plan replaces the old one.
+    """
+
+    def __init__(self, journal_path):
+        """
+        :param journal_path: The path of the SQLite database, created if it does not exist
+        """
+        self.journal_path = journal_path
+        self._lock = Lock()
+        # Actions are marked from the worker threads, every access goes through the lock
+        self._db = sqlite3.connect(journal_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def save_plan(self, local_base, from_remote, actions):
+        """
+        Replaces the journal's plan
+        :param local_base: The local directory being mirrored
+        :param from_remote: Whether the plan mirrors the remote onto the local, or the other way
+        :param actions: The SFTPActions of the plan, in the order they will run
+        """
+        rows = (
+            (action.remote_path, action.action_code, ActionStates.PENDING, time())
+            for action in actions
+        )
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM plan")
+            self._db.execute("DELETE FROM actions")
+            self._db.executemany(
+                "INSERT INTO plan (key, value) VALUES (?, ?)",
+                [
+                    ("local_base", local_base),
+                    ("from_remote", "1" if from_remote else "0"),
+                    ("saved_at", str(time())),
+                ],
+            )
+            self._db.executemany(
+                "INSERT INTO actions (remote_path, action_code, state, updated_at)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        logger.info("Saved plan to journal: {}".format(self.journal_path))
+
+    def plan(self):
+        """
+        :return: The (local base, from remote) of the saved plan
+        :raises ValueError: If no plan was ever saved in this journal
+        """
+        with self._lock:
+            values = dict(self._db.execute("SELECT key, value FROM plan"))
+        if "local_base" not in values:
+            raise ValueError("No plan in journal: {}".format(self.journal_path))
+        return values["local_base"], values["from_remote"] == "1"
+
+    def mark(self, remote_path, state, error=None):
+        """
+        Records the state of one action
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE actions SET state = ?, updated_at = ?, error = ?"
+                " WHERE remote_path = ?",
+                (state, time(), error, remote_path),
+            )
+
+    def unfinished(self):
+        """
+        :return: The (remote path, action code) of every action that is not done, in plan order
+        """
+        placeholders = ", ".join("?" for state in ActionStates.UNFINISHED_STATES)
+        with self._lock:
+            return self._db.execute(
+                "SELECT remote_path, action_code FROM actions"
+                " WHERE state IN ({}) ORDER BY position".format(placeholders),
+                ActionStates.UNFINISHED_STATES,
+            ).fetchall()
+
+    def counts(self):
+        """
+        :return: A dict of the number of actions in each state
+        """
+        with self._lock:
+            return dict(
+                self._db.execute("SELECT state, COUNT(*) FROM actions GROUP BY state")
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
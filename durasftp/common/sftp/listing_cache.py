@@ -0,0 +1,152 @@
+import json
+import sqlite3
+from threading import Lock
+from time import time
+
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.attr_tree import AttrEntry, entry_attrs, entry_name
+
+logger = get_logger(__name__)
+
+REMOTE = "remote"
+LOCAL = "local"
+
+# A directory that changed within this many seconds of being listed may have changed again
+#   within the same mtime, so its listing is never reused
+RACY_SECONDS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    side TEXT NOT NULL,
+    dir_path TEXT NOT NULL,
+    dir_mtime REAL NOT NULL,
+    listed_at REAL NOT NULL,
+    entries TEXT NOT NULL,
+    PRIMARY KEY (side, dir_path)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+class ListingCache:
+    """
+    An on-disk SQLite cache of directory listings, kept between runs. The listing of a directory
+      is reused as long as the directory's own mtime has not changed, which is the case as long
+      as no entry was added to it, removed from it, or renamed in it.
+    Modifying a file in place does not change the mtime of its directory on most filesystems,
+      so such changes are only seen once the directory changes for another reason, or on a
+      full rescan. Set full_rescan_every to bound how long that can take.
+    """
+
+    def __init__(self, cache_path, full_rescan_every=None):
+        """
+        :param cache_path: The path of the SQLite database, created if it does not exist
+        :param full_rescan_every: List every directory again on every Nth run, never if None
+        """
+        self.cache_path = cache_path
+        self.full_rescan_every = full_rescan_every
+        self.full_rescan = False
+        self.hits = 0
+        self.misses = 0
+        self._visited = {REMOTE: set(), LOCAL: set()}
+        self._lock = Lock()
+        # Remote directories are listed from several threads, every access goes through the lock
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def start_run(self):
+        """
+        Counts a new run, and decides whether it must be a full rescan
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO runs (key, value) VALUES ('run_count', 0)"
+            )
+            self._db.execute(
+                "UPDATE runs SET value = value + 1 WHERE key = 'run_count'"
+            )
+            (run_count,) = self._db.execute(
+                "SELECT value FROM runs WHERE key = 'run_count'"
+            ).fetchone()
+        self.full_rescan = bool(self.full_rescan_every) and (
+            run_count % self.full_rescan_every == 0
+        )
+        self.hits = 0
+        self.misses = 0
+        self._visited = {REMOTE: set(), LOCAL: set()}
+        if self.full_rescan:
+            logger.info("Run {} is a full rescan".format(run_count))
+
+    def get(self, side, dir_path, dir_mtime):
+        """
+        Looks up the cached listing of a directory
+        :param side: REMOTE or LOCAL
+        :param dir_path: The remote path of the directory
+        :param dir_mtime: The directory's current mtime
+        :return: The AttrEntries of the directory, or None if it must be listed again
+        """
+        with self._lock:
+            self._visited[side].add(dir_path)
+            row = None
+            if not self.full_rescan:
+                row = self._db.execute(
+                    "SELECT dir_mtime, listed_at, entries FROM listings"
+                    " WHERE side = ? AND dir_path = ?",
+                    (side, dir_path),
+                ).fetchone()
+            if row is None or row[0] != dir_mtime or dir_mtime + RACY_SECONDS >= row[1]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [AttrEntry(*attrs) for attrs in json.loads(row[2])]
+
+    def put(self, side, dir_path, dir_mtime, entries):
+        """
+        Caches the listing of a directory. Listings are only written to disk by finish_run.
+        :param side: REMOTE or LOCAL
+        :param dir_path: The remote path of the directory
+        :param dir_mtime: The directory's mtime, from before it was listed
+        :param entries: The SFTPAttributes or os.DirEntry of each child
+        """
+        encoded_entries = json.dumps(
+            [[entry_name(entry)] + list(entry_attrs(entry)) for entry in entries],
+            separators=(",", ":"),
+        )
+        with self._lock:
+            self._visited[side].add(dir_path)
+            self._db.execute(
+                "INSERT OR REPLACE INTO listings"
+                " (side, dir_path, dir_mtime, listed_at, entries) VALUES (?, ?, ?, ?, ?)",
+                (side, dir_path, dir_mtime, time(), encoded_entries),
+            )
+
+    def finish_run(self):
+        """
+        Forgets the directories that were not seen during this run, and saves the cache
+        """
+        with self._lock, self._db:
+            for side, visited in self._visited.items():
+                cached_paths = self._db.execute(
+                    "SELECT dir_path FROM listings WHERE side = ?", (side,)
+                ).fetchall()
+                self._db.executemany(
+                    "DELETE FROM listings WHERE side = ? AND dir_path = ?",
+                    [
+                        (side, dir_path)
+                        for (dir_path,) in cached_paths
+                        if dir_path not in visited
+                    ],
+                )
+        logger.info(
+            "Listing cache: {} directories reused, {} listed".format(
+                self.hits, self.misses
+            )
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,116 @@
+import posixpath
+from collections import OrderedDict
+from stat import S_ISLNK
+from threading import Lock
+from time import monotonic
+
+STAT = "stat"
+LSTAT = "lstat"
+LISTDIR = "listdir"
+
+# Cached in place of the attributes of a path that does not exist
+NOT_FOUND = object()
+
+
+def cache_key_path(remote_path):
+    """
+    :return: The normalized remote path to cache under, or None if the path is relative,
+      since a relative path changes meaning with the working directory
+    """
+    if not remote_path.startswith("/"):
+        return None
+    return posixpath.normpath(remote_path)
+
+
+class MetadataCache:
+    """
+    A bounded, in memory cache of remote stat, lstat and listdir_attr results, which saves a
+      round trip for every question that was asked recently. Listings also fill in the stat
+      of each entry in them.
+    Entries expire after ttl seconds, and the least recently used entries are evicted once the
+      cache is full. The connections that share a cache invalidate the paths that they change,
+      but changes made by anything else are only seen once the cached entries expire.
+    """
+
+    def __init__(self, ttl=5, max_entries=10000):
+        """
+        :param ttl: The seconds to keep each entry for
+        :param max_entries: The most entries to keep, each listing counts as one entry
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, kind, remote_path):
+        """
+        :param kind: STAT, LSTAT or LISTDIR
+        :param remote_path: The normalized remote path
+        :return: The cached SFTPAttributes, or list of them for LISTDIR, NOT_FOUND if the path
+          is known to be missing, or None if it is not cached
+        """
+        key = (kind, remote_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, kind, remote_path, value):
+        """
+        :param kind: STAT, LSTAT or LISTDIR
+        :param remote_path: The normalized remote path
+        :param value: The SFTPAttributes, list of them for LISTDIR, or NOT_FOUND
+        """
+        with self._lock:
+            self._put((kind, remote_path), value)
+
+    def put_listing(self, dir_path, entries):
+        """
+        Caches the listing of a directory, and the attributes of each entry in it
+        :param dir_path: The normalized remote path of the directory
+        :param entries: The SFTPAttributes of each entry, from listdir_attr
+        """
+        with self._lock:
+            self._put((LISTDIR, dir_path), entries)
+            for entry in entries:
+                entry_path = posixpath.join(dir_path, entry.filename)
+                self._put((LSTAT, entry_path), entry)
+                if not S_ISLNK(entry.st_mode or 0):
+                    # Only a symlink's stat differs from its lstat
+                    self._put((STAT, entry_path), entry)
+
+    def invalidate(self, remote_path, recursive=False):
+        """
+        Forgets everything about a path that changed, and about its directory
+        :param remote_path: The normalized remote path
+        :param recursive: Also forget everything below the path, for a directory that was
+          renamed or removed
+        """
+        with self._lock:
+            # The directory's own mtime changes along with its listing
+            for path in (remote_path, posixpath.dirname(remote_path)):
+                for kind in (STAT, LSTAT, LISTDIR):
+                    self._entries.pop((kind, path), None)
+            if recursive:
+                prefix = remote_path.rstrip("/") + "/"
+                for key in [key for key in self._entries if key[1].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _put(self, key, value):
+        self._entries[key] = (monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,234 @@
+import os
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from durasftp.common.log import get_logger
+
+logger = get_logger(__name__)
+
+# The upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, the way Prometheus histograms do
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for observations above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """
+        :return: The (upper bound, count of observations at or below it) of each bucket,
+          ending with "+Inf"
+        """
+        total = 0
+        cumulative = []
+        for upper_bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            cumulative.append((upper_bound, total))
+        return cumulative
+
+
+class ConnectionMetrics:
+    """
+    Counts the calls, latencies, retries, reconnects and bytes of DurableSFTPConnections.
+      One instance can be shared by every connection of a mirrorer. Read the attributes
+      directly, or export them in the Prometheus text format to a file or an HTTP endpoint.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: The upper bounds of the latency buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        # Keyed by method name
+        self.calls = {}
+        self.errors = {}
+        self.retries = {}
+        self.latency = {}
+        self.reconnects = 0
+        self.reconnect_latency = Histogram(self.buckets)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = Lock()
+
+    def record_call(self, method, seconds, failed=False):
+        """
+        :param method: The name of the connection method
+        :param seconds: How long the call took, including its retries
+        :param failed: True if the call raised
+        """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if failed:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            histogram = self.latency.get(method)
+            if histogram is None:
+                histogram = self.latency[method] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def record_retry(self, method):
+        with self._lock:
+            self.retries[method] = self.retries.get(method, 0) + 1
+
+    def record_reconnect(self, seconds):
+        with self._lock:
+            self.reconnects += 1
+            self.reconnect_latency.observe(seconds)
+
+    def add_bytes_in(self, count):
+        with self._lock:
+            self.bytes_in += count
+
+    def add_bytes_out(self, count):
+        with self._lock:
+            self.bytes_out += count
+
+    def to_prometheus(self):
+        """
+        :return: Every metric, in the Prometheus text exposition format
+        """
+        with self._lock:
+            lines = []
+            add_metric(
+                lines,
+                "durasftp_calls_total",
+                "counter",
+                "Calls to each connection method",
+                [({"method": method}, count) for method, count in self.calls.items()],
+            )
+            add_metric(
+                lines,
+                "durasftp_errors_total",
+                "counter",
+                "Calls to each connection method that failed after every retry",
+                [({"method": method}, count) for method, count in self.errors.items()],
+            )
+            add_metric(
+                lines,
+                "durasftp_retries_total",
+                "counter",
+                "Retries of each connection method",
+                [({"method": method}, count) for method, count in self.retries.items()],
+            )
+            add_histogram(
+                lines,
+                "durasftp_call_duration_seconds",
+                "How long each connection method took, including its retries",
+                [
+                    ({"method": method}, histogram)
+                    for method, histogram in self.latency.items()
+                ],
+            )
+            add_metric(
+                lines,
+                "durasftp_reconnects_total",
+                "counter",
+                "Transports rebuilt",
+                [({}, self.reconnects)],
+            )
+            add_histogram(
+                lines,
+                "durasftp_reconnect_duration_seconds",
+                "How long each reconnect took",
+                [({}, self.reconnect_latency)],
+            )
+            add_metric(
+                lines,
+                "durasftp_received_bytes_total",
+                "counter",
+                "Bytes downloaded",
+                [({}, self.bytes_in)],
+            )
+            add_metric(
+                lines,
+                "durasftp_sent_bytes_total",
+                "counter",
+                "Bytes uploaded",
+                [({}, self.bytes_out)],
+            )
+        return "".join(line + "\n" for line in lines)
+
+    def write_prometheus(self, path):
+        """
+        Writes every metric to a file, for the node exporter's textfile collector for example.
+          The file is replaced at once, so a scrape never reads half of it.
+        """
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """
+        Serves every metric over HTTP from a background thread, on any path
+        :return: The HTTP server, call shutdown() on it to stop serving
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request: {}".format(format % args))
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(
+            "Serving metrics on http://{}:{}/metrics".format(*server.server_address)
+        )
+        return server
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in labels.items()
+        )
+    )
+
+
+def add_metric(lines, name, metric_type, help_text, samples):
+    lines.append("# HELP {} {}".format(name, help_text))
+    lines.append("# TYPE {} {}".format(name, metric_type))
+    for labels, value in samples:
+        lines.append("{}{} {}".format(name, format_labels(labels), value))
+
+
+def add_histogram(lines, name, help_text, samples):
+    lines.append("# HELP {} {}".format(name, help_text))
+    lines.append("# TYPE {} histogram".format(name))
+    for labels, histogram in samples:
+        for upper_bound, count in histogram.cumulative_counts():
+            bucket_labels = dict(labels, le=upper_bound)
+            lines.append(
+                "{}_bucket{} {}".format(name, format_labels(bucket_labels), count)
+            )
+        lines.append("{}_sum{} {}".format(name, format_labels(labels), histogram.sum))
+        lines.append(
+            "{}_count{} {}".format(name, format_labels(labels), histogram.count)
+        )
@@ -6,19 +6,56 @@ Mirrors an SFTP server
 
 import argparse
 import stat
+import sys
 from argparse import ArgumentParser
-from collections import OrderedDict
-from os import scandir
-from os.path import join, isdir, realpath
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import scandir, stat as os_stat
+from os.path import basename, dirname, join, isdir, realpath
 
 import arrow
 import pysftp
+from paramiko import SSHException
 
-from durasftp.common.log import add_logger_args, get_logger
+from durasftp.common.log import add_logger_args, get_event_logger, get_logger
 from durasftp.common.sftp.action import SFTPAction
 from durasftp.common.sftp.action_codes import SFTPActionCodes
 from durasftp.common.sftp.action_list import SFTPActionList
-from durasftp.common.sftp.connection import DurableSFTPConnection
+from durasftp.common.sftp import diff_engine
+from durasftp.common.sftp.attr_tree import AttrEntry, AttrTree, entry_attrs
+from durasftp.common.sftp.connection import DurableSFTPConnection, is_partial_path
+from durasftp.common.sftp.connection_pool import DurableSFTPConnectionPool
+from durasftp.common.sftp.filters import add_filter_args, path_filter_from_args
+from durasftp.common.sftp.find_listing import FindLister, FindUnavailable
+from durasftp.common.sftp.hash_cache import HashCache
+from durasftp.common.sftp.hashing import (
+    COMPARE_HASH,
+    COMPARE_MODES,
+    COMPARE_SIZE_MTIME,
+    HASH_COMMANDS,
+    LocalHasher,
+    VerifyStates,
+)
+from durasftp.common.sftp.journal import ActionStates, MirrorJournal
+from durasftp.common.sftp.listing_cache import LOCAL, ListingCache
+from durasftp.common.sftp.metadata_cache import MetadataCache
+from durasftp.common.sftp.metrics import ConnectionMetrics
+from durasftp.common.sftp.moves import MOVE_MIN_SIZE, MoveDetector, fingerprint
+from durasftp.common.sftp.pipeline import MirrorPipeline
+from durasftp.common.sftp.profiler import (
+    RunProfiler,
+    add_profiler_args,
+    cprofiled,
+    profiled_phase,
+    profiled_run,
+    profiler_from_args,
+)
+from durasftp.common.sftp.segmented import (
+    DEFAULT_SEGMENT_SIZE,
+    SegmentedDownload,
+    SegmentedUpload,
+)
+from durasftp.common.sftp.walker import RemoteTreeWalker
 
 EPILOG = __doc__
 
@@ -29,6 +66,7 @@ cnopts.hostkeys = None
 # Leverage the logger module to avoid print statements
 #
 logger = get_logger(__name__)
+events = get_event_logger(__name__)
 
 
 def entry_is_dir(entry):
@@ -43,30 +81,138 @@ class Mirrorer:
     WITH_TIMES = "WITH_TIMES"
     WITH_PERMS = "WITH_PERMS"
 
-    def __init__(self, local_base, options=[], timeout=15, **kwargs):
-        logger.info("Opening sftp://{}:{}".format(kwargs["host"], kwargs["port"]))
-        self.conn = DurableSFTPConnection(cnopts=cnopts, timeout=timeout, **kwargs)
+    def __init__(
+        self,
+        local_base,
+        options=[],
+        timeout=15,
+        workers=1,
+        conn=None,
+        listing_cache=None,
+        root="/",
+        path_filter=None,
+        segment_threshold=None,
+        segment_connections=4,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        channels=False,
+        metadata_cache=None,
+        metrics=None,
+        profiler=None,
+        find_listing=False,
+        compare=COMPARE_SIZE_MTIME,
+        hash_cache=None,
+        hash_processes=None,
+        detect_moves=False,
+        **kwargs
+    ):
+        """
+        :param local_base: The local directory to mirror with
+        :param timeout: The socket timeout of each connection, in seconds
+        :param workers: The default number of files to transfer at the same time
+        :param conn: An already open connection to use, instead of opening one from kwargs
+        :param listing_cache: A ListingCache to reuse the listings of unchanged directories from
+        :param root: The remote directory to mirror, which is mirrored to the same path below local_base
+        :param path_filter: A PathFilter of the paths to leave out of the mirror
+        :param segment_threshold: Transfer files of at least this many bytes in segments,
+          over several connections at once. Never if None
+        :param segment_connections: The most connections to transfer each segmented file over
+        :param segment_size: The number of bytes in each segment
+        :param channels: Open the pool's extra connections as SFTP channels on the transport of
+          the first connection, instead of as connections of their own
+        :param metadata_cache: A MetadataCache that every connection shares, to answer
+          repeated stat, exists, isdir, isfile and listdir_attr questions from. It is emptied
+          at the start of each run.
+        :param metrics: A ConnectionMetrics that every connection counts its calls,
+          latencies, retries, reconnects and bytes in
+        :param profiler: A RunProfiler to record the cost of each phase of each run with,
+          by default one that records wall time, CPU time and peak RSS only
+        :param find_listing: List the remote tree with a single find command run over exec,
+          falling back to listing it over SFTP if the server does not allow it
+        :param compare: How to tell whether files match, COMPARE_SIZE_MTIME by their sizes and
+          mtimes, or COMPARE_HASH by hashing the files of the same size on both sides, on the
+          server with hash_many, falling back to sizes and mtimes if the server cannot
+        :param hash_cache: A HashCache to reuse the hashes of unchanged local files from
+        :param hash_processes: The number of processes to hash local files with, by default
+          one per core
+        :param detect_moves: Rename the files that were moved on the source at their old paths
+          on the destination, instead of transferring them again to their new paths
+        :param kwargs: The host, port and credentials of the SFTP server
+        """
+        self.connection_kwargs = dict(
+            cnopts=cnopts,
+            timeout=timeout,
+            metadata_cache=metadata_cache,
+            metrics=metrics,
+            **kwargs
+        )
+        if conn is None:
+            logger.info("Opening sftp://{}:{}".format(kwargs["host"], kwargs["port"]))
+            conn = self.open_connection()
+        else:
+            if metadata_cache is not None:
+                conn.metadata_cache = metadata_cache
+            if metrics is not None:
+                conn.metrics = metrics
+        if compare not in COMPARE_MODES:
+            raise ValueError("Unknown comparison: {}".format(compare))
+        self.conn = conn
+        self.metadata_cache = metadata_cache
+        self.metrics = metrics
+        self.profiler = profiler if profiler is not None else RunProfiler()
+        self.workers = workers
+        self.segment_threshold = segment_threshold
+        self.segment_connections = segment_connections
+        self.segment_size = segment_size
+        self.channels = channels
+        if channels:
+            # The pool's first worker shares its transport with the channels it opens
+            self.conn.shares_transport = True
+        self.pool = DurableSFTPConnectionPool(
+            self.pool_size(workers),
+            self.conn.open_channel if channels else self.open_connection,
+            connections=[self.conn],
+        )
         # Realpath here ensures that trailing slashes will not cause issues
         self.local_base = realpath(local_base)
         self.action_list = SFTPActionList(self)
-        self.remote_attr_tree = OrderedDict()
-        self.local_attr_tree = OrderedDict()
+        self.remote_attr_tree = AttrTree()
+        self.local_attr_tree = AttrTree()
         self.options = options
+        self.listing_cache = listing_cache
+        self.root = "/" + root.strip("/")
+        self.path_filter = path_filter
+        self.find_listing = find_listing
+        self.compare = compare
+        self.hash_cache = hash_cache
+        self.detect_moves = detect_moves
+        self.local_hasher = LocalHasher(hash_cache, processes=hash_processes)
+        # Plan whole trees with NumPy when it is installed
+        self.use_diff_engine = diff_engine.is_available()
         self.conn.listdir("/")
         if self.conn and self.conn._transport:
             transport = self.conn._transport
             sock = transport.sock
             logger.info(
                 "Opened sftp://{}:{} on socket: {}".format(
-                    kwargs["host"], kwargs["port"], sock.fileno()
+                    kwargs.get("host"), kwargs.get("port"), sock.fileno()
                 )
             )
 
-    def rmtree(self, remote_dir):
+    def open_connection(self):
+        """
+        Opens a new connection to the SFTP server, with the same settings as the mirrorer's own connection
+        :rtype: DurableSFTPConnection
+        """
+        return DurableSFTPConnection(**self.connection_kwargs)
+
+    def rmtree(self, remote_dir, conn=None):
         """
         Deletes all files and directories on a remote server recursively
         :param remote_dir: The remote directory to delete
+        :param conn: The connection to delete with, defaults to the mirrorer's connection
         """
+        if conn is None:
+            conn = self.conn
         files_to_delete = []
         dirs_to_delete = []
 
@@ -77,13 +223,13 @@ class Mirrorer:
             files_to_delete.append(remote_path)
 
         # First, write down every file and directory
-        self.conn.walktree(remote_dir, mark_to_remove, mark_to_rmdir, None)
+        conn.walktree(remote_dir, mark_to_remove, mark_to_rmdir, None)
         mark_to_rmdir(remote_dir)
 
         # Files are always safe to delete
         for remote_file_path in files_to_delete:
             logger.info("Removing: {}".format(remote_file_path))
-            self.conn.remove(remote_file_path)
+            conn.remove(remote_file_path)
 
         # Dirs need their children deleted first, since they must be empty
         # By sorting the paths by length, we ensure that child directories are deleted first
@@ -92,7 +238,7 @@ class Mirrorer:
         )
         for remote_dir_path in sorted_dirs:
             logger.info("Removing Dir: {}".format(remote_dir_path))
-            self.conn.rmdir(remote_dir_path)
+            conn.rmdir(remote_dir_path)
 
     def entries_match(self, local_entry, remote_entry):
         """
@@ -135,47 +281,232 @@ class Mirrorer:
         # TODO: Join these
         return self.local_base + remote_path
 
-    def load_remote_dir_listing(self, remote_path):
+    def walker(self, concurrency=1):
+        """
+        :return: A RemoteTreeWalker that shares the mirrorer's pool, listing cache and filter
+        :rtype: RemoteTreeWalker
+        """
+        return RemoteTreeWalker(
+            self.pool,
+            concurrency=concurrency,
+            listing_cache=self.listing_cache,
+            path_filter=self.path_filter,
+        )
+
+    def filter_entries(self, remote_path, entries):
+        """
+        Leaves out the entries of a directory listing that the path filter excludes
+        :param remote_path: The remote path of the listed directory
+        """
+        if self.path_filter is None:
+            return entries
+        return self.path_filter.filter_entries(remote_path, entries)
+
+    def load_remote_dir_listing(self, remote_path, workers=1):
         """
         Recursively loads the entire directory and subdirectory listing of a remote dir,
           and loads the results into the remote_attr_tree
         :param remote_path: A remote directory path
+        :param workers: The number of directories to list at the same time, each over its own connection
+        """
+        if self.find_listing and self.load_remote_tree_with_find(remote_path):
+            return
+        if workers > 1 or self.listing_cache is not None:
+            self.pool.size = max(self.pool.size, workers)
+            self.walker(concurrency=workers).load_tree(
+                remote_path, self.remote_attr_tree
+            )
+            return
+        self.load_remote_dir_listing_over_sftp(remote_path)
+
+    def load_remote_dir_listing_over_sftp(self, remote_path):
+        """
+        Recursively lists a remote dir over SFTP, one directory at a time, and loads the
+          results into the remote_attr_tree
+        :param remote_path: A remote directory path
         """
         logger.info("Loading remote: {}".format(remote_path))
-        remote_listing = self.conn.listdir_attr(remote_path)
-        for remote_entry in remote_listing:
+        remote_listing = [
+            remote_entry
+            for remote_entry in self.conn.listdir_attr(remote_path)
+            if not is_partial_path(remote_entry.filename)
+        ]
+        for remote_entry in self.filter_entries(remote_path, remote_listing):
             remote_entry_path = join(remote_path, remote_entry.filename)
             self.remote_attr_tree[remote_entry_path] = remote_entry
             if entry_is_dir(remote_entry):
-                self.load_remote_dir_listing(remote_entry_path)
+                self.load_remote_dir_listing_over_sftp(remote_entry_path)
 
-    def load_local_dir_listing(self, remote_path):
+    def load_remote_tree_with_find(self, remote_path):
+        """
+        Lists the tree under a remote dir with a single find command, and loads the results
+          into the remote_attr_tree. A server that refuses the command is not asked again.
+        :param remote_path: A remote directory path
+        :return: True if the tree was loaded, False if it must be listed over SFTP instead
+        """
+        # Nothing is loaded unless the whole listing succeeds
+        attr_tree = AttrTree()
+        for known_path, known_entry in self.remote_attr_tree.items():
+            attr_tree[known_path] = known_entry
+        try:
+            FindLister(self.conn, self.path_filter).load_tree(remote_path, attr_tree)
+        except FindUnavailable as ex:
+            logger.warning("Listing over SFTP, find is unavailable: {}".format(ex))
+            self.find_listing = False
+            return False
+        except (SSHException, EOFError, OSError) as ex:
+            logger.warning("Listing over SFTP, find failed: {}".format(ex))
+            return False
+        self.remote_attr_tree = attr_tree
+        return True
+
+    def load_local_dir_listing(self, remote_path, dir_mtime=None):
         """
         Recursively loads the entire directory and subdirectory listing of a local dir,
           and loads the results into the local_attr_tree
         :param remote_path: A remote directory path
+        :param dir_mtime: The current mtime of the local directory, if it is already known
+        """
+        if self.listing_cache is None:
+            local_entries, listed = self.list_local_dir(remote_path), True
+        else:
+            local_entries, listed = self.list_local_dir_cached(remote_path, dir_mtime)
+        for local_entry in local_entries:
+            child_remote_path = join(remote_path, local_entry.name)
+            self.local_attr_tree[child_remote_path] = local_entry
+            if local_entry.is_dir():
+                # Only a fresh listing knows the current mtime of each child
+                child_mtime = local_entry.stat().st_mtime if listed else None
+                self.load_local_dir_listing(child_remote_path, child_mtime)
+
+    def list_local_dir_cached(self, remote_path, dir_mtime=None):
+        """
+        Lists a single local directory, unless the listing cache has it and it has not changed
+        :param remote_path: A remote directory path
+        :param dir_mtime: The current mtime of the local directory, if it is already known
+        :return: The entries of the directory, and whether they were listed rather than cached
+        """
+        if dir_mtime is None:
+            try:
+                dir_mtime = os_stat(self.local_base + remote_path).st_mtime
+            except FileNotFoundError:
+                return [], True
+        # The cache keeps whole listings, so that it stays valid when the filter changes
+        local_entries = self.listing_cache.get(LOCAL, remote_path, dir_mtime)
+        listed = local_entries is None
+        if listed:
+            local_entries = self.read_local_dir(remote_path)
+            self.listing_cache.put(LOCAL, remote_path, dir_mtime, local_entries)
+        return self.filter_entries(remote_path, local_entries), listed
+
+    def list_local_dir(self, remote_path):
+        """
+        Lists a single local directory, leaving out unfinished transfers and filtered entries
+        :param remote_path: A remote directory path
+        :return: The DirEntry of each child, or nothing if the local directory does not exist
+        """
+        return self.filter_entries(remote_path, self.read_local_dir(remote_path))
+
+    def read_local_dir(self, remote_path):
+        """
+        Lists a single local directory, leaving out unfinished transfers
+        :param remote_path: A remote directory path
+        :return: The DirEntry of each child, or nothing if the local directory does not exist
         """
         logger.info("Loading local: {}".format(remote_path))
         local_path = self.local_base + remote_path
-        if isdir(local_path):
-            local_listing = scandir(local_path)
-            for local_entry in local_listing:
-                child_remote_path = self.remote_path_from_local(local_entry.path)
-                self.local_attr_tree[child_remote_path] = local_entry
-                if local_entry.is_dir():
-                    self.load_local_dir_listing(child_remote_path)
+        if not isdir(local_path):
+            return []
+        with scandir(local_path) as local_listing:
+            return [
+                local_entry
+                for local_entry in local_listing
+                if not is_partial_path(local_entry.name)
+            ]
+
+    def root_entries(self, root=None):
+        """
+        Looks up the root directory and each of its parents, on both sides. These are added
+          to the mirror, so that the root is created along with its parents when it is missing.
+        :param root: A remote directory path, defaults to the mirrorer's root
+        :return: A list of (remote path, remote entry, local entry) from the top down,
+          with None for entries that do not exist
+        """
+        if root is None:
+            root = self.root
+        root_entries = []
+        remote_path = ""
+        for name in root.strip("/").split("/"):
+            if not name:
+                continue
+            remote_path += "/" + name
+            root_entries.append(
+                (
+                    remote_path,
+                    self.stat_remote(remote_path),
+                    self.stat_local(remote_path),
+                )
+            )
+        return root_entries
+
+    def stat_remote(self, remote_path):
+        """
+        :return: The AttrEntry of a remote path, or None if it does not exist
+        """
+        try:
+            remote_stat = self.conn.stat(remote_path)
+        except FileNotFoundError:
+            return None
+        return AttrEntry(basename(remote_path), *entry_attrs(remote_stat))
+
+    def stat_local(self, remote_path):
+        """
+        :return: The AttrEntry of the local copy of a remote path, or None if it does not exist
+        """
+        try:
+            local_stat = os_stat(self.local_path_from_remote(remote_path))
+        except FileNotFoundError:
+            return None
+        return AttrEntry(basename(remote_path), *entry_attrs(local_stat))
+
+    def forget_remote_metadata(self):
+        """
+        Empties the metadata cache at the start of each run, so that a run started within its
+          ttl of the last one lists the remote as it is now
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.clear()
 
-    def load_stat_trees(self):
+    def load_stat_trees(self, workers=1):
         """
-        Completely scans both local and remote directories
+        Completely scans both local and remote directories, starting from the root
+        :param workers: The number of remote directories to list at the same time
         :return:
         """
-        # TODO: Add subdirectory loading, but default to "/"
         logger.info("Loading file listings")
-        self.remote_attr_tree = OrderedDict()
-        self.local_attr_tree = OrderedDict()
-        self.load_remote_dir_listing("/")
-        self.load_local_dir_listing("/")
+        self.forget_remote_metadata()
+        self.remote_attr_tree = AttrTree()
+        self.local_attr_tree = AttrTree()
+        if self.listing_cache is not None:
+            self.listing_cache.start_run()
+        if self.hash_cache is not None:
+            self.hash_cache.start_run()
+        root_is_remote_dir = root_is_local_dir = True
+        for remote_path, remote_entry, local_entry in self.root_entries():
+            if remote_entry is not None:
+                self.remote_attr_tree[remote_path] = remote_entry
+            if local_entry is not None:
+                self.local_attr_tree[remote_path] = local_entry
+            root_is_remote_dir = remote_entry is not None and remote_entry.is_dir()
+            root_is_local_dir = local_entry is not None and local_entry.is_dir()
+        if root_is_remote_dir:
+            with self.profiler.phase("load_remote_dir_listing"):
+                self.load_remote_dir_listing(self.root, workers=workers)
+        if root_is_local_dir:
+            with self.profiler.phase("load_local_dir_listing"):
+                self.load_local_dir_listing(self.root)
+        if self.listing_cache is not None:
+            self.listing_cache.finish_run()
 
     def action_from_remote_by_path(self, remote_path):
         """
@@ -186,9 +517,21 @@ class Mirrorer:
         :rtype: SFTPAction
         """
         remote_entry = self.remote_attr_tree[remote_path]
-        if remote_path in self.local_attr_tree:
+        local_entry = self.local_attr_tree.get(remote_path)
+        return self.action_from_remote(remote_path, remote_entry, local_entry)
+
+    def action_from_remote(self, remote_path, remote_entry, local_entry=None):
+        """
+        Calculates which SFTP action must be performed in order to mirror a remote
+          dir/file onto the local system
+        :param remote_path: A remote directory path
+        :param remote_entry: The remote SFTPAttributes of the path
+        :param local_entry: The local DirEntry of the path, or None if it does not exist locally
+        :return: The SFTP action to be performed later
+        :rtype: SFTPAction
+        """
+        if local_entry is not None:
             # Entry exists locally
-            local_entry = self.local_attr_tree[remote_path]
             if self.entries_match(local_entry, remote_entry):
                 return SFTPAction(
                     self,
@@ -234,9 +577,21 @@ class Mirrorer:
         :rtype: SFTPAction
         """
         local_entry = self.local_attr_tree[remote_path]
-        if remote_path in self.remote_attr_tree:
+        remote_entry = self.remote_attr_tree.get(remote_path)
+        return self.action_to_remote(remote_path, local_entry, remote_entry)
+
+    def action_to_remote(self, remote_path, local_entry, remote_entry=None):
+        """
+        Calculates which SFTP action must be performed in order to mirror a local
+          dir/file onto the remote system
+        :param remote_path: A remote directory path
+        :param local_entry: The local DirEntry of the path
+        :param remote_entry: The remote SFTPAttributes of the path, or None if it does not exist remotely
+        :return: The SFTP action to be performed later
+        :rtype: SFTPAction
+        """
+        if remote_entry is not None:
             # Entry exists remotely
-            remote_entry = self.remote_attr_tree[remote_path]
             if self.entries_match(local_entry, remote_entry):
                 return SFTPAction(
                     self,
@@ -273,73 +628,574 @@ class Mirrorer:
                     self, SFTPActionCodes.PUT, remote_path, local_entry=local_entry
                 )
 
-    def actions_to_mirror_from_remote(self):
+    def actions_by_diff(self, from_remote=True):
+        """
+        Calculates the SFTP actions for every path of the stat trees at once, with the diff engine.
+          This gives the same actions as calculating them path by path, but is much faster on
+          large trees.
+        :param from_remote: Mirror the remote tree onto the local one, rather than the other way
+        :return: A generator of SFTPActions, in the order of the tree being mirrored from
+        """
+        if from_remote:
+            source_tree, dest_tree = self.remote_attr_tree, self.local_attr_tree
+        else:
+            source_tree, dest_tree = self.local_attr_tree, self.remote_attr_tree
+        source_paths, action_codes, dest_positions = diff_engine.diff_trees(
+            source_tree, dest_tree, from_remote=from_remote
+        )
+        for position, remote_path in enumerate(source_paths):
+            action_code = action_codes[position]
+            if action_code is None:
+                continue
+            source_entry = source_tree.entry_at(position)
+            dest_position = dest_positions[position]
+            if dest_position == diff_engine.NOT_FOUND:
+                dest_entry = None
+            else:
+                dest_entry = dest_tree.entry_at(dest_position)
+            if from_remote:
+                remote_entry, local_entry = source_entry, dest_entry
+            else:
+                remote_entry, local_entry = dest_entry, source_entry
+            yield SFTPAction(
+                self,
+                action_code,
+                remote_path,
+                local_entry=local_entry,
+                remote_entry=remote_entry,
+            )
+
+    def compare_hashes(self, actions, from_remote=True):
+        """
+        Decides by their contents whether the files that are the same size on both sides match,
+          by hashing them on both sides. Files of different sizes are not hashed, since they
+          cannot match.
+        :param actions: A list of the SFTPActions planned by comparing sizes and mtimes
+        :param from_remote: Mirror the remote tree onto the local one, rather than the other way
+        :return: The actions, with those of the hashed files replaced by what their hashes require.
+          Files that could not be hashed on either side keep their planned action.
+        """
+        if not self.conn.can_hash:
+            return actions
+        candidates = [
+            position
+            for position, action in enumerate(actions)
+            if action.local_is_file
+            and action.remote_is_file
+            and action.local_entry.stat().st_size == action.remote_entry.st_size
+        ]
+        if not candidates:
+            return actions
+        try:
+            remote_hashes, local_hashes = self.hash_both_sides(
+                [actions[position].remote_path for position in candidates]
+            )
+        except (SSHException, EOFError, OSError) as ex:
+            logger.warning("Comparing sizes and mtimes, hashing failed: {}".format(ex))
+            return actions
+        if not remote_hashes and not self.conn.can_hash:
+            logger.warning("Comparing sizes and mtimes, the server cannot hash files")
+            return actions
+        changed_code = SFTPActionCodes.GET if from_remote else SFTPActionCodes.PUT
+        matched = changed = 0
+        for position in candidates:
+            action = actions[position]
+            remote_sha1 = remote_hashes.get(action.remote_path)
+            local_sha1 = local_hashes.get(action.remote_path)
+            if remote_sha1 is None or local_sha1 is None:
+                continue
+            if remote_sha1 == local_sha1:
+                action_code = SFTPActionCodes.OK
+                matched += 1
+            else:
+                action_code = changed_code
+                changed += 1
+            if action_code != action.action_code:
+                actions[position] = SFTPAction(
+                    self,
+                    action_code,
+                    action.remote_path,
+                    local_entry=action.local_entry,
+                    remote_entry=action.remote_entry,
+                )
+        events.info(
+            "hash_compare", files=len(candidates), matched=matched, changed=changed
+        )
+        return actions
+
+    def hash_both_sides(self, remote_paths, algo="sha1", local_paths=None):
+        """
+        Hashes files on both sides at the same time: on the server with hash_many, and locally
+          in a pool of processes, reusing the hashes of the hash cache
+        :param remote_paths: The remote paths of the remote files to hash
+        :param algo: A hash algorithm of HASH_COMMANDS, such as "sha1" or "sha256"
+        :param local_paths: The remote paths of the local files to hash, the same as
+          remote_paths by default
+        :return: A dict of the hex digest of each remote file, and one of each local file,
+          both by remote path and without the files that could not be hashed
+        """
+        if local_paths is None:
+            local_paths = remote_paths
+        local_paths = OrderedDict(
+            (self.local_path_from_remote(remote_path), remote_path)
+            for remote_path in local_paths
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            remote_hashes = executor.submit(self.conn.hash_many, remote_paths, algo)
+            local_hashes = self.local_hasher.hash_files(list(local_paths), algo)
+            return remote_hashes.result(), {
+                local_paths[local_path]: digest
+                for local_path, digest in local_hashes.items()
+            }
+
+    def find_moves(self, actions, from_remote=True):
+        """
+        Replaces the transfers of files that were moved on the source with renames of the files
+          left over at their old paths on the destination, as spotted by a MoveDetector
+        :param actions: A list of the planned SFTPActions
+        :param from_remote: Mirror the remote tree onto the local one, rather than the other way
+        :return: The actions, with renames in place of the transfers of moved files
+        """
+        if from_remote:
+            source_tree, dest_tree = self.remote_attr_tree, self.local_attr_tree
+            transfer_code, rename_code = SFTPActionCodes.GET, SFTPActionCodes.LRENAME
+        else:
+            source_tree, dest_tree = self.local_attr_tree, self.remote_attr_tree
+            transfer_code, rename_code = SFTPActionCodes.PUT, SFTPActionCodes.RRENAME
+        new_files = OrderedDict()
+        positions = {}
+        for position, action in enumerate(actions):
+            if action.action_code != transfer_code:
+                continue
+            if from_remote:
+                dest_exists, source_entry = action.local_exists, action.remote_entry
+            else:
+                dest_exists, source_entry = action.remote_exists, action.local_entry
+            if dest_exists:
+                continue
+            new_fingerprint = fingerprint(source_entry)
+            if new_fingerprint[0] >= MOVE_MIN_SIZE:
+                new_files[action.remote_path] = new_fingerprint
+                positions[action.remote_path] = position
+        if not new_files:
+            return actions
+        orphans = OrderedDict(
+            (remote_path, fingerprint(dest_entry))
+            for remote_path, dest_entry in dest_tree.items()
+            if stat.S_ISREG(entry_attrs(dest_entry)[0])
+            and remote_path not in source_tree
+        )
+        detector = MoveDetector(
+            self, from_remote=from_remote, confirm_all=self.compare == COMPARE_HASH
+        )
+        try:
+            moves = detector.find_moves(new_files, orphans)
+        except (SSHException, EOFError, OSError) as ex:
+            logger.warning(
+                "Transferring moved files again, hashing failed: {}".format(ex)
+            )
+            return actions
+        for new_path, orphan_path in moves:
+            action = actions[positions[new_path]]
+            actions[positions[new_path]] = SFTPAction(
+                self,
+                rename_code,
+                new_path,
+                local_entry=action.local_entry,
+                remote_entry=action.remote_entry,
+                rename_from=orphan_path,
+            )
+        events.info(
+            "find_moves",
+            new_files=len(new_files),
+            orphans=len(orphans),
+            moves=len(moves),
+        )
+        return actions
+
+    def refine_actions(self, actions, from_remote=True):
+        """
+        Revises the actions planned by comparing sizes and mtimes, by comparing contents
+          and by spotting moved files, as the mirrorer was asked to
+        :param actions: A list of the planned SFTPActions
+        :return: The revised actions
+        """
+        if self.compare == COMPARE_HASH:
+            with self.profiler.phase("compare_hashes"):
+                actions = self.compare_hashes(actions, from_remote=from_remote)
+        if self.detect_moves:
+            with self.profiler.phase("find_moves"):
+                actions = self.find_moves(actions, from_remote=from_remote)
+        self.finish_hashing()
+        return actions
+
+    @property
+    def refines_actions(self):
+        return self.compare == COMPARE_HASH or self.detect_moves
+
+    def finish_hashing(self):
+        """
+        Saves the hash cache, if anything was hashed since the stat trees were loaded
+        """
+        if self.hash_cache is not None and (
+            self.hash_cache.hits or self.hash_cache.misses
+        ):
+            self.hash_cache.finish_run()
+
+    def add_actions(self, actions):
+        """
+        Adds actions to the action list, leaving out the None of paths that need none
+        """
+        for action in actions:
+            if action is not None:
+                self.action_list.add(action)
+
+    def actions_to_mirror_from_remote(self, workers=1):
         """
         Loads entire directory structure for both local and remote sources
           and determines what SFTP actions will need to be performed to mirror
           the content of the remote server to the local server
+        :param workers: The number of remote directories to list at the same time
         :return: A list of SFTPActions
         :rtype: SFTPActionList
         """
-        # TODO: Allow subdirectory mirror
-        self.load_stat_trees()
+        self.load_stat_trees(workers=workers)
         self.action_list = SFTPActionList(self)
-        for remote_path in self.remote_attr_tree.keys():
-            action = self.action_from_remote_by_path(remote_path)
-            self.action_list.add(action)
+        with self.profiler.phase("build_actions"):
+            if self.use_diff_engine:
+                actions = self.actions_by_diff(from_remote=True)
+            else:
+                actions = (
+                    self.action_from_remote_by_path(remote_path)
+                    for remote_path in self.remote_attr_tree.keys()
+                )
+            if self.refines_actions:
+                actions = [action for action in actions if action is not None]
+            else:
+                self.add_actions(actions)
+        if self.refines_actions:
+            self.add_actions(self.refine_actions(actions, from_remote=True))
         return self.action_list
 
-    def actions_to_mirror_to_remote(self):
+    def actions_to_mirror_to_remote(self, workers=1):
         """
         Loads entire directory structure for both local and remote sources
           and determines what SFTP actions will need to be performed to mirror
           the content of the local server to the remote server
+        :param workers: The number of remote directories to list at the same time
         :return: A list of SFTPActions
         :rtype: SFTPActionList
         """
-        # TODO: Allow subdirectory mirror
-        self.load_stat_trees()
+        self.load_stat_trees(workers=workers)
         self.action_list = SFTPActionList(self)
-        for remote_path in self.local_attr_tree.keys():
-            action = self.action_to_remote_by_path(remote_path)
-            self.action_list.add(action)
+        with self.profiler.phase("build_actions"):
+            if self.use_diff_engine:
+                actions = self.actions_by_diff(from_remote=False)
+            else:
+                actions = (
+                    self.action_to_remote_by_path(remote_path)
+                    for remote_path in self.local_attr_tree.keys()
+                )
+            if self.refines_actions:
+                actions = [action for action in actions if action is not None]
+            else:
+                self.add_actions(actions)
+        if self.refines_actions:
+            self.add_actions(self.refine_actions(actions, from_remote=False))
         return self.action_list
 
-    def mirror_from_remote(self, callback=None, dry_run=False):
+    @profiled_run
+    def mirror_from_remote(
+        self,
+        callback=None,
+        dry_run=False,
+        workers=None,
+        streaming=False,
+        journal=None,
+        bulk_download=False,
+    ):
         """
         Mirrors from the remote server to the local server
         :param callback:
         :param dry_run:
+        :param workers: The number of files to transfer at the same time, each over its own connection
+        :param streaming: Start transferring each directory as soon as it is listed,
+          instead of listing both trees completely first
+        :param journal: A MirrorJournal to save the plan and its progress to, so that an
+          interrupted mirror can be resumed
+        :param bulk_download: Download the small files of each directory as a single tar
+          stream run over exec, falling back to downloading them file by file
         :return:
         """
         # TODO: Document params
-        # TODO: Add filter param fn
-        # TODO: Allow sync of subdirectories
-        self.actions_to_mirror_from_remote()
-        self.action_list.do_actions(callback=callback, dry_run=dry_run)
+        workers = self.use_workers(workers)
+        if streaming:
+            if journal is not None:
+                raise ValueError("Streaming mirrors cannot be journaled")
+            if bulk_download:
+                raise ValueError("Streaming mirrors cannot download in bulk")
+            if self.compare == COMPARE_HASH:
+                raise ValueError("Streaming mirrors cannot compare hashes")
+            if self.detect_moves:
+                raise ValueError("Streaming mirrors cannot detect moves")
+            self.forget_remote_metadata()
+            self.action_list = SFTPActionList(self)
+            pipeline = MirrorPipeline(
+                self, workers=workers, callback=callback, dry_run=dry_run
+            )
+            with self.profiler.phase("pipeline"):
+                pipeline.mirror_from_remote(self.root)
+            return
+        self.actions_to_mirror_from_remote(workers=workers)
+        if journal is not None and not dry_run:
+            self.action_list.save(journal, from_remote=True)
+        with self.profiler.phase("do_actions"):
+            self.action_list.do_actions(
+                callback=callback,
+                dry_run=dry_run,
+                workers=workers,
+                bulk_download=bulk_download,
+            )
 
-    def mirror_to_remote(self, callback=None, dry_run=False):
+    @profiled_run
+    def mirror_to_remote(
+        self, callback=None, dry_run=False, workers=None, streaming=False, journal=None
+    ):
         """
         Mirrors from the local server to the remote server
         :param callback:
         :param dry_run:
+        :param workers: The number of files to transfer at the same time, each over its own connection
+        :param streaming: Start transferring each directory as soon as it is listed,
+          instead of listing both trees completely first
+        :param journal: A MirrorJournal to save the plan and its progress to, so that an
+          interrupted mirror can be resumed
         :return:
         """
         # TODO: Document params
-        # TODO: Add filter param fn
-        # TODO: Allow sync of subdirectories
-        self.actions_to_mirror_to_remote()
-        self.action_list.do_actions(callback=callback, dry_run=dry_run)
+        workers = self.use_workers(workers)
+        if streaming:
+            if journal is not None:
+                raise ValueError("Streaming mirrors cannot be journaled")
+            if self.compare == COMPARE_HASH:
+                raise ValueError("Streaming mirrors cannot compare hashes")
+            if self.detect_moves:
+                raise ValueError("Streaming mirrors cannot detect moves")
+            self.forget_remote_metadata()
+            self.action_list = SFTPActionList(self)
+            pipeline = MirrorPipeline(
+                self, workers=workers, callback=callback, dry_run=dry_run
+            )
+            with self.profiler.phase("pipeline"):
+                pipeline.mirror_to_remote(self.root)
+            return
+        self.actions_to_mirror_to_remote(workers=workers)
+        if journal is not None and not dry_run:
+            self.action_list.save(journal, from_remote=False)
+        with self.profiler.phase("do_actions"):
+            self.action_list.do_actions(
+                callback=callback, dry_run=dry_run, workers=workers
+            )
+
+    @profiled_run
+    def resume(self, journal, callback=None, dry_run=False, workers=None):
+        """
+        Finishes an interrupted mirror from its journal. Only the paths of unfinished actions
+          are checked again, by listing their parent directories, rather than listing both trees.
+        :param journal: The MirrorJournal that the interrupted mirror was saved to
+        :param callback: Called with each action once it has been performed
+        :param dry_run: Only log what would have been done
+        :param workers: The number of files to transfer at the same time
+        :return: The actions that were still required
+        :rtype: SFTPActionList
+        """
+        local_base, from_remote = journal.plan()
+        if local_base != self.local_base:
+            raise ValueError(
+                "Journal {} is for {}, not {}".format(
+                    journal.journal_path, local_base, self.local_base
+                )
+            )
+        workers = self.use_workers(workers)
+        self.forget_remote_metadata()
+        unfinished_paths = [remote_path for remote_path, code in journal.unfinished()]
+        logger.info("Resuming {} unfinished actions".format(len(unfinished_paths)))
+        self.action_list = SFTPActionList(self)
+        with self.profiler.phase("recheck_actions"):
+            for remote_path, action in self.recheck_actions(
+                unfinished_paths, from_remote, workers
+            ):
+                if action is None or action.action_code == SFTPActionCodes.OK:
+                    # Finished before the interruption, or no longer needed
+                    if not dry_run:
+                        journal.mark(remote_path, ActionStates.DONE)
+                else:
+                    self.action_list.add(action)
+        if not dry_run:
+            self.action_list.journal = journal
+        with self.profiler.phase("do_actions"):
+            self.action_list.do_actions(
+                callback=callback, dry_run=dry_run, workers=workers
+            )
+        return self.action_list
+
+    @profiled_phase
+    def verify(self, algo="sha1", workers=None):
+        """
+        Checks that the local tree mirrors the remote one, by comparing the contents of every
+          file on both sides. Files of different sizes mismatch without being hashed.
+        :param algo: A hash algorithm of HASH_COMMANDS, such as "sha1" or "sha256"
+        :param workers: The number of remote directories to list at the same time
+        :return: An OrderedDict of the VerifyStates of each file, by remote path. Files that
+          could not be hashed on either side are UNVERIFIED.
+        """
+        if algo not in HASH_COMMANDS:
+            raise ValueError("Unknown hash algorithm: {}".format(algo))
+        workers = self.use_workers(workers)
+        self.load_stat_trees(workers=workers)
+        states = OrderedDict()
+        same_size_paths = []
+        for remote_path, remote_entry in self.remote_attr_tree.items():
+            if not entry_is_file(remote_entry):
+                continue
+            local_entry = self.local_attr_tree.get(remote_path)
+            if local_entry is None or not local_entry.is_file():
+                states[remote_path] = VerifyStates.MISSING_LOCAL
+            elif local_entry.stat().st_size != remote_entry.st_size:
+                states[remote_path] = VerifyStates.MISMATCH
+            else:
+                states[remote_path] = VerifyStates.UNVERIFIED
+                same_size_paths.append(remote_path)
+        for remote_path, local_entry in self.local_attr_tree.items():
+            if local_entry.is_file() and remote_path not in states:
+                states[remote_path] = VerifyStates.MISSING_REMOTE
+        remote_hashes, local_hashes = self.hash_both_sides(same_size_paths, algo)
+        for remote_path in same_size_paths:
+            remote_digest = remote_hashes.get(remote_path)
+            local_digest = local_hashes.get(remote_path)
+            if remote_digest is None or local_digest is None:
+                continue
+            if remote_digest == local_digest:
+                states[remote_path] = VerifyStates.MATCH
+            else:
+                states[remote_path] = VerifyStates.MISMATCH
+        self.finish_hashing()
+        counts = Counter(states.values())
+        events.info(
+            "verify",
+            files=len(states),
+            **{state.lower(): count for state, count in sorted(counts.items())}
+        )
+        return states
+
+    def recheck_actions(self, remote_paths, from_remote, workers=1):
+        """
+        Calculates the action that each path requires now, by listing only their parent directories
+        :param remote_paths: Remote paths, in the order that their actions should be calculated
+        :param from_remote: Mirror the remote onto the local, rather than the other way
+        :param workers: The number of remote directories to list at the same time
+        :return: A generator of (remote path, SFTPAction or None)
+        """
+        parent_paths = list(
+            OrderedDict.fromkeys(dirname(path) for path in remote_paths)
+        )
+        walker = self.walker(concurrency=workers)
+        remote_listings = {
+            parent_path: {entry.filename: entry for entry in entries}
+            for parent_path, entries in walker.list_dirs(parent_paths).items()
+        }
+        local_listings = {
+            parent_path: {
+                entry.name: entry for entry in self.list_local_dir(parent_path)
+            }
+            for parent_path in parent_paths
+        }
+        for remote_path in remote_paths:
+            parent_path, name = dirname(remote_path), basename(remote_path)
+            remote_entry = remote_listings[parent_path].get(name)
+            local_entry = local_listings[parent_path].get(name)
+            if from_remote:
+                if remote_entry is None:
+                    yield remote_path, None
+                else:
+                    yield remote_path, self.action_from_remote(
+                        remote_path, remote_entry, local_entry
+                    )
+            else:
+                if local_entry is None:
+                    yield remote_path, None
+                else:
+                    yield remote_path, self.action_to_remote(
+                        remote_path, local_entry, remote_entry
+                    )
+
+    def use_workers(self, workers=None):
+        """
+        Sizes the connection pool for a number of concurrent workers
+        :param workers: The number of workers, defaults to the number the mirrorer was created with
+        :return: The number of workers to use
+        """
+        if workers is None:
+            workers = self.workers
+        self.pool.size = self.pool_size(workers)
+        return workers
+
+    def pool_size(self, workers):
+        """
+        :return: The number of connections that a number of workers may use
+        """
+        if self.segment_threshold is None:
+            return max(workers, 1)
+        return max(workers, self.segment_connections, 1)
+
+    def download(self, conn, remote_path, local_path, file_size):
+        """
+        Downloads a file, in segments over several connections if it is large enough
+        :param conn: The connection to download over, which the caller holds
+        :param remote_path: The remote file to download
+        :param local_path: The local path to download it to
+        :param file_size: The size of the remote file
+        """
+        if self.segment_threshold is not None and file_size >= self.segment_threshold:
+            SegmentedDownload(
+                self.pool,
+                remote_path,
+                local_path,
+                max_connections=self.segment_connections,
+                segment_size=self.segment_size,
+            ).run(conn, preserve_mtime=True)
+        else:
+            conn.get(remote_path, local_path, preserve_mtime=True)
+
+    def upload(self, conn, local_path, remote_path, file_size):
+        """
+        Uploads a file, in segments over several connections if it is large enough
+        :param conn: The connection to upload over, which the caller holds
+        :param local_path: The local file to upload
+        :param remote_path: The remote path to upload it to
+        :param file_size: The size of the local file
+        """
+        if self.segment_threshold is not None and file_size >= self.segment_threshold:
+            SegmentedUpload(
+                self.pool,
+                local_path,
+                remote_path,
+                max_connections=self.segment_connections,
+                segment_size=self.segment_size,
+            ).run(conn, preserve_mtime=True)
+        else:
+            conn.put(local_path, remote_path, preserve_mtime=True)
 
     def close(self):
         """
-        Close the SFTP connection socket
+        Close the SFTP connection sockets
         """
         if self.conn._transport:
             transport = self.conn._transport
             sock = transport.sock
             logger.info("Closing socket: {}".format(sock.fileno()))
         self.conn.close()
+        self.pool.close()
 
 
 def parse_arguments():
@@ -357,20 +1213,144 @@ def parse_arguments():
         "--private-key-pass", help="Password to an encrypted private key file"
     )
     parser.add_argument("--port", default=22, help="SFTP port", type=int)
+    parser.add_argument(
+        "--workers",
+        default=1,
+        help="Number of files to transfer at the same time",
+        type=int,
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         default=False,
         help="Don't actually do anything, just print what would be done",
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        default=False,
+        help="Start transferring each directory as soon as it is listed",
+    )
+    parser.add_argument(
+        "--journal", help="SQLite file to record the mirror's progress in"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Finish the unfinished actions recorded in the journal",
+    )
+    parser.add_argument(
+        "--listing-cache",
+        help="SQLite file to keep directory listings in between runs",
+    )
+    parser.add_argument(
+        "--full-rescan-every",
+        type=int,
+        help="List every directory again on every Nth run that uses the listing cache",
+    )
+    parser.add_argument(
+        "--channels",
+        action="store_true",
+        default=False,
+        help="Multiplex the workers as SFTP channels over a single SSH connection",
+    )
+    parser.add_argument(
+        "--find-listing",
+        action="store_true",
+        default=False,
+        help="List the remote tree with a single find command over exec, when the server allows it",
+    )
+    parser.add_argument(
+        "--bulk-download",
+        action="store_true",
+        default=False,
+        help="Download the small files of each directory as a single tar stream over exec, when the server allows it",
+    )
+    parser.add_argument(
+        "--compare",
+        choices=COMPARE_MODES,
+        default=COMPARE_SIZE_MTIME,
+        help="Compare files by size and mtime, or by hashing the files of the same size on both sides",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        help="SQLite file to keep the hashes of local files in between runs",
+    )
+    parser.add_argument(
+        "--detect-moves",
+        action="store_true",
+        default=False,
+        help="Rename the files that were moved on the remote, instead of downloading them again",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        default=False,
+        help="Once the mirror is done, compare the contents of every file on both sides",
+    )
+    parser.add_argument(
+        "--hash-algorithm",
+        choices=sorted(HASH_COMMANDS),
+        default="sha1",
+        help="The hash algorithm to verify files with",
+    )
+    parser.add_argument(
+        "--metadata-cache-ttl",
+        type=float,
+        help="Answer repeated stat and listing questions from memory, for this many seconds",
+    )
+    parser.add_argument(
+        "--health-check-interval",
+        type=float,
+        help="Check idle connections every this many seconds, and reconnect dead ones ahead of time",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Write connection metrics to this file in the Prometheus text format, once the mirror is done",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve connection metrics in the Prometheus text format on this local port, while the mirror runs",
+    )
+    parser.add_argument(
+        "--segment-threshold",
+        type=int,
+        help="Transfer files of at least this many bytes in segments, over several connections at once",
+    )
+    parser.add_argument(
+        "--segment-connections",
+        default=4,
+        type=int,
+        help="The most connections to transfer each segmented file over",
+    )
+    add_filter_args(parser)
+    add_profiler_args(parser)
     add_logger_args(parser)
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.resume and args.journal is None:
+        parser.error("--resume requires --journal")
+    return args
 
 
 if __name__ == "__main__":
-    # TODO: Add subdirectory mirror
-    # TODO: Add regex filter option
     args = parse_arguments()
+    listing_cache = None
+    if args.listing_cache is not None:
+        listing_cache = ListingCache(args.listing_cache, args.full_rescan_every)
+    hash_cache = None
+    if args.hash_cache is not None:
+        hash_cache = HashCache(args.hash_cache)
+    metadata_cache = None
+    if args.metadata_cache_ttl is not None:
+        metadata_cache = MetadataCache(ttl=args.metadata_cache_ttl)
+    metrics = None
+    if args.metrics_file is not None or args.metrics_port is not None:
+        metrics = ConnectionMetrics()
+    if args.metrics_port is not None:
+        metrics.serve_prometheus(args.metrics_port)
     mirrorer = Mirrorer(
         local_base=args.local_base,
         host=args.host,
@@ -379,10 +1359,54 @@ if __name__ == "__main__":
         password=args.password,
         private_key=args.private_key,
         private_key_pass=args.private_key_pass,
+        workers=args.workers,
+        listing_cache=listing_cache,
+        root=args.root,
+        path_filter=path_filter_from_args(args),
+        segment_threshold=args.segment_threshold,
+        segment_connections=args.segment_connections,
+        channels=args.channels,
+        find_listing=args.find_listing,
+        compare=args.compare,
+        hash_cache=hash_cache,
+        detect_moves=args.detect_moves,
+        metadata_cache=metadata_cache,
+        health_check_interval=args.health_check_interval,
+        metrics=metrics,
+        profiler=profiler_from_args(args),
     )
-    mirrorer.mirror_from_remote(dry_run=False)
+    journal = None if args.journal is None else MirrorJournal(args.journal)
+    with cprofiled(args.profile):
+        if args.resume:
+            mirrorer.resume(journal)
+        else:
+            mirrorer.mirror_from_remote(
+                dry_run=False,
+                streaming=args.streaming,
+                journal=journal,
+                bulk_download=args.bulk_download,
+            )
     filtered_stuff = mirrorer.action_list
     for remote_path, action in filtered_stuff:
         # TODO: Improve UX
         print(action)
+    failed_paths = []
+    if args.verify:
+        for remote_path, state in mirrorer.verify(args.hash_algorithm).items():
+            if state != VerifyStates.MATCH:
+                print("{} {}".format(state, remote_path))
+            if state in VerifyStates.FAILED_STATES:
+                failed_paths.append(remote_path)
+    if args.profile_report is not None:
+        print(mirrorer.profiler.report())
     mirrorer.close()
+    if args.metrics_file is not None:
+        metrics.write_prometheus(args.metrics_file)
+    if journal is not None:
+        journal.close()
+    if listing_cache is not None:
+        listing_cache.close()
+    if hash_cache is not None:
+        hash_cache.close()
+    if failed_paths:
+        sys.exit(1)
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+from durasftp.common.sftp.attr_tree import entry_attrs
+
+# Empty files cost nothing to transfer, and all share the same few fingerprints
+MOVE_MIN_SIZE = 1
+
+
+def fingerprint(entry):
+    """
+    :param entry: The entry of a file, on either side
+    :return: The (size, whole second mtime) that a moved file keeps
+    """
+    st_mode, st_size, st_mtime = entry_attrs(entry)
+    return st_size, int(st_mtime)
+
+
+def group_by_fingerprint(new_files, orphans):
+    """
+    Groups the files to transfer with the files left over on the destination that have the
+      same fingerprint, which are probably the same files, moved
+    :param new_files: An OrderedDict of the fingerprint of each file that is missing on the
+      destination, by remote path
+    :param orphans: An OrderedDict of the fingerprint of each file that is only on the
+      destination, by remote path
+    :return: A list of (new paths, orphan paths) of each fingerprint that both have
+    """
+    orphans_by_fingerprint = OrderedDict()
+    for orphan_path, orphan_fingerprint in orphans.items():
+        orphans_by_fingerprint.setdefault(orphan_fingerprint, []).append(orphan_path)
+    new_by_fingerprint = OrderedDict()
+    for new_path, new_fingerprint in new_files.items():
+        if new_fingerprint in orphans_by_fingerprint:
+            new_by_fingerprint.setdefault(new_fingerprint, []).append(new_path)
+    return [
+        (new_paths, orphans_by_fingerprint[new_fingerprint])
+        for new_fingerprint, new_paths in new_by_fingerprint.items()
+    ]
+
+
+def match_by_hash(new_paths, orphan_paths, new_hashes, orphan_hashes):
+    """
+    Pairs each new file with an orphan that hashes the same, using each orphan once
+    :param new_hashes: A dict of the hex digest of new files, without those not hashed
+    :param orphan_hashes: A dict of the hex digest of orphans, without those not hashed
+    :return: A list of (new path, orphan path)
+    """
+    orphans_by_hash = OrderedDict()
+    for orphan_path in orphan_paths:
+        digest = orphan_hashes.get(orphan_path)
+        if digest is not None:
+            orphans_by_hash.setdefault(digest, []).append(orphan_path)
+    moves = []
+    for new_path in new_paths:
+        matching_orphans = orphans_by_hash.get(new_hashes.get(new_path))
+        if matching_orphans:
+            moves.append((new_path, matching_orphans.pop(0)))
+    return moves
+
+
+class MoveDetector:
+    """
+    Spots the files that were moved on the source since the last mirror, so that they can
+      be renamed on the destination instead of being transferred again. The mirror never
+      deletes, so a moved file is left over at its old path on the destination, with the
+      fingerprint of a file that is missing at its new path.
+    A file whose fingerprint is shared by several files, on either side, is only taken to
+      be moved once hashes confirm it. With confirm_all, every move is confirmed.
+    """
+
+    def __init__(self, mirrorer, from_remote=True, confirm_all=False):
+        """
+        :param mirrorer: The Mirrorer whose stat trees were planned from
+        :param from_remote: Whether the remote is mirrored onto the local, or the other way
+        :param confirm_all: Confirm every probable move with hashes, not only ambiguous ones
+        """
+        self.mirrorer = mirrorer
+        self.from_remote = from_remote
+        self.confirm_all = confirm_all
+
+    def find_moves(self, new_files, orphans):
+        """
+        :param new_files: An OrderedDict of the fingerprint of each file that is missing on
+          the destination, by remote path
+        :param orphans: An OrderedDict of the fingerprint of each file that is only on the
+          destination, by remote path
+        :return: A list of (new path, orphan path) of the files that were moved
+        """
+        moves = []
+        to_confirm = []
+        for new_paths, orphan_paths in group_by_fingerprint(new_files, orphans):
+            if len(new_paths) == 1 and len(orphan_paths) == 1 and not self.confirm_all:
+                moves.append((new_paths[0], orphan_paths[0]))
+            else:
+                to_confirm.append((new_paths, orphan_paths))
+        if to_confirm and self.mirrorer.conn.can_hash:
+            new_hashes, orphan_hashes = self.hash_candidates(to_confirm)
+            for new_paths, orphan_paths in to_confirm:
+                moves.extend(
+                    match_by_hash(new_paths, orphan_paths, new_hashes, orphan_hashes)
+                )
+        return moves
+
+    def hash_candidates(self, to_confirm):
+        """
+        Hashes the new files on the source, and the orphans on the destination
+        :return: A dict of the hex digest of each new file, and one of each orphan
+        """
+        new_paths = [path for new_paths, _ in to_confirm for path in new_paths]
+        orphan_paths = [path for _, orphan_paths in to_confirm for path in orphan_paths]
+        if self.from_remote:
+            return self.mirrorer.hash_both_sides(new_paths, local_paths=orphan_paths)
+        orphan_hashes, new_hashes = self.mirrorer.hash_both_sides(
+            orphan_paths, local_paths=new_paths
+        )
+        return new_hashes, orphan_hashes
@@ -0,0 +1,201 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from threading import BoundedSemaphore, Lock
+
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+
+logger = get_logger(__name__)
+
+
+class MirrorPipeline:
+    """
+    Mirrors a tree one directory at a time. Each directory is diffed as soon as both of its
+      listings are available, and its file actions are queued for the workers right away,
+      so that listing and transferring overlap.
+    Memory scales with the number of directories in flight, rather than the size of the tree:
+      no stat trees are kept, and only the actions that changed something are recorded
+      in the mirrorer's action list.
+    """
+
+    def __init__(
+        self,
+        mirrorer,
+        workers=1,
+        listing_workers=None,
+        max_queued_actions=None,
+        callback=None,
+        dry_run=False,
+    ):
+        """
+        :param mirrorer: The Mirrorer to plan and run actions with
+        :param workers: The number of file actions to run at the same time
+        :param listing_workers: The number of remote directories to list ahead, defaults to workers
+        :param max_queued_actions: How many file actions can wait for a worker before listing pauses
+        :param callback: Called with each action once it has been performed
+        :param dry_run: Only log what would have been done
+        """
+        self.mirrorer = mirrorer
+        self.workers = max(workers, 1)
+        self.listing_workers = max(listing_workers or self.workers, 1)
+        self.max_queued_actions = max_queued_actions or self.workers * 4
+        self.callback = callback
+        self.dry_run = dry_run
+        self.walker = mirrorer.walker(concurrency=self.listing_workers)
+        self.failures = []
+        self._callback_lock = Lock()
+        self._queue_slots = BoundedSemaphore(self.max_queued_actions)
+        self._listing_executor = None
+        self._action_executor = None
+
+    def mirror_from_remote(self, remote_path="/"):
+        """
+        Mirrors a remote directory onto the local system
+        """
+        self.run(remote_path, from_remote=True)
+
+    def mirror_to_remote(self, remote_path="/"):
+        """
+        Mirrors a local directory onto the remote system
+        """
+        self.run(remote_path, from_remote=False)
+
+    def run(self, remote_path, from_remote):
+        pool = self.mirrorer.pool
+        pool.size = max(pool.size, self.workers + self.listing_workers)
+        self._listing_executor = ThreadPoolExecutor(max_workers=self.listing_workers)
+        self._action_executor = ThreadPoolExecutor(max_workers=self.workers)
+        # Each entry is [remote dir path, whether it exists remotely, listing future]
+        frontier = deque()
+        try:
+            root_exists_remotely = self.mirror_root(remote_path, from_remote)
+            frontier.append([remote_path, root_exists_remotely, None])
+            while frontier and not self.failures:
+                self.prefetch_listings(frontier)
+                dir_path, exists_remotely, listing_future = frontier.popleft()
+                if exists_remotely:
+                    remote_entries = listing_future.result()[1]
+                else:
+                    remote_entries = []
+                local_entries = self.mirrorer.list_local_dir(dir_path)
+                if from_remote:
+                    self.mirror_dir_from_remote(
+                        dir_path, remote_entries, local_entries, frontier
+                    )
+                else:
+                    self.mirror_dir_to_remote(
+                        dir_path, remote_entries, local_entries, frontier
+                    )
+        finally:
+            for dir_path, exists_remotely, listing_future in frontier:
+                if listing_future is not None:
+                    listing_future.cancel()
+            self._listing_executor.shutdown(wait=True)
+            self._action_executor.shutdown(wait=True)
+        if self.failures:
+            raise self.failures[0]
+
+    def mirror_root(self, remote_path, from_remote):
+        """
+        Mirrors the root directory and each of its parents, before anything inside the root
+        :return: Whether the root is a directory on the remote
+        """
+        root_is_remote_dir = True
+        for dir_path, remote_entry, local_entry in self.mirrorer.root_entries(
+            remote_path
+        ):
+            if from_remote and remote_entry is not None:
+                action = self.mirrorer.action_from_remote(
+                    dir_path, remote_entry, local_entry
+                )
+            elif not from_remote and local_entry is not None:
+                action = self.mirrorer.action_to_remote(
+                    dir_path, local_entry, remote_entry
+                )
+            else:
+                action = None
+            if action is not None:
+                self.dispatch(action)
+            # A root that was only just created remotely is empty, so it need not be listed
+            root_is_remote_dir = remote_entry is not None and remote_entry.is_dir()
+        return root_is_remote_dir
+
+    def prefetch_listings(self, frontier):
+        """
+        Starts listing the next few remote directories, while the current one is being diffed
+        """
+        prefetched = 0
+        for frontier_entry in frontier:
+            if prefetched >= self.listing_workers * 2:
+                break
+            dir_path, exists_remotely, listing_future = frontier_entry
+            if exists_remotely:
+                if listing_future is None:
+                    frontier_entry[2] = self._listing_executor.submit(
+                        self.walker.list_dir, dir_path
+                    )
+                prefetched += 1
+
+    def mirror_dir_from_remote(self, dir_path, remote_entries, local_entries, frontier):
+        local_entries_by_name = {entry.name: entry for entry in local_entries}
+        for remote_entry in remote_entries:
+            remote_path = join(dir_path, remote_entry.filename)
+            local_entry = local_entries_by_name.get(remote_entry.filename)
+            action = self.mirrorer.action_from_remote(
+                remote_path, remote_entry, local_entry
+            )
+            if action is None:
+                continue
+            self.dispatch(action)
+            if action.remote_is_dir:
+                frontier.append([remote_path, True, None])
+
+    def mirror_dir_to_remote(self, dir_path, remote_entries, local_entries, frontier):
+        remote_entries_by_name = {entry.filename: entry for entry in remote_entries}
+        for local_entry in local_entries:
+            remote_path = join(dir_path, local_entry.name)
+            remote_entry = remote_entries_by_name.get(local_entry.name)
+            action = self.mirrorer.action_to_remote(
+                remote_path, local_entry, remote_entry
+            )
+            if action is None:
+                continue
+            self.dispatch(action)
+            if action.local_is_dir:
+                # A directory that replaced a remote file is empty, so it need not be listed
+                frontier.append([remote_path, action.remote_is_dir, None])
+
+    def dispatch(self, action):
+        """
+        Queues file actions for the workers. Directory actions are run right away,
+          since everything below them depends on them.
+        """
+        if action.action_code != SFTPActionCodes.OK:
+            self.mirrorer.action_list.add(action)
+        if action.action_code in SFTPActionCodes.FILE_ACTION_CODES:
+            self._queue_slots.acquire()
+            future = self._action_executor.submit(self.run_pooled_action, action)
+            future.add_done_callback(self.finish_action)
+        elif action.action_code == SFTPActionCodes.RMKDIR:
+            self.run_pooled_action(action)
+        else:
+            # OK and LMKDIR actions never touch the connection
+            action.run(callback=self.locked_callback, dry_run=self.dry_run)
+
+    def run_pooled_action(self, action):
+        if self.failures:
+            # Another action failed, skip whatever is still queued
+            return
+        with self.mirrorer.pool.connection() as conn:
+            action.run(callback=self.locked_callback, dry_run=self.dry_run, conn=conn)
+
+    def finish_action(self, future):
+        self._queue_slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            self.failures.append(future.exception())
+
+    def locked_callback(self, action):
+        if self.callback is not None:
+            with self._callback_lock:
+                self.callback(action)
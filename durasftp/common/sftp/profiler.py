@@ -0,0 +1,283 @@
+import cProfile
+import json
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter, process_time
+
+from durasftp.common.log import get_logger
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is not reported
+    resource = None
+
+logger = get_logger(__name__)
+
+
+def peak_rss_bytes():
+    """
+    :return: The most memory that this process has had resident so far, or None if unknown
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class PhaseProfile:
+    """
+    What one phase of a mirror run cost
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = None
+        self.traced_peak_bytes = None
+        # The (source line, bytes allocated, allocations) that grew the most, with trace_memory
+        self.top_allocators = []
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "traced_peak_bytes": self.traced_peak_bytes,
+            "top_allocators": [
+                {"location": location, "size_bytes": size, "count": count}
+                for location, size, count in self.top_allocators
+            ],
+        }
+
+
+class RunProfiler:
+    """
+    Records the wall time, CPU time and peak RSS of each phase of a mirror run, such as
+      listing each tree, building the actions and doing them. With trace_memory, tracemalloc
+      also records the peak traced memory of each phase, and the source lines that allocated
+      the most during it, at the price of a much slower run.
+    CPU time is for the whole process, so it includes the worker threads. Peak RSS is the
+      process's high-water mark at the end of the phase.
+    """
+
+    def __init__(self, trace_memory=False, top_allocators=10, report_path=None):
+        """
+        :param trace_memory: Trace allocations with tracemalloc
+        :param top_allocators: The number of source lines to report for each phase
+        :param report_path: A file to write the JSON report of each run to
+        """
+        self.trace_memory = trace_memory
+        self.top_allocators = top_allocators
+        self.report_path = report_path
+        self.run_name = None
+        self.phases = []
+        self._run_started_at = None
+        self._started_tracing = False
+        self._phase_depth = 0
+        self.run_wall_seconds = 0.0
+
+    def start_run(self, run_name):
+        self.run_name = run_name
+        self.phases = []
+        self._run_started_at = perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def finish_run(self):
+        """
+        Logs the report of the run, and writes its JSON report to report_path
+        """
+        self.run_wall_seconds = perf_counter() - self._run_started_at
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        logger.info(self.report())
+        if self.report_path is not None:
+            with open(self.report_path, "w") as report_file:
+                json.dump(self.to_dict(), report_file, indent=2)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Records what the code run inside of this context costs, as one phase of the run.
+          A phase inside of another one only counts toward the outer one.
+        """
+        profile = PhaseProfile(name)
+        if self._phase_depth:
+            yield profile
+            return
+        start_snapshot = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            if hasattr(tracemalloc, "reset_peak"):
+                # Python 3.9 and up, before that the peak is since the run started
+                tracemalloc.reset_peak()
+            start_snapshot = tracemalloc.take_snapshot()
+        started_at = perf_counter()
+        cpu_started_at = process_time()
+        self._phase_depth += 1
+        try:
+            yield profile
+        finally:
+            self._phase_depth -= 1
+            profile.wall_seconds = perf_counter() - started_at
+            profile.cpu_seconds = process_time() - cpu_started_at
+            profile.peak_rss_bytes = peak_rss_bytes()
+            if start_snapshot is not None:
+                profile.traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+                profile.top_allocators = self._top_allocators(start_snapshot)
+            self.phases.append(profile)
+
+    def _top_allocators(self, start_snapshot):
+        """
+        :return: The source lines whose allocations grew the most since start_snapshot
+        """
+        # Leave out the snapshots themselves
+        own_traces = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        differences = (
+            tracemalloc.take_snapshot()
+            .filter_traces(own_traces)
+            .compare_to(start_snapshot.filter_traces(own_traces), "lineno")
+        )
+        differences.sort(key=lambda difference: difference.size_diff, reverse=True)
+        return [
+            (
+                "{}:{}".format(
+                    difference.traceback[0].filename, difference.traceback[0].lineno
+                ),
+                difference.size_diff,
+                difference.count_diff,
+            )
+            for difference in differences[: self.top_allocators]
+            if difference.size_diff > 0
+        ]
+
+    def to_dict(self):
+        return {
+            "run": self.run_name,
+            "wall_seconds": self.run_wall_seconds,
+            "phases": [profile.to_dict() for profile in self.phases],
+        }
+
+    def report(self):
+        """
+        :return: A human readable summary of the last run
+        """
+        lines = [
+            "Profile of {} ({:.3f}s)".format(self.run_name, self.run_wall_seconds),
+            "{:<28} {:>10} {:>10} {:>12} {:>12}".format(
+                "phase", "wall s", "cpu s", "peak rss", "traced peak"
+            ),
+        ]
+        for profile in self.phases:
+            lines.append(
+                "{:<28} {:>10.3f} {:>10.3f} {:>12} {:>12}".format(
+                    profile.name,
+                    profile.wall_seconds,
+                    profile.cpu_seconds,
+                    format_bytes(profile.peak_rss_bytes),
+                    format_bytes(profile.traced_peak_bytes),
+                )
+            )
+            for location, size, count in profile.top_allocators:
+                lines.append(
+                    "    {:>10} in {:>7} blocks  {}".format(
+                        format_bytes(size), count, location
+                    )
+                )
+        return "\n".join(lines)
+
+
+def format_bytes(size):
+    if size is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return "{:.1f}{}".format(size, unit) if unit != "B" else "{}B".format(size)
+        size /= 1024
+
+
+def profiled_run(fn):
+    """
+    Profiles each call of a Mirrorer method as one run, made of the phases recorded inside of it
+    """
+
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        self.profiler.start_run(fn.__name__)
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            self.profiler.finish_run()
+
+    return wrapper
+
+
+def profiled_phase(fn):
+    """
+    Profiles each call of a Mirrorer method as one more phase of the last run, such as a
+      verify after a mirror, whose report is written again with it. Only a call made before
+      any run is profiled as a run of its own.
+    """
+
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler.run_name is None:
+            self.profiler.start_run(fn.__name__)
+        try:
+            with self.profiler.phase(fn.__name__):
+                return fn(self, *args, **kwargs)
+        finally:
+            self.profiler.finish_run()
+
+    return wrapper
+
+
+@contextmanager
+def cprofiled(dump_path):
+    """
+    Profiles the code run inside of this context with cProfile, and dumps its pstats to
+      dump_path. cProfile only sees the calling thread, not the worker threads.
+    :param dump_path: The file to dump the pstats to, or None to not profile
+    """
+    if dump_path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(dump_path)
+        logger.info("Wrote cProfile stats to {}".format(dump_path))
+
+
+def add_profiler_args(parser):
+    parser.add_argument(
+        "--profile",
+        help="Write a cProfile dump of the whole run to this file, to read with pstats or snakeviz",
+    )
+    parser.add_argument(
+        "--profile-report",
+        help="Write the time, CPU and memory of each phase of the run to this JSON file, and print a summary",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        default=False,
+        help="Report the top allocators of each phase with tracemalloc, which slows the run down",
+    )
+
+
+def profiler_from_args(args):
+    """
+    Builds a RunProfiler from the arguments added by add_profiler_args
+    """
+    return RunProfiler(trace_memory=args.trace_memory, report_path=args.profile_report)
@@ -0,0 +1,299 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from threading import Lock
+
+from durasftp.common import ONE_MB
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.connection import PARTIAL_STATE_SUFFIX, PARTIAL_SUFFIX
+
+logger = get_logger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 32 * ONE_MB
+
+
+def split_segments(file_size, segment_size):
+    """
+    :return: The (index, offset, length) of each segment of a file
+    """
+    return [
+        (index, offset, min(segment_size, file_size - offset))
+        for index, offset in enumerate(range(0, file_size, segment_size))
+    ]
+
+
+def preallocate(path, size):
+    """
+    Creates a local file of the given size, reserving its blocks up front where the
+      filesystem supports it, so that segments can be written into it in any order
+    """
+    with open(path, "wb") as local_file:
+        if size == 0:
+            return
+        try:
+            os.posix_fallocate(local_file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            # Not every platform or filesystem can reserve blocks, a sparse file works too
+            local_file.truncate(size)
+
+
+class SegmentedTransfer:
+    """
+    Transfers a single large file as several byte ranges at the same time, each over its own
+      pooled connection, so that one SSH channel's window and one CPU's crypto do not limit
+      the throughput. Subclasses transfer each segment.
+    """
+
+    def __init__(
+        self,
+        pool,
+        max_connections=4,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        callback=None,
+    ):
+        """
+        :param pool: The DurableSFTPConnectionPool to borrow the extra connections from
+        :param max_connections: The most connections to transfer over, including the caller's own
+        :param segment_size: The number of bytes in each segment
+        :param callback: Called with the bytes transferred so far and the size of the file,
+          each time a segment completes
+        """
+        self.pool = pool
+        self.max_connections = max_connections
+        self.segment_size = segment_size
+        self.callback = callback
+        self.file_size = 0
+        self.bytes_done = 0
+        self._lock = Lock()
+        self._failed = False
+
+    def transfer_segment(self, conn, offset, length):
+        """
+        :return: The number of bytes written
+        """
+        raise NotImplementedError()
+
+    def segment_done(self, index):
+        """
+        Called with the index of each segment once it is transferred, while holding the lock
+        """
+        pass
+
+    def transfer_segments(self, conn, segments):
+        """
+        Transfers segments over the caller's connection, and over as many idle pooled
+          connections as there are segments to share
+        :param conn: A connection that the caller holds
+        :param segments: The (index, offset, length) of each segment to transfer
+        """
+        pending_segments = deque(segments)
+        connections = [conn] + self._borrow_connections(
+            min(self.max_connections, len(pending_segments)) - 1
+        )
+        logger.info(
+            "Transferring {} segments over {} connections".format(
+                len(pending_segments), len(connections)
+            )
+        )
+        try:
+            with ThreadPoolExecutor(len(connections)) as executor:
+                futures = [
+                    executor.submit(
+                        self._transfer_pending_segments, segment_conn, pending_segments
+                    )
+                    for segment_conn in connections
+                ]
+                wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        # Stop the other connections after their current segment
+                        self._failed = True
+                        raise future.exception()
+        finally:
+            for segment_conn in connections[1:]:
+                self.pool.release(segment_conn)
+
+    def _borrow_connections(self, count):
+        """
+        Borrows up to count idle connections from the pool, without waiting. Waiting could
+          deadlock once every worker holds a connection and waits for another one.
+        """
+        connections = []
+        for _ in range(count):
+            conn = self.pool.acquire(block=False)
+            if conn is None:
+                break
+            connections.append(conn)
+        return connections
+
+    def _transfer_pending_segments(self, conn, pending_segments):
+        """
+        Transfers segments over one connection until none are left
+        """
+        while not self._failed:
+            try:
+                index, offset, length = pending_segments.popleft()
+            except IndexError:
+                return
+            written = self.transfer_segment(conn, offset, length)
+            if written != length:
+                raise IOError(
+                    "Segment at byte {} wrote {} of {} bytes".format(
+                        offset, written, length
+                    )
+                )
+            with self._lock:
+                self.segment_done(index)
+                self.bytes_done += length
+                if self.callback is not None:
+                    self.callback(self.bytes_done, self.file_size)
+
+
+class SegmentedDownload(SegmentedTransfer):
+    """
+    Downloads a single large file in segments. Segments are written into a preallocated
+      partial file next to the local path, which is moved into place once every segment is
+      complete. Each segment retries on its own through its connection's reconnect logic, and
+      the completed segments are recorded next to the partial file, so an interrupted download
+      only fetches the missing segments again, as long as the size and mtime of the remote
+      file have not changed.
+    """
+
+    def __init__(self, pool, remotepath, localpath, **kwargs):
+        """
+        :param pool: The DurableSFTPConnectionPool to borrow the extra connections from
+        :param remotepath: The remote file to download
+        :param localpath: The local path to download it to
+        :param kwargs: The max_connections, segment_size and callback of the transfer
+        """
+        super().__init__(pool, **kwargs)
+        self.remotepath = remotepath
+        self.localpath = localpath
+        self.partial_path = localpath + PARTIAL_SUFFIX
+        self.state_path = localpath + PARTIAL_STATE_SUFFIX
+        self.source_state = None
+        self.done_segments = set()
+
+    def run(self, conn, preserve_mtime=False):
+        """
+        Performs the download
+        :param conn: A connection that the caller holds, which downloads segments too
+        :param preserve_mtime: Give the local file the remote file's mtime
+        """
+        remote_attrs = conn.stat(self.remotepath)
+        self.file_size = remote_attrs.st_size
+        self.source_state = {
+            "size": self.file_size,
+            "mtime": remote_attrs.st_mtime,
+            "segment_size": self.segment_size,
+        }
+        done_segments = self._load_done_segments()
+        if done_segments is None:
+            preallocate(self.partial_path, self.file_size)
+            self.done_segments = set()
+            self._save_state()
+        else:
+            self.done_segments = done_segments
+        segments = split_segments(self.file_size, self.segment_size)
+        self.bytes_done = sum(
+            length for index, offset, length in segments if index in self.done_segments
+        )
+        pending_segments = [
+            segment for segment in segments if segment[0] not in self.done_segments
+        ]
+        logger.info(
+            "Downloading {} in segments, {} of {} segments left".format(
+                self.remotepath, len(pending_segments), len(segments)
+            )
+        )
+        self.transfer_segments(conn, pending_segments)
+
+        os.replace(self.partial_path, self.localpath)
+        os.remove(self.state_path)
+        if preserve_mtime:
+            os.utime(self.localpath, (remote_attrs.st_atime, remote_attrs.st_mtime))
+
+    def transfer_segment(self, conn, offset, length):
+        return conn.get_range(self.remotepath, self.partial_path, offset, length)
+
+    def segment_done(self, index):
+        self.done_segments.add(index)
+        self._save_state()
+
+    def _load_done_segments(self):
+        """
+        :return: The indexes of the segments that an interrupted download completed,
+          or None to start over
+        """
+        if not os.path.isfile(self.partial_path):
+            return None
+        try:
+            with open(self.state_path) as state_file:
+                recorded_state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        done_segments = recorded_state.pop("done_segments", None)
+        if done_segments is None or recorded_state != self.source_state:
+            logger.warning(
+                "Remote changed, restarting download: {}".format(self.remotepath)
+            )
+            return None
+        if os.stat(self.partial_path).st_size != self.file_size:
+            return None
+        return set(done_segments)
+
+    def _save_state(self):
+        state = dict(self.source_state, done_segments=sorted(self.done_segments))
+        with open(self.state_path, "w") as state_file:
+            json.dump(state, state_file)
+
+
+class SegmentedUpload(SegmentedTransfer):
+    """
+    Uploads a single large file in segments. The remote partial file is created at its full
+      size up front, each segment is written into it at its own offset, and it is renamed into
+      place once every segment is complete. A failed segment retries on its own through its
+      connection's reconnect logic, without sending the rest of the file again.
+    """
+
+    def __init__(self, pool, localpath, remotepath, **kwargs):
+        """
+        :param pool: The DurableSFTPConnectionPool to borrow the extra connections from
+        :param localpath: The local file to upload
+        :param remotepath: The remote path to upload it to
+        :param kwargs: The max_connections, segment_size and callback of the transfer
+        """
+        super().__init__(pool, **kwargs)
+        self.localpath = localpath
+        self.remotepath = remotepath
+        self.partial_path = remotepath + PARTIAL_SUFFIX
+
+    def run(self, conn, preserve_mtime=False):
+        """
+        Performs the upload
+        :param conn: A connection that the caller holds, which uploads segments too
+        :param preserve_mtime: Give the remote file the local file's mtime
+        :return: The SFTPAttributes of the uploaded file
+        """
+        local_stat = os.stat(self.localpath)
+        self.file_size = local_stat.st_size
+        conn.create_sized(self.partial_path, self.file_size)
+        segments = split_segments(self.file_size, self.segment_size)
+        logger.info("Uploading {} in {} segments".format(self.localpath, len(segments)))
+        self.transfer_segments(conn, segments)
+
+        # The partial file was created at full size, only the segments show what arrived
+        if self.bytes_done != self.file_size:
+            raise IOError(
+                "size mismatch in put!  {} != {}".format(
+                    self.bytes_done, self.file_size
+                )
+            )
+        conn.rename_into_place(self.partial_path, self.remotepath)
+        if preserve_mtime:
+            conn.utime(self.remotepath, (local_stat.st_atime, local_stat.st_mtime))
+        return conn.stat(self.remotepath)
+
+    def transfer_segment(self, conn, offset, length):
+        return conn.put_range(self.localpath, self.partial_path, offset, length)
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os.path import join
+from stat import S_ISDIR
+
+from durasftp.common.log import get_logger
+from durasftp.common.sftp.connection import is_partial_path
+from durasftp.common.sftp.listing_cache import REMOTE
+
+logger = get_logger(__name__)
+
+
+class RemoteTreeWalker:
+    """
+    Lists a remote directory tree breadth first, keeping up to `concurrency` directory
+      listings in flight at once, each on its own connection borrowed from a pool.
+    """
+
+    def __init__(self, pool, concurrency=1, listing_cache=None, path_filter=None):
+        """
+        :param pool: The DurableSFTPConnectionPool to borrow connections from
+        :param concurrency: The maximum number of directories to list at the same time
+        :param listing_cache: A ListingCache to reuse the listings of unchanged directories from
+        :param path_filter: A PathFilter of the entries to leave out, excluded directories
+          are never listed
+        """
+        self.pool = pool
+        self.concurrency = max(concurrency, 1)
+        self.listing_cache = listing_cache
+        self.path_filter = path_filter
+
+    def read_dir(self, remote_path):
+        """
+        Lists a single remote directory, leaving out unfinished transfers
+        :return: The SFTPAttributes entries of the directory
+        """
+        logger.info("Loading remote: {}".format(remote_path))
+        with self.pool.connection() as conn:
+            remote_listing = conn.listdir_attr(remote_path)
+        return [
+            entry for entry in remote_listing if not is_partial_path(entry.filename)
+        ]
+
+    def filter_entries(self, remote_path, entries):
+        if self.path_filter is None:
+            return entries
+        return self.path_filter.filter_entries(remote_path, entries)
+
+    def list_dir(self, remote_path):
+        """
+        Lists a single remote directory, leaving out unfinished transfers and filtered entries
+        :return: The directory path, and its SFTPAttributes entries
+        """
+        return remote_path, self.filter_entries(remote_path, self.read_dir(remote_path))
+
+    def list_dir_cached(self, remote_path, dir_mtime=None):
+        """
+        Lists a single remote directory, unless the listing cache has it and it has not changed
+        :param remote_path: A remote directory path
+        :param dir_mtime: The current mtime of the directory, if it is already known
+        :return: The directory path, its entries, and whether they were listed rather than cached
+        """
+        if self.listing_cache is None:
+            remote_path, entries = self.list_dir(remote_path)
+            return remote_path, entries, True
+        if dir_mtime is None:
+            with self.pool.connection() as conn:
+                dir_mtime = conn.stat(remote_path).st_mtime
+        # The cache keeps whole listings, so that it stays valid when the filter changes
+        entries = self.listing_cache.get(REMOTE, remote_path, dir_mtime)
+        listed = entries is None
+        if listed:
+            entries = self.read_dir(remote_path)
+            self.listing_cache.put(REMOTE, remote_path, dir_mtime, entries)
+        return remote_path, self.filter_entries(remote_path, entries), listed
+
+    def list_dirs(self, remote_paths):
+        """
+        Lists several remote directories, which need not be related. A directory that no longer
+          exists is listed as empty.
+        :param remote_paths: Remote directory paths
+        :return: A dict of {directory path: SFTPAttributes entries}
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return dict(executor.map(self.list_dir_if_exists, remote_paths))
+
+    def list_dir_if_exists(self, remote_path):
+        try:
+            return self.list_dir(remote_path)
+        except FileNotFoundError:
+            return remote_path, []
+
+    def walk(self, remote_path):
+        """
+        Lists every directory under remote_path, yielding each listing as soon as it arrives.
+          Listings arrive roughly breadth first, but in no guaranteed order.
+        :param remote_path: A remote directory path
+        :return: A generator of (directory path, SFTPAttributes entries)
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {executor.submit(self.list_dir_cached, remote_path)}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        dir_path, entries, listed = future.result()
+                        for entry in entries:
+                            if S_ISDIR(entry.st_mode):
+                                child_path = join(dir_path, entry.filename)
+                                # Only a fresh listing knows the current mtime of each child
+                                child_mtime = entry.st_mtime if listed else None
+                                pending.add(
+                                    executor.submit(
+                                        self.list_dir_cached, child_path, child_mtime
+                                    )
+                                )
+                        yield dir_path, entries
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def load_tree(self, remote_path, attr_tree):
+        """
+        Lists the whole tree under remote_path, and loads it into attr_tree in the same depth first
+          order as a recursive walk would
+        :param remote_path: A remote directory path
+        :param attr_tree: The mapping of remote paths to entries to fill in
+        """
+        listings = dict(self.walk(remote_path))
+        stack = [iter(self.children(remote_path, listings))]
+        while stack:
+            for child_path, entry in stack[-1]:
+                attr_tree[child_path] = entry
+                if S_ISDIR(entry.st_mode):
+                    stack.append(iter(self.children(child_path, listings)))
+                    break
+            else:
+                stack.pop()
+
+    @staticmethod
+    def children(dir_path, listings):
+        return [
+            (join(dir_path, entry.filename), entry) for entry in listings.pop(dir_path)
+        ]
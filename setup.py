@@ -28,11 +28,14 @@ setup(
         "Programming Language :: Python :: 3",
     ],
     # packages=['durasftp'],
-    packages=find_packages(exclude=["*.test", "*.test.*", "test.*", "test"]),
+    packages=find_packages(
+        exclude=["*.test", "*.test.*", "test.*", "test", "benchmark", "benchmark.*"]
+    ),
     include_package_data=False,
     install_requires=[
         "pysftp>=0.2.9", "arrow>=0.14.4"
     ],
+    extras_require={"fast": ["numpy>=1.13"]},
     python_requires='>=3.5',
     entry_points={"console_scripts": ["realpython=reader.__main__:main"]},
 )
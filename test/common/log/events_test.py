@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import io
+import json
+import logging
+import unittest
+from argparse import ArgumentParser
+
+from durasftp.common.log import (
+    add_logger_args,
+    get_log_json,
+    get_project_logger,
+    set_log_json,
+)
+from durasftp.common.log.events import Event, EventLogger, Lazy
+from durasftp.common.log.log_formatter import JsonLinesFormatter, LogFormatter
+
+
+class Exploding:
+    def __str__(self):
+        raise AssertionError("Rendered an event that is not logged")
+
+
+class TestEventLogger(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.logger = logging.getLogger("events_test")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+        self.events = EventLogger(self.logger)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_disabled_events_are_never_rendered(self):
+        calls = []
+        self.events.debug(
+            "skipped", value=Exploding(), lazy=Lazy(lambda: calls.append(1))
+        )
+        self.assertEqual("", self.stream.getvalue())
+        self.assertEqual([], calls)
+
+    def test_it_renders_events_as_key_value_pairs(self):
+        self.events.info(
+            "retry",
+            method="listdir",
+            attempt=1,
+            error="Socket is closed",
+            empty="",
+            entries=Lazy(lambda: 3),
+        )
+        self.assertEqual(
+            'retry method=listdir attempt=1 error="Socket is closed" empty="" entries=3\n',
+            self.stream.getvalue(),
+        )
+
+    def test_lazy_fields_are_computed_once(self):
+        calls = []
+        event = Event("listing", {"entries": Lazy(lambda: calls.append(1) or 5)})
+        self.assertEqual("listing entries=5", str(event))
+        self.assertEqual("listing entries=5", str(event))
+        self.assertEqual([1], calls)
+
+    def test_it_writes_json_lines(self):
+        self.handler.setFormatter(JsonLinesFormatter())
+        self.events.warning("upload", path="/a b.txt", size=Lazy(lambda: 10))
+        self.logger.warning("Plain %s", "message")
+        first, second = [
+            json.loads(line) for line in self.stream.getvalue().splitlines()
+        ]
+        self.assertEqual("WARNING", first["level"])
+        self.assertEqual("events_test", first["logger"])
+        self.assertEqual("upload", first["event"])
+        self.assertEqual("/a b.txt", first["path"])
+        self.assertEqual(10, first["size"])
+        self.assertTrue(first["time"].endswith("Z"))
+        self.assertEqual("Plain message", second["message"])
+
+
+class TestLogArgs(unittest.TestCase):
+    def tearDown(self):
+        set_log_json(False)
+
+    def test_log_json_switches_the_project_formatter(self):
+        parser = ArgumentParser()
+        add_logger_args(parser)
+        args = parser.parse_args(["--log-json"])
+        self.assertTrue(args.log_json)
+        self.assertTrue(get_log_json())
+        handler = get_project_logger().handlers[0]
+        self.assertIsInstance(handler.formatter, JsonLinesFormatter)
+        set_log_json(False)
+        self.assertIsInstance(handler.formatter, LogFormatter)
+
+
+if __name__ == "__main__":
+    unittest.main()
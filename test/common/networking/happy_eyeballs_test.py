@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import socket
+import unittest
+
+from durasftp.common.networking.happy_eyeballs import (
+    connect,
+    interleave_families,
+    resolve,
+)
+
+
+def closed_port():
+    """
+    :return: A local port that nothing listens on
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestHappyEyeballs(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_it_interleaves_address_families(self):
+        addresses = [
+            (socket.AF_INET6, 1, 6, "", ("::1", 22)),
+            (socket.AF_INET6, 1, 6, "", ("::2", 22)),
+            (socket.AF_INET, 1, 6, "", ("10.0.0.1", 22)),
+            (socket.AF_INET, 1, 6, "", ("10.0.0.2", 22)),
+        ]
+        self.assertEqual(
+            ["::1", "10.0.0.1", "::2", "10.0.0.2"],
+            [address[4][0] for address in interleave_families(addresses)],
+        )
+
+    def test_it_connects(self):
+        sock = connect(resolve("127.0.0.1", self.port), timeout=3)
+        self.assertEqual(("127.0.0.1", self.port), sock.getpeername())
+        self.assertEqual(3, sock.gettimeout())
+        sock.close()
+
+    def test_it_falls_back_to_the_next_address(self):
+        addresses = resolve("127.0.0.1", closed_port()) + resolve(
+            "127.0.0.1", self.port
+        )
+        sock = connect(addresses, timeout=3, attempt_delay=60)
+        self.assertEqual(self.port, sock.getpeername()[1])
+        sock.close()
+
+    def test_it_raises_the_last_error(self):
+        with self.assertRaises(ConnectionRefusedError):
+            connect(resolve("127.0.0.1", closed_port()), timeout=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
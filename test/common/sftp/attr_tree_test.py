@@ -0,0 +1,86 @@
+import unittest
+from collections import OrderedDict
+from os import makedirs, scandir
+from os.path import join
+from stat import S_IFDIR, S_IFREG
+from tempfile import TemporaryDirectory
+
+from paramiko import SFTPAttributes
+
+from durasftp.common.sftp.attr_tree import AttrTree
+
+
+def make_attributes(file_name, st_mode, st_size=0, st_mtime=0):
+    attrs = SFTPAttributes()
+    attrs.filename = file_name
+    attrs.st_mode = st_mode
+    attrs.st_size = st_size
+    attrs.st_mtime = st_mtime
+    return attrs
+
+
+class TestAttrTree(unittest.TestCase):
+    def setUp(self):
+        self.entries = OrderedDict(
+            [
+                ("/one", make_attributes("one", S_IFDIR | 0o755)),
+                ("/one/two", make_attributes("two", S_IFDIR | 0o755)),
+                ("/one/two/temp.txt", make_attributes("temp.txt", S_IFREG, 11, 1500)),
+                ("/one/thing.jpg", make_attributes("thing.jpg", S_IFREG, 22, 1600)),
+                ("/temp.txt", make_attributes("temp.txt", S_IFREG, 33, 1700)),
+            ]
+        )
+        self.attr_tree = AttrTree()
+        for remote_path, attrs in self.entries.items():
+            self.attr_tree[remote_path] = attrs
+
+    def test_it_keeps_insertion_order(self):
+        self.assertEqual(list(self.entries.keys()), list(self.attr_tree.keys()))
+        self.assertEqual(5, len(self.attr_tree))
+
+    def test_it_looks_up_attributes(self):
+        for remote_path, attrs in self.entries.items():
+            entry = self.attr_tree[remote_path]
+            self.assertEqual(attrs.filename, entry.filename)
+            self.assertEqual(attrs.st_mode, entry.st_mode)
+            self.assertEqual(attrs.st_size, entry.st_size)
+            self.assertEqual(attrs.st_mtime, entry.st_mtime)
+        self.assertTrue(self.attr_tree["/one"].is_dir())
+        self.assertTrue(self.attr_tree["/temp.txt"].is_file())
+
+    def test_it_misses_unknown_paths(self):
+        self.assertNotIn("/two", self.attr_tree)
+        self.assertNotIn("/one/two/three", self.attr_tree)
+        self.assertIsNone(self.attr_tree.get("/two"))
+        with self.assertRaises(KeyError):
+            self.attr_tree["/two"]
+
+    def test_parent_paths_are_not_keys_until_set(self):
+        attr_tree = AttrTree()
+        attr_tree["/some/nested/file.txt"] = make_attributes("file.txt", S_IFREG)
+        self.assertNotIn("/some", attr_tree)
+        self.assertNotIn("/some/nested", attr_tree)
+        attr_tree["/some"] = make_attributes("some", S_IFDIR)
+        self.assertEqual(["/some/nested/file.txt", "/some"], list(attr_tree.keys()))
+
+    def test_setting_a_path_again_keeps_its_position(self):
+        self.attr_tree["/one/two"] = make_attributes("two", S_IFREG, 44, 1800)
+        self.assertEqual(list(self.entries.keys()), list(self.attr_tree.keys()))
+        self.assertTrue(self.attr_tree["/one/two"].is_file())
+        self.assertEqual(44, self.attr_tree["/one/two"].st_size)
+
+    def test_it_stores_local_dir_entries(self):
+        with TemporaryDirectory() as local_base:
+            makedirs(join(local_base, "one"))
+            with open(join(local_base, "temp.txt"), "wb") as temp_file:
+                temp_file.write(b"Hello world")
+            attr_tree = AttrTree()
+            for local_entry in scandir(local_base):
+                attr_tree["/" + local_entry.name] = local_entry
+            self.assertTrue(attr_tree["/one"].is_dir())
+            self.assertTrue(attr_tree["/temp.txt"].is_file())
+            self.assertEqual(11, attr_tree["/temp.txt"].stat().st_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import io
+import os
+import tarfile
+import unittest
+from contextlib import contextmanager
+from stat import S_IFREG
+from tempfile import TemporaryDirectory
+
+from paramiko import SSHException
+
+from durasftp.common.sftp.action import SFTPAction
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.bulk_download import BulkDownloader, bulk_batches
+
+MTIME = 1500000000
+
+
+def tar_of(files, cut_short=False):
+    """
+    :param files: The (name, content, mtime) of each file to archive
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        for name, content, mtime in files:
+            member = tarfile.TarInfo("./" + name)
+            member.size = len(content)
+            member.mtime = mtime
+            tar.addfile(member, io.BytesIO(content))
+    output = stream.getvalue()
+    # Partway through the second file
+    return output[:4000] if cut_short else output
+
+
+class FakeChannel:
+    def __init__(self, output):
+        self.output = output
+        self.sent = b""
+        self.closed = False
+
+    def sendall(self, data):
+        self.sent += data
+
+    def shutdown_write(self):
+        pass
+
+    def makefile(self, mode):
+        return io.BytesIO(self.output)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, channel=None):
+        self.channel = channel
+        self.commands = []
+
+    def exec_command(self, command, cwd=None):
+        self.commands.append((command, cwd))
+        if self.channel is None:
+            raise SSHException("Channel closed.")
+        return self.channel
+
+
+class FakeMirrorer:
+    def __init__(self, local_base, conn):
+        self.local_base = local_base
+        self.conn = conn
+        self.pool = self
+        self.metrics = None
+
+    def local_path_from_remote(self, remote_path):
+        return self.local_base + remote_path
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+def get_action(mirrorer, remote_path, size, action_code=SFTPActionCodes.GET):
+    remote_entry = AttrEntry(
+        os.path.basename(remote_path), S_IFREG | 0o644, size, MTIME
+    )
+    return SFTPAction(mirrorer, action_code, remote_path, remote_entry=remote_entry)
+
+
+class TestBulkDownload(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = TemporaryDirectory()
+        os.mkdir(self.local_dir.name + "/docs")
+
+    def tearDown(self):
+        self.local_dir.cleanup()
+
+    def mirrorer(self, output=None):
+        channel = None if output is None else FakeChannel(output)
+        return FakeMirrorer(self.local_dir.name, FakeConnection(channel))
+
+    def test_it_batches_small_files_by_directory(self):
+        mirrorer = self.mirrorer()
+        actions = [
+            get_action(mirrorer, "/docs/a.txt", 10),
+            get_action(mirrorer, "/docs/b.txt", 10),
+            get_action(mirrorer, "/docs/huge.bin", 10**9),
+            get_action(mirrorer, "/lonely/c.txt", 10),
+            get_action(mirrorer, "/docs/d.txt", 10, SFTPActionCodes.PUT),
+        ]
+        batches, singles = bulk_batches(actions)
+        self.assertEqual(
+            [["/docs/a.txt", "/docs/b.txt"]],
+            [[action.remote_path for action in batch] for batch in batches],
+        )
+        self.assertEqual(
+            ["/docs/huge.bin", "/docs/d.txt", "/lonely/c.txt"],
+            [action.remote_path for action in singles],
+        )
+
+    def test_it_unpacks_the_stream_with_mtimes(self):
+        mirrorer = self.mirrorer(
+            tar_of([("-a.txt", b"first", MTIME), ("b.txt", b"second", MTIME)])
+        )
+        actions = [
+            get_action(mirrorer, "/docs/-a.txt", 5),
+            get_action(mirrorer, "/docs/b.txt", 6),
+        ]
+        done = []
+        remaining = BulkDownloader(mirrorer).run(actions, callback=done.append)
+        self.assertEqual([], remaining)
+        self.assertEqual(actions, done)
+        self.assertEqual([("tar -cf - --null -T -", "/docs")], mirrorer.conn.commands)
+        self.assertEqual(b"./-a.txt\0./b.txt\0", mirrorer.conn.channel.sent)
+        with open(self.local_dir.name + "/docs/b.txt", "rb") as local_file:
+            self.assertEqual(b"second", local_file.read())
+        self.assertEqual(MTIME, os.stat(self.local_dir.name + "/docs/-a.txt").st_mtime)
+        self.assertEqual(
+            ["-a.txt", "b.txt"], sorted(os.listdir(self.local_dir.name + "/docs"))
+        )
+        self.assertTrue(mirrorer.conn.channel.closed)
+
+    def test_changed_and_missing_files_are_left_to_download_on_their_own(self):
+        mirrorer = self.mirrorer(
+            tar_of([("a.txt", b"first", MTIME), ("b.txt", b"changed!", MTIME + 1)])
+        )
+        actions = [
+            get_action(mirrorer, "/docs/a.txt", 5),
+            get_action(mirrorer, "/docs/b.txt", 6),
+            get_action(mirrorer, "/docs/c.txt", 6),
+        ]
+        remaining = BulkDownloader(mirrorer).run(actions)
+        self.assertEqual(actions[1:], remaining)
+
+    def test_a_broken_stream_leaves_the_rest_of_the_batch(self):
+        mirrorer = self.mirrorer(
+            tar_of([("a.txt", b"x" * 2000, MTIME), ("b.txt", b"y" * 2000, MTIME)], True)
+        )
+        actions = [
+            get_action(mirrorer, "/docs/a.txt", 2000),
+            get_action(mirrorer, "/docs/b.txt", 2000),
+        ]
+        downloader = BulkDownloader(mirrorer)
+        remaining = downloader.run(actions)
+        self.assertEqual(actions[1:], remaining)
+        self.assertTrue(downloader.available)
+        self.assertEqual(["a.txt"], os.listdir(self.local_dir.name + "/docs"))
+
+    def test_it_stops_asking_a_server_that_refuses_exec(self):
+        mirrorer = self.mirrorer()
+        actions = [
+            get_action(mirrorer, "/docs/{}/{}.txt".format(dir_num, file_num), 5)
+            for dir_num in range(3)
+            for file_num in range(2)
+        ]
+        downloader = BulkDownloader(mirrorer)
+        remaining = downloader.run(actions)
+        self.assertEqual(actions, remaining)
+        self.assertFalse(downloader.available)
+        self.assertEqual(1, len(mirrorer.conn.commands))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import errno
+import unittest
+
+from paramiko import SSHException
+
+from durasftp.common.sftp.connection import (
+    DurableSFTPConnection,
+    backoff_delay,
+    is_partial_path,
+)
+
+SHA1 = "55ca6286e3e4f4fba5d0448333fa99fc5a404a73"
+
+
+class TestConnectionHelpers(unittest.TestCase):
+    def test_the_first_retry_is_immediate(self):
+        self.assertEqual(0, backoff_delay(0, base=0.5, cap=30))
+
+    def test_retries_back_off_exponentially_with_jitter(self):
+        for attempt_num, full_delay in [(1, 0.5), (2, 1), (3, 2), (4, 4)]:
+            delays = [backoff_delay(attempt_num, base=0.5, cap=30) for _ in range(50)]
+            self.assertTrue(
+                all(full_delay / 2 <= delay <= full_delay for delay in delays)
+            )
+            self.assertGreater(len(set(delays)), 1)
+
+    def test_retries_never_wait_longer_than_the_cap(self):
+        self.assertLessEqual(backoff_delay(20, base=0.5, cap=30), 30)
+
+    def test_it_recognizes_partial_paths(self):
+        self.assertTrue(is_partial_path("/big/huge.csv.durasftp-partial"))
+        self.assertTrue(is_partial_path("/big/huge.csv.durasftp-partial.json"))
+        self.assertFalse(is_partial_path("/big/huge.csv"))
+
+
+class FakeChannel:
+    def __init__(self, output, exit_status=0):
+        self.output = output
+        self.exit_status = exit_status
+        self.sent = b""
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, data):
+        self.sent += data
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, size):
+        chunk, self.output = self.output[:size], self.output[size:]
+        return chunk
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHashingConnection(DurableSFTPConnection):
+    """
+    Runs hash_many without a server, with a scripted exec channel and check-file answers
+    """
+
+    def __init__(self, channel=None, check_file_hashes=None):
+        self.channel = channel
+        self.check_file_hashes = check_file_hashes or {}
+        self.commands = []
+        self.checked_paths = []
+        self._timeout = 5
+        self.exec_hashing = True
+        self.check_file_hashing = True
+        self._check_file_failures = 0
+        self._check_file_hashed = False
+
+    def exec_command(self, command, cwd=None):
+        self.commands.append((command, cwd))
+        if self.channel is None:
+            raise SSHException("Channel closed.")
+        return self.channel
+
+    def check_file(self, remotepath, algo="sha1"):
+        self.checked_paths.append(remotepath)
+        digest = self.check_file_hashes.get(remotepath)
+        if digest is None:
+            raise IOError(errno.ENOENT, "No such file")
+        if isinstance(digest, Exception):
+            raise digest
+        return digest
+
+    def close(self):
+        pass
+
+
+class TestHashMany(unittest.TestCase):
+    def test_it_hashes_files_with_one_command(self):
+        channel = FakeChannel("{}  ./sub/-a b\0".format(SHA1).encode("utf-8"))
+        conn = FakeHashingConnection(channel)
+        hashes = conn.hash_many(["/base/sub/-a b", "/base/gone.txt"], "sha1")
+        self.assertEqual({"/base/sub/-a b": SHA1}, hashes)
+        self.assertEqual([("xargs -0 sha1sum -z", "/base")], conn.commands)
+        self.assertEqual(b"./sub/-a b\0./gone.txt\0", channel.sent)
+        self.assertTrue(channel.closed)
+        self.assertTrue(conn.exec_hashing)
+        self.assertEqual([], conn.checked_paths)
+
+    def test_it_falls_back_to_check_file_when_exec_is_refused(self):
+        conn = FakeHashingConnection(check_file_hashes={"/one.txt": SHA1})
+        self.assertEqual({"/one.txt": SHA1}, conn.hash_many(["/one.txt", "/gone.txt"]))
+        self.assertFalse(conn.exec_hashing)
+        self.assertTrue(conn.can_hash)
+
+    def test_it_falls_back_to_check_file_when_the_command_is_missing(self):
+        conn = FakeHashingConnection(
+            FakeChannel(b"", exit_status=127), check_file_hashes={"/one.txt": SHA1}
+        )
+        self.assertEqual({"/one.txt": SHA1}, conn.hash_many(["/one.txt"]))
+        self.assertFalse(conn.exec_hashing)
+
+    def test_it_gives_up_on_servers_that_cannot_hash(self):
+        unsupported = IOError("Operation unsupported")
+        paths = ["/{}.txt".format(num) for num in range(5)]
+        conn = FakeHashingConnection(
+            check_file_hashes={path: unsupported for path in paths}
+        )
+        self.assertEqual({}, conn.hash_many(paths))
+        self.assertEqual(3, len(conn.checked_paths))
+        self.assertFalse(conn.can_hash)
+
+    def test_it_rejects_unknown_algorithms(self):
+        with self.assertRaises(ValueError):
+            FakeHashingConnection().hash_many(["/one.txt"], "crc32")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import unittest
+from stat import S_IFDIR, S_IFLNK, S_IFREG
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp import diff_engine
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.attr_tree import AttrTree
+from durasftp.common.sftp.mirrorer import Mirrorer
+
+DIR_MODE = S_IFDIR | 0o755
+FILE_MODE = S_IFREG | 0o644
+LINK_MODE = S_IFLNK | 0o777
+
+
+class OfflineConnection:
+    """
+    Stands in for a connection, so that planning can be tested without a server
+    """
+
+    _transport = None
+
+    def listdir(self, remote_path):
+        return []
+
+    def close(self):
+        pass
+
+
+def action_pairs(actions):
+    return [(action.remote_path, action.action_code) for action in actions]
+
+
+@unittest.skipUnless(diff_engine.is_available(), "NumPy is not installed")
+class TestDiffEngine(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = TemporaryDirectory()
+        self.mirrorer = Mirrorer(self.local_dir.name, conn=OfflineConnection())
+        remote_tree = AttrTree()
+        local_tree = AttrTree()
+        remote_tree.set("/same_dir", DIR_MODE, 4096, 100)
+        local_tree.set("/same_dir", DIR_MODE, 4096, 200)
+        remote_tree.set("/same_dir/same.txt", FILE_MODE, 10, 1500.2)
+        local_tree.set("/same_dir/same.txt", FILE_MODE, 10, 1500.9)
+        remote_tree.set("/same_dir/newer.txt", FILE_MODE, 10, 1600)
+        local_tree.set("/same_dir/newer.txt", FILE_MODE, 10, 1500)
+        remote_tree.set("/same_dir/bigger.txt", FILE_MODE, 20, 1500)
+        local_tree.set("/same_dir/bigger.txt", FILE_MODE, 10, 1500)
+        remote_tree.set("/remote_only_dir", DIR_MODE, 4096, 100)
+        remote_tree.set("/remote_only_dir/file.txt", FILE_MODE, 5, 100)
+        remote_tree.set("/dir_vs_file", DIR_MODE, 4096, 100)
+        local_tree.set("/dir_vs_file", FILE_MODE, 5, 100)
+        remote_tree.set("/file_vs_dir", FILE_MODE, 5, 100)
+        local_tree.set("/file_vs_dir", DIR_MODE, 4096, 100)
+        remote_tree.set("/link", LINK_MODE, 5, 100)
+        local_tree.set("/link", FILE_MODE, 5, 100)
+        local_tree.set("/local_only_dir", DIR_MODE, 4096, 100)
+        local_tree.set("/local_only_dir/file.txt", FILE_MODE, 5, 100)
+        local_tree.set("/same_dir/local_only.txt", FILE_MODE, 5, 100)
+        self.mirrorer.remote_attr_tree = remote_tree
+        self.mirrorer.local_attr_tree = local_tree
+
+    def tearDown(self):
+        self.local_dir.cleanup()
+
+    def test_it_matches_per_path_actions_from_remote(self):
+        per_path_actions = [
+            self.mirrorer.action_from_remote_by_path(remote_path)
+            for remote_path in self.mirrorer.remote_attr_tree.keys()
+        ]
+        per_path_actions = [action for action in per_path_actions if action]
+        diff_actions = list(self.mirrorer.actions_by_diff(from_remote=True))
+        self.assertEqual(action_pairs(per_path_actions), action_pairs(diff_actions))
+        codes = dict(action_pairs(diff_actions))
+        self.assertEqual(SFTPActionCodes.OK, codes["/same_dir/same.txt"])
+        self.assertEqual(SFTPActionCodes.GET, codes["/same_dir/newer.txt"])
+        self.assertEqual(SFTPActionCodes.LMKDIR, codes["/dir_vs_file"])
+        self.assertNotIn("/link", codes)
+
+    def test_it_matches_per_path_actions_to_remote(self):
+        per_path_actions = [
+            self.mirrorer.action_to_remote_by_path(remote_path)
+            for remote_path in self.mirrorer.local_attr_tree.keys()
+        ]
+        per_path_actions = [action for action in per_path_actions if action]
+        diff_actions = list(self.mirrorer.actions_by_diff(from_remote=False))
+        self.assertEqual(action_pairs(per_path_actions), action_pairs(diff_actions))
+        codes = dict(action_pairs(diff_actions))
+        self.assertEqual(SFTPActionCodes.PUT, codes["/link"])
+        self.assertEqual(SFTPActionCodes.RMKDIR, codes["/local_only_dir"])
+
+    def test_it_keeps_the_entries_of_both_sides(self):
+        actions = {
+            action.remote_path: action
+            for action in self.mirrorer.actions_by_diff(from_remote=True)
+        }
+        self.assertTrue(actions["/file_vs_dir"].local_is_dir)
+        self.assertTrue(actions["/file_vs_dir"].remote_is_file)
+        self.assertFalse(actions["/remote_only_dir"].local_exists)
+
+    def test_it_handles_empty_trees(self):
+        self.mirrorer.local_attr_tree = AttrTree()
+        diff_actions = list(self.mirrorer.actions_by_diff(from_remote=True))
+        self.assertEqual(len(self.mirrorer.remote_attr_tree) - 1, len(diff_actions))
+        self.mirrorer.remote_attr_tree = AttrTree()
+        self.assertEqual([], list(self.mirrorer.actions_by_diff(from_remote=True)))
+
+    def test_trees_can_grow_after_a_diff(self):
+        list(self.mirrorer.actions_by_diff(from_remote=True))
+        self.mirrorer.remote_attr_tree.set("/later.txt", FILE_MODE, 1, 1)
+        self.assertIn("/later.txt", self.mirrorer.remote_attr_tree)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+import unittest
+
+from durasftp.common.sftp.exec_output import read_records
+
+OUTPUT = b"one\0two\0thr" * 10000 + b"ee\0four"
+
+
+class FakeChannel:
+    def __init__(self, output):
+        self.output = output
+
+    def recv(self, size):
+        chunk, self.output = self.output[:size], self.output[size:]
+        return chunk
+
+
+class TestReadRecords(unittest.TestCase):
+    def test_it_streams_records_and_leaves_out_one_cut_short(self):
+        records = list(read_records(FakeChannel(OUTPUT)))
+        self.assertEqual(20001, len(records))
+        self.assertEqual([b"one", b"two", b"throne"], records[:3])
+        self.assertEqual(b"three", records[-1])
+
+    def test_it_raises_on_a_record_cut_short(self):
+        records = read_records(FakeChannel(OUTPUT), ValueError("cut short"))
+        with self.assertRaises(ValueError):
+            list(records)
+
+    def test_it_reads_output_that_ends_with_a_record(self):
+        records = read_records(FakeChannel(b"one\0two\0"), ValueError("cut short"))
+        self.assertEqual([b"one", b"two"], list(records))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import unittest
+from stat import S_IFDIR, S_IFREG
+
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.filters import PathFilter
+
+
+def file_entry(name, st_size=100, st_mtime=1500000000):
+    return AttrEntry(name, S_IFREG | 0o644, st_size, st_mtime)
+
+
+def dir_entry(name):
+    return AttrEntry(name, S_IFDIR | 0o755, 4096, 1500000000)
+
+
+class TestPathFilter(unittest.TestCase):
+    def test_an_empty_filter_allows_everything(self):
+        entries = [file_entry("temp.txt"), dir_entry("one")]
+        path_filter = PathFilter()
+        self.assertTrue(path_filter.is_empty())
+        self.assertIs(entries, path_filter.filter_entries("/", entries))
+
+    def test_it_excludes_directories_by_glob(self):
+        path_filter = PathFilter(exclude=["/archive", "*.tmp"])
+        self.assertFalse(path_filter.allows("/archive", dir_entry("archive")))
+        self.assertTrue(path_filter.allows("/data/archive", dir_entry("archive")))
+        self.assertFalse(path_filter.allows("/data/deep/x.tmp", file_entry("x.tmp")))
+        self.assertTrue(path_filter.allows("/data/x.tmp.csv", file_entry("x.tmp.csv")))
+
+    def test_includes_only_apply_to_files(self):
+        path_filter = PathFilter(include=["*.csv"], include_regex=[r"/reports/"])
+        self.assertTrue(path_filter.allows("/data", dir_entry("data")))
+        self.assertTrue(path_filter.allows("/data/a.csv", file_entry("a.csv")))
+        self.assertTrue(path_filter.allows("/reports/a.pdf", file_entry("a.pdf")))
+        self.assertFalse(path_filter.allows("/data/a.pdf", file_entry("a.pdf")))
+
+    def test_excludes_win_over_includes(self):
+        path_filter = PathFilter(include=["*.csv"], exclude_regex=[r"^/old/"])
+        self.assertFalse(path_filter.allows("/old/a.csv", file_entry("a.csv")))
+
+    def test_it_filters_files_by_size(self):
+        path_filter = PathFilter(min_size=10, max_size=100)
+        self.assertFalse(path_filter.allows("/a", file_entry("a", st_size=9)))
+        self.assertTrue(path_filter.allows("/a", file_entry("a", st_size=10)))
+        self.assertTrue(path_filter.allows("/a", file_entry("a", st_size=100)))
+        self.assertFalse(path_filter.allows("/a", file_entry("a", st_size=101)))
+        self.assertTrue(path_filter.allows("/d", dir_entry("d")))
+
+    def test_it_filters_files_by_modified_time(self):
+        path_filter = PathFilter(modified_since="2017-07-14T02:40:00+00:00")
+        self.assertEqual(1500000000, path_filter.modified_since)
+        self.assertTrue(path_filter.allows("/a", file_entry("a", st_mtime=1500000000)))
+        self.assertFalse(path_filter.allows("/a", file_entry("a", st_mtime=1499999999)))
+        self.assertEqual(
+            1500000000, PathFilter(modified_since=1500000000).modified_since
+        )
+
+    def test_it_filters_listings(self):
+        path_filter = PathFilter(exclude=["/one/two"])
+        entries = [dir_entry("two"), file_entry("three.txt")]
+        filtered_entries = path_filter.filter_entries("/one", entries)
+        self.assertEqual(["three.txt"], [entry.name for entry in filtered_entries])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import unittest
+from io import BytesIO
+from stat import S_IFDIR, S_IFLNK, S_IFREG
+
+from paramiko import SSHException
+
+from durasftp.common.sftp.attr_tree import AttrEntry, AttrTree
+from durasftp.common.sftp.filters import PathFilter
+from durasftp.common.sftp.find_listing import (
+    FindLister,
+    FindUnavailable,
+    parse_find_record,
+)
+
+FIND_OUTPUT = (
+    b"d 755 4096 1500000000.5 \0"
+    b"d 755 4096 1500000001.0 docs\0"
+    b"f 644 12 1500000002.9 docs/read me.txt\0"
+    b"f 600 3 1500000003.0 docs/line\nbreak.txt\0"
+    b"d 700 4096 1500000004.0 tmp\0"
+    b"f 644 1 1500000005.0 tmp/scratch.txt\0"
+    b"f 644 9 1500000006.0 big.bin.durasftp-partial\0"
+    b"l 777 4 1500000007.0 latest\0"
+)
+
+
+class FakeChannel:
+    def __init__(self, output, exit_status=0, chunk_size=7):
+        self.chunks = [
+            output[start : start + chunk_size]
+            for start in range(0, len(output), chunk_size)
+        ]
+        self.exit_status = exit_status
+        self.eof_received = False
+        self.closed = False
+
+    def recv(self, size):
+        if self.chunks:
+            return self.chunks.pop(0)
+        self.eof_received = True
+        return b""
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def makefile_stderr(self, mode):
+        return BytesIO(b"find: unknown predicate `-printf'")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, channel=None, refuse=False, root_mtime=1500000000):
+        self.channel = channel
+        self.refuse = refuse
+        self.root_mtime = root_mtime
+        self.commands = []
+
+    def stat(self, remote_path):
+        return AttrEntry("data", S_IFDIR | 0o755, 4096, self.root_mtime)
+
+    def exec_command(self, command, cwd=None):
+        self.commands.append((command, cwd))
+        if self.refuse:
+            raise SSHException("Channel closed.")
+        return self.channel
+
+
+class TestFindListing(unittest.TestCase):
+    def test_it_finds_the_tree_from_its_root(self):
+        conn = FakeConnection(FakeChannel(FIND_OUTPUT))
+        FindLister(conn).load_tree("/data", AttrTree())
+        self.assertEqual(
+            [("find . -printf '%y %m %s %T@ %P\\0'", "/data")], conn.commands
+        )
+
+    def test_it_parses_records(self):
+        relative_path, entry = parse_find_record(
+            b"f 644 12 1500000002.9 docs/read me.txt"
+        )
+        self.assertEqual("docs/read me.txt", relative_path)
+        self.assertEqual("read me.txt", entry.filename)
+        self.assertEqual(S_IFREG | 0o644, entry.st_mode)
+        self.assertEqual(12, entry.st_size)
+        self.assertEqual(1500000002, entry.st_mtime)
+
+    def test_it_loads_the_tree_in_depth_first_order(self):
+        channel = FakeChannel(FIND_OUTPUT)
+        attr_tree = AttrTree()
+        FindLister(FakeConnection(channel)).load_tree("/data", attr_tree)
+        self.assertEqual(
+            [
+                "/data/docs",
+                "/data/docs/read me.txt",
+                "/data/docs/line\nbreak.txt",
+                "/data/tmp",
+                "/data/tmp/scratch.txt",
+                "/data/latest",
+            ],
+            list(attr_tree.keys()),
+        )
+        self.assertEqual(S_IFLNK | 0o777, attr_tree["/data/latest"].st_mode)
+        self.assertTrue(channel.closed)
+
+    def test_excluded_directories_are_skipped_with_their_contents(self):
+        attr_tree = AttrTree()
+        lister = FindLister(
+            FakeConnection(FakeChannel(FIND_OUTPUT)), PathFilter(exclude=["/data/tmp"])
+        )
+        lister.load_tree("/data", attr_tree)
+        self.assertNotIn("/data/tmp", attr_tree)
+        self.assertNotIn("/data/tmp/scratch.txt", attr_tree)
+        self.assertIn("/data/latest", attr_tree)
+
+    def test_it_is_unavailable_when_exec_is_refused(self):
+        with self.assertRaises(FindUnavailable):
+            FindLister(FakeConnection(refuse=True)).load_tree("/data", AttrTree())
+
+    def test_it_is_unavailable_when_find_fails(self):
+        with self.assertRaisesRegex(FindUnavailable, "-printf"):
+            FindLister(FakeConnection(FakeChannel(b"", exit_status=1))).load_tree(
+                "/data", AttrTree()
+            )
+
+    def test_it_is_unavailable_when_find_lists_another_directory(self):
+        conn = FakeConnection(FakeChannel(FIND_OUTPUT), root_mtime=1400000000)
+        with self.assertRaises(FindUnavailable):
+            FindLister(conn).load_tree("/data", AttrTree())
+
+
+if __name__ == "__main__":
+    unittest.main()
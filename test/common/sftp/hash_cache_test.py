@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp.hash_cache import HashCache
+
+OLD_MTIME = 1500000000
+SHA1 = "55ca6286e3e4f4fba5d0448333fa99fc5a404a73"
+
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+        self.cache_path = join(self.cache_dir.name, "hashes.sqlite")
+        self.cache = HashCache(self.cache_path)
+        self.file_path = join(self.cache_dir.name, "file.txt")
+        with open(self.file_path, "wb") as local_file:
+            local_file.write(b"hi\n")
+        os.utime(self.file_path, (OLD_MTIME, OLD_MTIME))
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache_dir.cleanup()
+
+    def cache_one_run(self, hashed_at=OLD_MTIME + 60):
+        self.cache.start_run()
+        self.cache.put(os.stat(self.file_path), SHA1, hashed_at)
+        self.cache.finish_run()
+
+    def reopen(self):
+        self.cache.close()
+        self.cache = HashCache(self.cache_path)
+        self.cache.start_run()
+
+    def test_it_reuses_the_hashes_of_unchanged_files(self):
+        self.cache_one_run()
+        self.reopen()
+        self.assertEqual(SHA1, self.cache.get(os.stat(self.file_path)))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_it_hashes_changed_files_again(self):
+        self.cache_one_run()
+        self.reopen()
+        os.utime(self.file_path, ns=(OLD_MTIME * 10**9, OLD_MTIME * 10**9 + 1))
+        self.assertIsNone(self.cache.get(os.stat(self.file_path)))
+        with open(self.file_path, "ab") as local_file:
+            local_file.write(b"more")
+        os.utime(self.file_path, (OLD_MTIME, OLD_MTIME))
+        self.assertIsNone(self.cache.get(os.stat(self.file_path)))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_it_keeps_the_hashes_of_each_algorithm_apart(self):
+        self.cache_one_run()
+        self.reopen()
+        self.assertIsNone(self.cache.get(os.stat(self.file_path), "sha256"))
+        self.assertEqual(SHA1, self.cache.get(os.stat(self.file_path), "sha1"))
+
+    def test_it_never_reuses_files_that_changed_while_hashed(self):
+        self.cache_one_run(hashed_at=OLD_MTIME + 0.5)
+        self.reopen()
+        self.assertIsNone(self.cache.get(os.stat(self.file_path)))
+
+    def test_it_forgets_files_that_were_not_looked_up(self):
+        self.cache_one_run()
+        self.reopen()
+        self.cache.finish_run()
+        self.reopen()
+        self.assertIsNone(self.cache.get(os.stat(self.file_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
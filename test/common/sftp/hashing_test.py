@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from durasftp.common import generate_file_hash, generate_file_sha1
+from durasftp.common.sftp.hash_cache import HashCache
+from durasftp.common.sftp.hashing import (
+    HASH_POOL_MIN_FILES,
+    LocalHasher,
+    hash_base_path,
+    hash_command,
+    parse_hash_record,
+)
+
+SHA1 = "55ca6286e3e4f4fba5d0448333fa99fc5a404a73"
+
+
+class TestLocalHasher(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = TemporaryDirectory()
+        self.local_paths = []
+        for file_num in range(HASH_POOL_MIN_FILES * 2):
+            local_path = join(self.local_dir.name, "file_{}.txt".format(file_num))
+            with open(local_path, "w") as local_file:
+                local_file.write("content {}".format(file_num))
+            self.local_paths.append(local_path)
+
+    def tearDown(self):
+        self.local_dir.cleanup()
+
+    def test_it_hashes_files_in_a_pool_of_processes(self):
+        missing_path = join(self.local_dir.name, "missing.txt")
+        hashes = LocalHasher(processes=2).hash_files(self.local_paths + [missing_path])
+        self.assertEqual(
+            {
+                local_path: generate_file_sha1(local_path)
+                for local_path in self.local_paths
+            },
+            hashes,
+        )
+
+    def test_it_hashes_with_any_algorithm(self):
+        hashes = LocalHasher(processes=1).hash_files(self.local_paths[:1], "sha256")
+        self.assertEqual(
+            generate_file_hash(self.local_paths[0], "sha256"),
+            hashes[self.local_paths[0]],
+        )
+        self.assertEqual(64, len(hashes[self.local_paths[0]]))
+
+    def test_it_reuses_cached_hashes(self):
+        cache = HashCache(join(self.local_dir.name, "hashes.sqlite"))
+        try:
+            hasher = LocalHasher(cache, processes=1)
+            cache.start_run()
+            first_hashes = hasher.hash_files(self.local_paths)
+            self.assertEqual(len(self.local_paths), cache.misses)
+            cache.finish_run()
+            # Cached hashes are trusted, so a stale one shows that nothing was read
+            for local_path in first_hashes:
+                cache.put(os.stat(local_path), SHA1, 0)
+            cache.start_run()
+            self.assertEqual(first_hashes, hasher.hash_files(self.local_paths))
+        finally:
+            cache.close()
+
+
+class TestRemoteHashing(unittest.TestCase):
+    def test_it_builds_the_command_of_each_algorithm(self):
+        self.assertEqual("xargs -0 sha256sum -z", hash_command("sha256"))
+
+    def test_it_hashes_in_the_deepest_common_directory(self):
+        self.assertEqual("/base", hash_base_path(["/base/one.txt", "/base/sub/two"]))
+        self.assertEqual("/base/sub", hash_base_path(["/base/sub/two"]))
+        self.assertEqual("/", hash_base_path(["/one.txt", "/base/two"]))
+
+    def test_it_parses_hash_records(self):
+        self.assertEqual(
+            ("./a b\nc", SHA1),
+            parse_hash_record("{}  ./a b\nc".format(SHA1).encode("utf-8")),
+        )
+        self.assertEqual(
+            ("./bin", SHA1), parse_hash_record("{} *./bin".format(SHA1).encode())
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import unittest
+from threading import Event, RLock, Thread
+from time import monotonic
+
+from durasftp.common.sftp.health_monitor import HealthMonitor
+
+
+class FakeConnection:
+    def __init__(self):
+        self.host = "localhost"
+        self.port = 2222
+        self._op_lock = RLock()
+        self.last_used_at = monotonic() - 60
+        self.channels = []
+        self.suspect = False
+        self.reconnects = 0
+        self.probe_error = None
+        self.unstall = Event()
+        self.unstall.set()
+
+    def probe(self):
+        self.unstall.wait()
+        if self.probe_error is not None:
+            raise self.probe_error
+
+    def reconnect(self, generation=None):
+        self.reconnects += 1
+        self.unstall.set()
+
+
+class TestHealthMonitor(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeConnection()
+        self.monitor = HealthMonitor(self.conn, interval=1, probe_timeout=0.2)
+
+    def test_it_leaves_a_healthy_connection_alone(self):
+        self.assertTrue(self.monitor.check(self.conn))
+        self.assertEqual(1, self.monitor.probes)
+        self.assertEqual(0, self.conn.reconnects)
+        self.assertFalse(self.conn.suspect)
+
+    def test_it_reconnects_a_stalled_connection(self):
+        self.conn.unstall.clear()
+        self.assertFalse(self.monitor.check(self.conn))
+        self.assertEqual(1, self.monitor.stalls)
+        self.assertEqual(1, self.conn.reconnects)
+        self.assertFalse(self.conn.suspect)
+
+    def test_it_reconnects_a_failed_connection(self):
+        self.conn.probe_error = EOFError()
+        self.assertFalse(self.monitor.check(self.conn))
+        self.assertEqual(1, self.monitor.failures)
+        self.assertEqual(1, self.conn.reconnects)
+
+    def test_it_leaves_a_suspect_connection_to_its_next_operation(self):
+        self.conn.probe_error = EOFError()
+        self.conn.reconnect = self.fail_to_reconnect
+        self.assertFalse(self.monitor.check(self.conn))
+        self.assertTrue(self.conn.suspect)
+
+    def test_it_skips_a_recently_used_connection(self):
+        self.conn.last_used_at = monotonic()
+        self.assertTrue(self.monitor.check(self.conn))
+        self.assertEqual(0, self.monitor.probes)
+
+    def test_it_skips_a_connection_in_use(self):
+        channel = FakeConnection()
+        self.conn.channels.append(channel)
+        acquired = Event()
+        released = Event()
+        self.hold_in_another_thread(channel._op_lock, acquired, released)
+        acquired.wait()
+        self.assertTrue(self.monitor.check(self.conn))
+        self.assertEqual(0, self.monitor.probes)
+        released.set()
+        # The connection's own lock was given back
+        self.assertTrue(self.conn._op_lock.acquire(blocking=False))
+        self.conn._op_lock.release()
+
+    @staticmethod
+    def hold_in_another_thread(lock, acquired, released):
+        def hold():
+            with lock:
+                acquired.set()
+                released.wait()
+
+        Thread(target=hold, daemon=True).start()
+
+    @staticmethod
+    def fail_to_reconnect(generation=None):
+        raise OSError("Network is unreachable")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp.action_codes import SFTPActionCodes
+from durasftp.common.sftp.journal import ActionStates, MirrorJournal
+
+
+class PlannedAction:
+    def __init__(self, action_code, remote_path):
+        self.action_code = action_code
+        self.remote_path = remote_path
+
+
+class TestMirrorJournal(unittest.TestCase):
+    def setUp(self):
+        self.journal_dir = TemporaryDirectory()
+        self.journal_path = join(self.journal_dir.name, "journal.sqlite")
+        self.journal = MirrorJournal(self.journal_path)
+        self.actions = [
+            PlannedAction(SFTPActionCodes.LMKDIR, "/one"),
+            PlannedAction(SFTPActionCodes.GET, "/one/thing.jpg"),
+            PlannedAction(SFTPActionCodes.GET, "/temp.txt"),
+        ]
+        self.journal.save_plan("/tmp/local", True, self.actions)
+
+    def tearDown(self):
+        self.journal.close()
+        self.journal_dir.cleanup()
+
+    def test_it_saves_the_plan(self):
+        self.assertEqual(("/tmp/local", True), self.journal.plan())
+        self.assertEqual({ActionStates.PENDING: 3}, self.journal.counts())
+
+    def test_it_lists_unfinished_actions_in_plan_order(self):
+        self.journal.mark("/one", ActionStates.DONE)
+        self.journal.mark("/one/thing.jpg", ActionStates.IN_PROGRESS)
+        self.journal.mark("/temp.txt", ActionStates.FAILED, error="OSError()")
+        self.assertEqual(
+            [
+                ("/one/thing.jpg", SFTPActionCodes.GET),
+                ("/temp.txt", SFTPActionCodes.GET),
+            ],
+            self.journal.unfinished(),
+        )
+
+    def test_it_survives_reopening(self):
+        self.journal.mark("/one", ActionStates.DONE)
+        self.journal.close()
+        self.journal = MirrorJournal(self.journal_path)
+        self.assertEqual(("/tmp/local", True), self.journal.plan())
+        self.assertEqual(2, len(self.journal.unfinished()))
+
+    def test_a_new_plan_replaces_the_old_one(self):
+        self.journal.save_plan("/tmp/other", False, self.actions[:1])
+        self.assertEqual(("/tmp/other", False), self.journal.plan())
+        self.assertEqual([("/one", SFTPActionCodes.LMKDIR)], self.journal.unfinished())
+
+    def test_an_empty_journal_has_no_plan(self):
+        empty_journal = MirrorJournal(join(self.journal_dir.name, "empty.sqlite"))
+        with self.assertRaises(ValueError):
+            empty_journal.plan()
+        empty_journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
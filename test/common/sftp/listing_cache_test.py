@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import unittest
+from os.path import join
+from stat import S_IFDIR, S_IFREG
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.listing_cache import LOCAL, REMOTE, ListingCache
+
+OLD_MTIME = 1500000000
+
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+        self.cache_path = join(self.cache_dir.name, "listings.sqlite")
+        self.cache = ListingCache(self.cache_path)
+        self.entries = [
+            AttrEntry("one", S_IFDIR | 0o755, 4096, OLD_MTIME),
+            AttrEntry("temp.txt", S_IFREG | 0o644, 11, OLD_MTIME + 0.5),
+        ]
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache_dir.cleanup()
+
+    def cache_one_run(self):
+        self.cache.start_run()
+        self.cache.put(REMOTE, "/", OLD_MTIME, self.entries)
+        self.cache.finish_run()
+
+    def reopen(self, full_rescan_every=None):
+        self.cache.close()
+        self.cache = ListingCache(self.cache_path, full_rescan_every)
+        self.cache.start_run()
+
+    def test_it_reuses_unchanged_directories(self):
+        self.cache_one_run()
+        self.reopen()
+        cached_entries = self.cache.get(REMOTE, "/", OLD_MTIME)
+        self.assertEqual(["one", "temp.txt"], [entry.name for entry in cached_entries])
+        self.assertTrue(cached_entries[0].is_dir())
+        self.assertEqual(11, cached_entries[1].st_size)
+        self.assertEqual(OLD_MTIME + 0.5, cached_entries[1].st_mtime)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_it_lists_changed_directories(self):
+        self.cache_one_run()
+        self.reopen()
+        self.assertIsNone(self.cache.get(REMOTE, "/", OLD_MTIME + 1))
+        self.assertIsNone(self.cache.get(LOCAL, "/", OLD_MTIME))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_it_never_reuses_directories_that_changed_while_listed(self):
+        self.cache.start_run()
+        self.cache.put(REMOTE, "/", 4102444800, self.entries)
+        self.cache.finish_run()
+        self.reopen()
+        self.assertIsNone(self.cache.get(REMOTE, "/", 4102444800))
+
+    def test_it_rescans_every_n_runs(self):
+        self.cache_one_run()
+        self.reopen(full_rescan_every=3)
+        self.assertFalse(self.cache.full_rescan)
+        self.assertIsNotNone(self.cache.get(REMOTE, "/", OLD_MTIME))
+        self.cache.finish_run()
+        self.reopen(full_rescan_every=3)
+        self.assertTrue(self.cache.full_rescan)
+        self.assertIsNone(self.cache.get(REMOTE, "/", OLD_MTIME))
+
+    def test_it_forgets_directories_that_were_not_seen(self):
+        self.cache_one_run()
+        self.reopen()
+        self.cache.finish_run()
+        self.reopen()
+        self.assertIsNone(self.cache.get(REMOTE, "/", OLD_MTIME))
+
+
+if __name__ == "__main__":
+    unittest.main()
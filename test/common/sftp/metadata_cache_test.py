@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import unittest
+from stat import S_IFDIR, S_IFLNK, S_IFREG
+
+from paramiko import SFTPAttributes
+
+from durasftp.common.sftp.metadata_cache import (
+    LISTDIR,
+    LSTAT,
+    NOT_FOUND,
+    STAT,
+    MetadataCache,
+    cache_key_path,
+)
+
+
+def sftp_attrs(filename, st_mode):
+    attrs = SFTPAttributes()
+    attrs.filename = filename
+    attrs.st_mode = st_mode
+    attrs.st_size = 100
+    attrs.st_mtime = 1500000000
+    return attrs
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetadataCache(ttl=60)
+        self.entries = [
+            sftp_attrs("one", S_IFDIR | 0o755),
+            sftp_attrs("temp.txt", S_IFREG | 0o644),
+            sftp_attrs("link", S_IFLNK | 0o777),
+        ]
+
+    def test_it_counts_hits_and_misses(self):
+        self.assertIsNone(self.cache.get(STAT, "/temp.txt"))
+        self.cache.put(STAT, "/temp.txt", self.entries[1])
+        self.assertIs(self.entries[1], self.cache.get(STAT, "/temp.txt"))
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_it_remembers_missing_paths(self):
+        self.cache.put(STAT, "/missing.txt", NOT_FOUND)
+        self.assertIs(NOT_FOUND, self.cache.get(STAT, "/missing.txt"))
+
+    def test_listings_fill_in_the_stat_of_their_entries(self):
+        self.cache.put_listing("/data", self.entries)
+        self.assertEqual(self.entries, self.cache.get(LISTDIR, "/data"))
+        self.assertIs(self.entries[0], self.cache.get(STAT, "/data/one"))
+        self.assertIs(self.entries[1], self.cache.get(LSTAT, "/data/temp.txt"))
+        # A symlink's stat is the stat of its target
+        self.assertIs(self.entries[2], self.cache.get(LSTAT, "/data/link"))
+        self.assertIsNone(self.cache.get(STAT, "/data/link"))
+
+    def test_entries_expire(self):
+        cache = MetadataCache(ttl=-1)
+        cache.put(STAT, "/temp.txt", self.entries[1])
+        self.assertIsNone(cache.get(STAT, "/temp.txt"))
+
+    def test_it_evicts_the_least_recently_used_entries(self):
+        cache = MetadataCache(max_entries=2)
+        cache.put(STAT, "/a", self.entries[1])
+        cache.put(STAT, "/b", self.entries[1])
+        cache.get(STAT, "/a")
+        cache.put(STAT, "/c", self.entries[1])
+        self.assertEqual(2, len(cache))
+        self.assertIsNotNone(cache.get(STAT, "/a"))
+        self.assertIsNone(cache.get(STAT, "/b"))
+
+    def test_changes_invalidate_the_path_and_its_directory(self):
+        self.cache.put(STAT, "/data", self.entries[0])
+        self.cache.put_listing("/data", self.entries)
+        self.cache.invalidate("/data/temp.txt")
+        self.assertIsNone(self.cache.get(STAT, "/data/temp.txt"))
+        self.assertIsNone(self.cache.get(LISTDIR, "/data"))
+        self.assertIsNone(self.cache.get(STAT, "/data"))
+        self.assertIsNotNone(self.cache.get(STAT, "/data/one"))
+
+    def test_removing_a_directory_invalidates_everything_below_it(self):
+        self.cache.put_listing("/data", self.entries)
+        self.cache.put_listing("/data/one", self.entries)
+        self.cache.put(STAT, "/database", self.entries[1])
+        self.cache.invalidate("/data", recursive=True)
+        self.assertIsNone(self.cache.get(LISTDIR, "/data/one"))
+        self.assertIsNone(self.cache.get(STAT, "/data/one/temp.txt"))
+        self.assertIsNotNone(self.cache.get(STAT, "/database"))
+
+    def test_only_absolute_paths_are_cached(self):
+        self.assertEqual("/data/one", cache_key_path("/data//one/"))
+        self.assertIsNone(cache_key_path("data/one"))
+
+
+if __name__ == "__main__":
+    unittest.main()
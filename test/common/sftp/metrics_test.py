@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+from urllib.request import urlopen
+
+from durasftp.common.sftp.metrics import ConnectionMetrics, Histogram
+
+
+class TestHistogram(unittest.TestCase):
+    def test_it_counts_into_cumulative_buckets(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual([(0.1, 2), (1, 3), ("+Inf", 4)], histogram.cumulative_counts())
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(2.65, histogram.sum)
+
+
+class TestConnectionMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = ConnectionMetrics(buckets=(0.1, 1))
+        self.metrics.record_call("listdir_attr", 0.05)
+        self.metrics.record_call("listdir_attr", 0.5)
+        self.metrics.record_call("get", 2, failed=True)
+        self.metrics.record_retry("get")
+        self.metrics.record_reconnect(0.3)
+        self.metrics.add_bytes_in(1000)
+        self.metrics.add_bytes_out(24)
+
+    def test_it_is_readable_as_attributes(self):
+        self.assertEqual({"listdir_attr": 2, "get": 1}, self.metrics.calls)
+        self.assertEqual({"get": 1}, self.metrics.errors)
+        self.assertEqual({"get": 1}, self.metrics.retries)
+        self.assertEqual(2, self.metrics.latency["listdir_attr"].count)
+        self.assertEqual(1, self.metrics.reconnects)
+        self.assertEqual((1000, 24), (self.metrics.bytes_in, self.metrics.bytes_out))
+
+    def test_it_exports_prometheus_text(self):
+        text = self.metrics.to_prometheus()
+        self.assertIn("# TYPE durasftp_calls_total counter\n", text)
+        self.assertIn('durasftp_calls_total{method="listdir_attr"} 2\n', text)
+        self.assertIn('durasftp_errors_total{method="get"} 1\n', text)
+        self.assertIn('durasftp_retries_total{method="get"} 1\n', text)
+        self.assertIn(
+            'durasftp_call_duration_seconds_bucket{method="listdir_attr",le="0.1"} 1\n',
+            text,
+        )
+        self.assertIn(
+            'durasftp_call_duration_seconds_bucket{method="listdir_attr",le="+Inf"} 2\n',
+            text,
+        )
+        self.assertIn('durasftp_call_duration_seconds_count{method="get"} 1\n', text)
+        self.assertIn("durasftp_reconnects_total 1\n", text)
+        self.assertIn('durasftp_reconnect_duration_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn("durasftp_received_bytes_total 1000\n", text)
+        self.assertIn("durasftp_sent_bytes_total 24\n", text)
+
+    def test_it_writes_prometheus_text_to_a_file(self):
+        metrics_dir = tempfile.mkdtemp()
+        metrics_path = os.path.join(metrics_dir, "durasftp.prom")
+        self.metrics.write_prometheus(metrics_path)
+        with open(metrics_path) as metrics_file:
+            self.assertEqual(self.metrics.to_prometheus(), metrics_file.read())
+        self.assertEqual(["durasftp.prom"], os.listdir(metrics_dir))
+
+    def test_it_serves_prometheus_text(self):
+        server = self.metrics.serve_prometheus(0)
+        try:
+            url = "http://{}:{}/metrics".format(*server.server_address)
+            with urlopen(url) as response:
+                self.assertEqual(
+                    self.metrics.to_prometheus(), response.read().decode("utf-8")
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,22 @@
+import json
 import unittest
-from os import stat, utime, urandom
+from os import listdir, makedirs, remove, rename, stat, utime, urandom
+from os.path import dirname, exists, join
+from tempfile import TemporaryDirectory
 
 from durasftp.common import ONE_MB
 from durasftp.common.log import get_logger
 from durasftp.common.sftp.action_codes import SFTPActionCodes
-from test.common.sftp.mirrorer_test import TestMirrorerBase
+from durasftp.common.sftp.connection import PARTIAL_SUFFIX, PARTIAL_STATE_SUFFIX
+from durasftp.common.sftp.filters import PathFilter
+from durasftp.common.sftp.hashing import COMPARE_HASH, VerifyStates
+from durasftp.common.sftp.journal import ActionStates, MirrorJournal
+from durasftp.common.sftp.listing_cache import ListingCache
+from durasftp.common.sftp.metadata_cache import MetadataCache
+from durasftp.common.sftp.metrics import ConnectionMetrics
+from durasftp.common.sftp.profiler import RunProfiler
+from test.common.config import SFTP_BASE
+from test.common.sftp.mirrorer_test import TestMirrorerBase, paths_from_remote
 
 """
 These tests require a running local SFTP server, configured in src.test.common.config
@@ -58,6 +70,84 @@ class TestMirrorerFromRemote(TestMirrorerBase):
         )
         self.assertEqual(2, len(lmkdir_actions))
 
+    def test_parallel_mirror(self):
+        remote_paths = ["/file_{}.txt".format(x) for x in range(9)] + [
+            "/one/two/temp.txt",
+            "/one/thing.jpg",
+        ]
+        all_path_sets = self.make_remote_content(remote_paths)
+        self.mirrorer.mirror_from_remote(workers=4)
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+
+        get_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.GET]
+        )
+        self.assertEqual(11, len(get_actions))
+        self.assertLessEqual(len(self.mirrorer.pool), 4)
+
+    def test_parallel_mirror_over_channels(self):
+        remote_paths = ["/file_{}.txt".format(x) for x in range(9)]
+        all_path_sets = self.make_remote_content(remote_paths)
+        self.mirrorer.pool.connection_factory = self.mirrorer.conn.open_channel
+        self.mirrorer.mirror_from_remote(workers=4, streaming=True)
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+        for conn in self.mirrorer.pool.connections:
+            self.assertIs(self.mirrorer.conn._transport, conn._transport)
+
+        # When the shared transport dies, it is only rebuilt once, and every channel
+        #   reopens on the new one
+        self.make_remote_content(["/file_9.txt"])
+        self.mirrorer.conn._transport.close()
+        self.mirrorer.mirror_from_remote(workers=4, streaming=True)
+        self.assert_files_match("/file_9.txt")
+        self.assertEqual(1, self.mirrorer.conn.generation)
+
+    def test_concurrent_listing_matches_sequential_listing(self):
+        self.make_remote_content(
+            [
+                "/temp.txt",
+                "/one/two/temp.txt",
+                "/one/two/three/",
+                "/one/thing.jpg",
+                "/four/five/six/seven.txt",
+                "/four/eight/",
+            ]
+        )
+        self.mirrorer.load_stat_trees()
+        sequential_tree = self.mirrorer.remote_attr_tree
+        self.mirrorer.load_stat_trees(workers=4)
+        concurrent_tree = self.mirrorer.remote_attr_tree
+        self.assertEqual(list(sequential_tree.keys()), list(concurrent_tree.keys()))
+        for remote_path, remote_entry in sequential_tree.items():
+            self.assertEqual(remote_entry.st_mode, concurrent_tree[remote_path].st_mode)
+            self.assertEqual(remote_entry.st_size, concurrent_tree[remote_path].st_size)
+
+    def test_streaming_mirror(self):
+        remote_paths = [
+            "/temp.txt",
+            "/one/two/temp.txt",
+            "/one/two/thing.jpg",
+            "/one/thing.jpg",
+        ]
+        all_path_sets = self.make_remote_content(remote_paths)
+        self.mirrorer.mirror_from_remote(workers=2, streaming=True)
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+
+        get_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.GET]
+        )
+        self.assertEqual(4, len(get_actions))
+        lmkdir_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.LMKDIR]
+        )
+        self.assertEqual(2, len(lmkdir_actions))
+
+        self.mirrorer.mirror_from_remote(workers=2, streaming=True)
+        self.assertEqual(0, len(self.mirrorer.action_list.items()))
+
     def test_does_not_copy_twice(self):
         remote_paths = [
             "/temp.txt",
@@ -117,6 +207,334 @@ class TestMirrorerFromRemote(TestMirrorerBase):
         self.mirrorer.mirror_from_remote()
         self.assert_files_match(remote_path)
 
+    def test_it_resumes_partial_downloads(self):
+        random_megabyte = urandom(ONE_MB)
+        remote_path, local_path, sftp_path = self.make_remote_test_file(
+            "/big/huge.csv", content=random_megabyte, iterations=2
+        )
+        self.make_local_content(["/big/"])
+        sftp_stat = stat(sftp_path)
+        with open(local_path + PARTIAL_SUFFIX, "wb") as partial_file:
+            partial_file.write(random_megabyte)
+        with open(local_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+            # SFTP only has whole second mtimes
+            json.dump(
+                {"size": sftp_stat.st_size, "mtime": int(sftp_stat.st_mtime)},
+                state_file,
+            )
+
+        metrics = ConnectionMetrics()
+        self.mirrorer.conn.metrics = metrics
+        self.mirrorer.mirror_from_remote()
+        self.assert_files_match(remote_path)
+        self.assertEqual(["huge.csv"], listdir(dirname(local_path)))
+        # Only the second megabyte was downloaded
+        self.assertEqual(ONE_MB, metrics.bytes_in)
+
+    def test_it_restarts_partial_downloads_if_the_remote_changed(self):
+        remote_path, local_path, sftp_path = self.make_remote_test_file(
+            "/big/huge.csv", content=urandom(ONE_MB)
+        )
+        self.make_local_content(["/big/"])
+        with open(local_path + PARTIAL_SUFFIX, "wb") as partial_file:
+            partial_file.write(urandom(ONE_MB // 2))
+        with open(local_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+            json.dump({"size": ONE_MB, "mtime": 0}, state_file)
+
+        self.mirrorer.mirror_from_remote()
+        self.assert_files_match(remote_path)
+
+    def test_it_downloads_large_files_in_segments(self):
+        remote_path, local_path, sftp_path = self.make_remote_test_file(
+            "/big/huge.csv", content=urandom(ONE_MB), iterations=3
+        )
+        self.make_local_content(["/big/"])
+        sftp_stat = stat(sftp_path)
+        # Pretend that the first of three segments was downloaded before an interruption
+        with open(local_path + PARTIAL_SUFFIX, "wb") as partial_file:
+            with open(sftp_path, "rb") as sftp_file:
+                partial_file.write(sftp_file.read(ONE_MB))
+            partial_file.truncate(sftp_stat.st_size)
+        with open(local_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+            json.dump(
+                {
+                    "size": sftp_stat.st_size,
+                    "mtime": sftp_stat.st_mtime,
+                    "segment_size": ONE_MB,
+                    "done_segments": [0],
+                },
+                state_file,
+            )
+
+        self.mirrorer.segment_threshold = ONE_MB
+        self.mirrorer.segment_size = ONE_MB
+        self.mirrorer.mirror_from_remote(workers=2)
+        self.assert_files_match(remote_path)
+        self.assertEqual(["huge.csv"], listdir(dirname(local_path)))
+
+    def test_it_resumes_from_a_journal(self):
+        remote_paths = ["/one/file_{}.txt".format(x) for x in range(6)]
+        all_path_sets = self.make_remote_content(remote_paths)
+        with TemporaryDirectory() as journal_dir:
+            journal = MirrorJournal(join(journal_dir, "journal.sqlite"))
+            downloaded = []
+
+            def interrupt(action):
+                downloaded.append(action.remote_path)
+                if len(downloaded) == 3:
+                    raise KeyboardInterrupt()
+
+            with self.assertRaises(KeyboardInterrupt):
+                self.mirrorer.mirror_from_remote(callback=interrupt, journal=journal)
+            self.assertEqual(4, journal.counts()[ActionStates.PENDING])
+
+            resumed_actions = self.mirrorer.resume(journal)
+            for remote_path, local_path, sftp_path in all_path_sets:
+                self.assert_files_match(remote_path)
+            get_actions = resumed_actions.filtered_items(codes=[SFTPActionCodes.GET])
+            self.assertEqual(4, len(get_actions))
+            self.assertEqual({ActionStates.DONE: 7}, journal.counts())
+            journal.close()
+
+    def test_it_profiles_each_phase_of_a_run(self):
+        remote_path, local_path, sftp_path = self.make_remote_test_file("/one/a.txt")
+        with TemporaryDirectory() as report_dir:
+            report_path = join(report_dir, "profile.json")
+            self.mirrorer.profiler = RunProfiler(report_path=report_path)
+            self.mirrorer.mirror_from_remote()
+            self.assert_files_match(remote_path)
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+            self.assertEqual("mirror_from_remote", report["run"])
+            self.assertEqual(
+                [
+                    "load_remote_dir_listing",
+                    "load_local_dir_listing",
+                    "build_actions",
+                    "do_actions",
+                ],
+                [phase["name"] for phase in report["phases"]],
+            )
+            self.assertIn("do_actions", self.mirrorer.profiler.report())
+
+            # A verify is one more phase of the mirror, not a run of its own
+            self.mirrorer.verify()
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+        self.assertEqual("mirror_from_remote", report["run"])
+        self.assertEqual(
+            ["do_actions", "verify"], [phase["name"] for phase in report["phases"]][-2:]
+        )
+
+    def test_it_picks_up_new_files_with_a_listing_cache(self):
+        remote_path, local_path, sftp_path = self.make_remote_test_file("/one/a.txt")
+        # Directories that changed just before they were listed are never reused
+        utime(dirname(sftp_path), (1500000000, 1500000000))
+        with TemporaryDirectory() as cache_dir:
+            listing_cache = ListingCache(join(cache_dir, "listings.sqlite"))
+            self.mirrorer.listing_cache = listing_cache
+            self.mirrorer.mirror_from_remote()
+            self.assert_files_match(remote_path)
+
+            self.mirrorer.mirror_from_remote()
+            self.assertLess(0, listing_cache.hits)
+
+            new_remote_path, new_local_path, new_sftp_path = self.make_remote_test_file(
+                "/one/b.txt"
+            )
+            utime(dirname(new_sftp_path), (1500000060, 1500000060))
+            self.mirrorer.mirror_from_remote()
+            self.assert_files_match(new_remote_path)
+            self.mirrorer.listing_cache = None
+            listing_cache.close()
+
+    def test_it_renames_moved_files(self):
+        self.make_remote_test_file("/one/a.txt")
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_from_remote()
+
+        old_remote_path, old_local_path, old_sftp_path = paths_from_remote("/one/a.txt")
+        remote_path, local_path, sftp_path = paths_from_remote("/two/b.txt")
+        makedirs(dirname(sftp_path))
+        rename(old_sftp_path, sftp_path)
+        self.ensure_remote_path_is_visible(remote_path)
+        self.mirrorer.mirror_from_remote()
+        self.assert_files_match(remote_path)
+        self.assert_local_missing(old_remote_path)
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.LRENAME]
+        )
+        self.assertEqual(["/two/b.txt"], [path for path, action in rename_actions])
+        get_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.GET]
+        )
+        self.assertEqual(0, len(get_actions))
+
+    def test_it_pairs_moved_files_with_the_same_fingerprint_by_hash(self):
+        for name, content in [("a", b"a"), ("b", b"b")]:
+            remote_path, local_path, sftp_path = self.make_remote_test_file(
+                "/one/{}.txt".format(name), content=content, iterations=1000
+            )
+            utime(sftp_path, (1500000000, 1500000000))
+        self.skip_unless_the_server_hashes("/one/a.txt")
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_from_remote()
+
+        makedirs(join(SFTP_BASE, "two"))
+        for name in ["a", "b"]:
+            old_remote_path, old_local_path, old_sftp_path = paths_from_remote(
+                "/one/{}.txt".format(name)
+            )
+            remote_path, local_path, sftp_path = paths_from_remote(
+                "/two/{}.txt".format(name)
+            )
+            rename(old_sftp_path, sftp_path)
+            self.ensure_remote_path_is_visible(remote_path)
+        self.mirrorer.mirror_from_remote()
+        for name in ["a", "b"]:
+            self.assert_files_match("/two/{}.txt".format(name))
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.LRENAME]
+        )
+        self.assertEqual(2, len(rename_actions))
+
+    def test_it_downloads_moved_files_that_changed_after_planning(self):
+        self.make_remote_test_file("/one/a.txt")
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_from_remote()
+
+        old_remote_path, old_local_path, old_sftp_path = paths_from_remote("/one/a.txt")
+        remote_path, local_path, sftp_path = paths_from_remote("/two/b.txt")
+        makedirs(dirname(sftp_path))
+        rename(old_sftp_path, sftp_path)
+        self.ensure_remote_path_is_visible(remote_path)
+        self.mirrorer.actions_to_mirror_from_remote()
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.LRENAME]
+        )
+        self.assertEqual(1, len(rename_actions))
+
+        with open(old_local_path, "ab") as old_local_file:
+            old_local_file.write(b"!!!")
+        self.mirrorer.action_list.do_actions()
+        self.assert_files_match(remote_path)
+        self.assertTrue(exists(old_local_path))
+
+    def test_it_compares_contents_by_hash(self):
+        for name in ["touched", "changed"]:
+            self.make_remote_test_file(
+                "/one/{}.txt".format(name), content=urandom(1000)
+            )
+        self.skip_unless_the_server_hashes("/one/touched.txt")
+        self.mirrorer.mirror_from_remote()
+
+        # A new mtime with the same contents, then a new byte with the same mtime
+        remote_path, local_path, sftp_path = paths_from_remote("/one/touched.txt")
+        utime(sftp_path, (1500000000, 1500000000))
+        remote_path, local_path, sftp_path = paths_from_remote("/one/changed.txt")
+        sftp_stat = stat(sftp_path)
+        with open(sftp_path, "r+b") as sftp_file:
+            first_byte = sftp_file.read(1)
+            sftp_file.seek(0)
+            sftp_file.write(bytes([first_byte[0] ^ 0xFF]))
+        utime(sftp_path, (sftp_stat.st_atime, sftp_stat.st_mtime))
+
+        self.mirrorer.compare = COMPARE_HASH
+        self.mirrorer.mirror_from_remote()
+        get_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.GET]
+        )
+        self.assertEqual(["/one/changed.txt"], [path for path, action in get_actions])
+        self.assert_files_match("/one/changed.txt")
+
+    def test_it_verifies_a_mirror(self):
+        for name in ["match", "mismatch", "missing"]:
+            self.make_remote_test_file(
+                "/one/{}.txt".format(name), content=urandom(1000)
+            )
+        self.skip_unless_the_server_hashes("/one/match.txt")
+        self.mirrorer.mirror_from_remote()
+
+        # One byte changed, with the same size and mtime
+        remote_path, local_path, sftp_path = paths_from_remote("/one/mismatch.txt")
+        local_stat = stat(local_path)
+        with open(local_path, "r+b") as local_file:
+            first_byte = local_file.read(1)
+            local_file.seek(0)
+            local_file.write(bytes([first_byte[0] ^ 0xFF]))
+        utime(local_path, (local_stat.st_atime, local_stat.st_mtime))
+        remote_path, local_path, sftp_path = paths_from_remote("/one/missing.txt")
+        remove(local_path)
+        self.make_local_test_file("/one/extra.txt")
+
+        states = self.mirrorer.verify()
+        self.assertEqual(
+            {
+                "/one/match.txt": VerifyStates.MATCH,
+                "/one/mismatch.txt": VerifyStates.MISMATCH,
+                "/one/missing.txt": VerifyStates.MISSING_LOCAL,
+                "/one/extra.txt": VerifyStates.MISSING_REMOTE,
+            },
+            dict(states),
+        )
+
+    def test_it_leaves_files_unverified_if_the_server_cannot_hash(self):
+        self.make_remote_test_file("/one/a.txt", content=urandom(1000))
+        self.mirrorer.mirror_from_remote()
+        self.mirrorer.conn.exec_hashing = False
+        self.mirrorer.conn.check_file_hashing = False
+
+        states = self.mirrorer.verify()
+        self.assertEqual({"/one/a.txt": VerifyStates.UNVERIFIED}, dict(states))
+
+    def test_it_tries_find_once_before_listing_over_sftp(self):
+        remote_paths = ["/one/two/a.txt", "/one/b.txt", "/three/c.txt"]
+        all_path_sets = self.make_remote_content(remote_paths)
+        find_paths = []
+
+        def find_fails(remote_path):
+            # As after a connection error, which leaves find_listing on
+            find_paths.append(remote_path)
+            return False
+
+        self.mirrorer.find_listing = True
+        self.mirrorer.load_remote_tree_with_find = find_fails
+        self.mirrorer.mirror_from_remote()
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+        self.assertEqual([self.mirrorer.root], find_paths)
+
+    def test_it_lists_the_remote_again_with_a_metadata_cache(self):
+        self.make_remote_test_file("/one/a.txt")
+        metadata_cache = MetadataCache(ttl=60)
+        self.mirrorer.metadata_cache = metadata_cache
+        self.mirrorer.conn.metadata_cache = metadata_cache
+        self.mirrorer.mirror_from_remote()
+
+        # Within the ttl, the next run still sees the change
+        remote_path, local_path, sftp_path = self.make_remote_test_file("/one/b.txt")
+        self.mirrorer.mirror_from_remote()
+        self.assert_files_match(remote_path)
+
+    def test_subdirectory_mirror_with_filters(self):
+        included_path_sets = self.make_remote_content(
+            ["/data/sub/a.csv", "/data/deep/er/b.csv"]
+        )
+        excluded_path_sets = self.make_remote_content(
+            ["/data/sub/c.tmp", "/data/archive/d.csv", "/other/e.csv"]
+        )
+        self.mirrorer.root = "/data"
+        self.mirrorer.path_filter = PathFilter(include=["*.csv"], exclude=["*/archive"])
+        self.mirrorer.mirror_from_remote()
+        for remote_path, local_path, sftp_path in included_path_sets:
+            self.assert_files_match(remote_path)
+        for remote_path, local_path, sftp_path in excluded_path_sets:
+            self.assert_local_missing(remote_path)
+        self.assert_local_missing("/data/archive")
+
+        self.mirrorer.mirror_from_remote(workers=2, streaming=True)
+        self.assertEqual(0, len(self.mirrorer.action_list.items()))
+
     def test_it_handles_empty_directories(self):
         all_path_sets = self.make_remote_content(["/some/nested/dir/"])
         remote_path, local_path, sftp_path = all_path_sets[0]
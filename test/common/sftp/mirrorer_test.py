@@ -216,6 +216,11 @@ class TestMirrorerBase(unittest.TestCase):
                         )
                     )
 
+    def skip_unless_the_server_hashes(self, remote_path):
+        # Servers that only allow SFTP, and lack the check-file extension, cannot hash
+        if not self.mirrorer.conn.hash_many([remote_path]):
+            self.skipTest("The SFTP server cannot hash files")
+
     def expect_sftp_failure(self, fn):
         try:
             fn()
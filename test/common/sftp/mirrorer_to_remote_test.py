@@ -1,10 +1,12 @@
 import unittest
-from os import stat, utime, urandom
+from os import makedirs, rename, stat, utime, urandom
+from os.path import dirname, exists, join
 
 from durasftp.common import ONE_MB
 from durasftp.common.log import get_logger
 from durasftp.common.sftp.action_codes import SFTPActionCodes
-from test.common.sftp.mirrorer_test import TestMirrorerBase
+from test.common.config import LOCAL_BASE
+from test.common.sftp.mirrorer_test import TestMirrorerBase, paths_from_remote
 
 """
 These tests require a running local SFTP server, configured in src.test.common.config
@@ -58,6 +60,46 @@ class TestMirrorerToRemote(TestMirrorerBase):
         )
         self.assertEqual(2, len(rmkdir_actions))
 
+    def test_parallel_mirror(self):
+        remote_paths = ["/file_{}.txt".format(x) for x in range(9)] + [
+            "/one/two/temp.txt",
+            "/one/thing.jpg",
+        ]
+        all_path_sets = self.make_local_content(remote_paths)
+        self.mirrorer.mirror_to_remote(workers=4)
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+
+        put_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.PUT]
+        )
+        self.assertEqual(11, len(put_actions))
+        self.assertLessEqual(len(self.mirrorer.pool), 4)
+
+    def test_streaming_mirror(self):
+        remote_paths = [
+            "/temp.txt",
+            "/one/two/temp.txt",
+            "/one/two/thing.jpg",
+            "/one/thing.jpg",
+        ]
+        all_path_sets = self.make_local_content(remote_paths)
+        self.mirrorer.mirror_to_remote(workers=2, streaming=True)
+        for remote_path, local_path, sftp_path in all_path_sets:
+            self.assert_files_match(remote_path)
+
+        put_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.PUT]
+        )
+        self.assertEqual(4, len(put_actions))
+        rmkdir_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.RMKDIR]
+        )
+        self.assertEqual(2, len(rmkdir_actions))
+
+        self.mirrorer.mirror_to_remote(workers=2, streaming=True)
+        self.assertEqual(0, len(self.mirrorer.action_list.items()))
+
     def test_does_not_copy_twice(self):
         remote_paths = [
             "/temp.txt",
@@ -117,6 +159,95 @@ class TestMirrorerToRemote(TestMirrorerBase):
         self.mirrorer.mirror_to_remote()
         self.assert_files_match(remote_path)
 
+    def test_it_uploads_large_files_in_segments(self):
+        remote_path, local_path, sftp_path = self.make_local_test_file(
+            "/big/huge.csv", content=urandom(ONE_MB), iterations=3
+        )
+        utime(local_path, (1500000000, 1500000000))
+        self.mirrorer.segment_threshold = ONE_MB
+        self.mirrorer.segment_size = ONE_MB
+        self.mirrorer.mirror_to_remote(workers=2)
+        self.assert_files_match(remote_path)
+        self.assertEqual(1500000000, stat(sftp_path).st_mtime)
+
+        self.mirrorer.mirror_to_remote()
+        put_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.PUT, SFTPActionCodes.RMKDIR]
+        )
+        self.assertEqual(0, len(put_actions))
+
+    def test_it_renames_moved_files(self):
+        self.make_local_test_file("/one/a.txt")
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_to_remote()
+
+        old_remote_path, old_local_path, old_sftp_path = paths_from_remote("/one/a.txt")
+        remote_path, local_path, sftp_path = paths_from_remote("/two/b.txt")
+        makedirs(dirname(local_path))
+        rename(old_local_path, local_path)
+        self.ensure_local_path_is_visible(remote_path)
+        self.mirrorer.mirror_to_remote()
+        self.assert_files_match(remote_path)
+        self.assert_remote_missing(old_remote_path)
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.RRENAME]
+        )
+        self.assertEqual(["/two/b.txt"], [path for path, action in rename_actions])
+        put_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.PUT]
+        )
+        self.assertEqual(0, len(put_actions))
+
+    def test_it_pairs_moved_files_with_the_same_fingerprint_by_hash(self):
+        for name, content in [("a", b"a"), ("b", b"b")]:
+            remote_path, local_path, sftp_path = self.make_local_test_file(
+                "/one/{}.txt".format(name), content=content, iterations=1000
+            )
+            utime(local_path, (1500000000, 1500000000))
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_to_remote()
+        self.skip_unless_the_server_hashes("/one/a.txt")
+
+        makedirs(join(LOCAL_BASE, "two"))
+        for name in ["a", "b"]:
+            old_remote_path, old_local_path, old_sftp_path = paths_from_remote(
+                "/one/{}.txt".format(name)
+            )
+            remote_path, local_path, sftp_path = paths_from_remote(
+                "/two/{}.txt".format(name)
+            )
+            rename(old_local_path, local_path)
+            self.ensure_local_path_is_visible(remote_path)
+        self.mirrorer.mirror_to_remote()
+        for name in ["a", "b"]:
+            self.assert_files_match("/two/{}.txt".format(name))
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.RRENAME]
+        )
+        self.assertEqual(2, len(rename_actions))
+
+    def test_it_uploads_moved_files_that_changed_after_planning(self):
+        self.make_local_test_file("/one/a.txt")
+        self.mirrorer.detect_moves = True
+        self.mirrorer.mirror_to_remote()
+
+        old_remote_path, old_local_path, old_sftp_path = paths_from_remote("/one/a.txt")
+        remote_path, local_path, sftp_path = paths_from_remote("/two/b.txt")
+        makedirs(dirname(local_path))
+        rename(old_local_path, local_path)
+        self.ensure_local_path_is_visible(remote_path)
+        self.mirrorer.actions_to_mirror_to_remote()
+        rename_actions = self.mirrorer.action_list.filtered_items(
+            codes=[SFTPActionCodes.RRENAME]
+        )
+        self.assertEqual(1, len(rename_actions))
+
+        with open(old_sftp_path, "ab") as old_sftp_file:
+            old_sftp_file.write(b"!!!")
+        self.mirrorer.action_list.do_actions()
+        self.assert_files_match(remote_path)
+        self.assertTrue(exists(old_sftp_path))
+
     def test_it_handles_empty_directories(self):
         all_path_sets = self.make_local_content(["/some/nested/dir/"])
         remote_path, local_path, sftp_path = all_path_sets[0]
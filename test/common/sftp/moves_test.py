@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import unittest
+from collections import OrderedDict
+
+from durasftp.common.sftp.attr_tree import AttrEntry
+from durasftp.common.sftp.moves import (
+    MoveDetector,
+    fingerprint,
+    group_by_fingerprint,
+    match_by_hash,
+)
+
+
+class FakeConnection:
+    def __init__(self, can_hash=True):
+        self.can_hash = can_hash
+
+
+class FakeMirrorer:
+    """
+    Hashes each remote path and local path to the digest given for it
+    """
+
+    def __init__(self, remote_digests, local_digests, can_hash=True):
+        self.conn = FakeConnection(can_hash)
+        self.remote_digests = remote_digests
+        self.local_digests = local_digests
+        self.hashed = []
+
+    def hash_both_sides(self, remote_paths, algo="sha1", local_paths=None):
+        self.hashed.append((list(remote_paths), list(local_paths)))
+        return (
+            {path: self.remote_digests[path] for path in remote_paths},
+            {path: self.local_digests[path] for path in local_paths},
+        )
+
+
+class TestFingerprints(unittest.TestCase):
+    def test_fingerprint_whole_seconds(self):
+        entry = AttrEntry("a.txt", 0o100644, 12, 1600000000.75)
+        self.assertEqual((12, 1600000000), fingerprint(entry))
+
+    def test_group_by_fingerprint(self):
+        new_files = OrderedDict(
+            [("/new/a", (1, 10)), ("/new/b", (2, 20)), ("/new/c", (2, 20))]
+        )
+        orphans = OrderedDict(
+            [("/old/a", (1, 10)), ("/old/b", (2, 20)), ("/old/z", (3, 30))]
+        )
+        self.assertEqual(
+            [(["/new/a"], ["/old/a"]), (["/new/b", "/new/c"], ["/old/b"])],
+            group_by_fingerprint(new_files, orphans),
+        )
+
+    def test_match_by_hash_uses_each_orphan_once(self):
+        moves = match_by_hash(
+            ["/new/a", "/new/b", "/new/c"],
+            ["/old/a", "/old/b"],
+            {"/new/a": "1", "/new/b": "1", "/new/c": "2"},
+            {"/old/a": "1", "/old/b": "3"},
+        )
+        self.assertEqual([("/new/a", "/old/a")], moves)
+
+    def test_match_by_hash_without_hashes(self):
+        self.assertEqual([], match_by_hash(["/new/a"], ["/old/a"], {}, {}))
+
+
+class TestMoveDetector(unittest.TestCase):
+    def setUp(self):
+        self.new_files = OrderedDict(
+            [("/new/a", (1, 10)), ("/new/b", (2, 20)), ("/new/c", (2, 20))]
+        )
+        self.orphans = OrderedDict(
+            [("/old/a", (1, 10)), ("/old/b", (2, 20)), ("/old/c", (2, 20))]
+        )
+
+    def test_unique_matches_are_not_hashed(self):
+        mirrorer = FakeMirrorer(
+            {"/new/b": "b", "/new/c": "c"}, {"/old/b": "c", "/old/c": "b"}
+        )
+        moves = MoveDetector(mirrorer).find_moves(self.new_files, self.orphans)
+        self.assertEqual(
+            [("/new/a", "/old/a"), ("/new/b", "/old/c"), ("/new/c", "/old/b")], moves
+        )
+        self.assertEqual(
+            [(["/new/b", "/new/c"], ["/old/b", "/old/c"])], mirrorer.hashed
+        )
+
+    def test_confirm_all(self):
+        mirrorer = FakeMirrorer(
+            {"/new/a": "x", "/new/b": "b", "/new/c": "c"},
+            {"/old/a": "a", "/old/b": "b", "/old/c": "c"},
+        )
+        detector = MoveDetector(mirrorer, confirm_all=True)
+        moves = detector.find_moves(self.new_files, self.orphans)
+        self.assertEqual([("/new/b", "/old/b"), ("/new/c", "/old/c")], moves)
+
+    def test_to_remote_hashes_orphans_remotely(self):
+        mirrorer = FakeMirrorer(
+            {"/old/b": "b", "/old/c": "c"}, {"/new/b": "c", "/new/c": "b"}
+        )
+        detector = MoveDetector(mirrorer, from_remote=False)
+        moves = detector.find_moves(self.new_files, self.orphans)
+        self.assertEqual(
+            [("/new/a", "/old/a"), ("/new/b", "/old/c"), ("/new/c", "/old/b")], moves
+        )
+        self.assertEqual(
+            [(["/old/b", "/old/c"], ["/new/b", "/new/c"])], mirrorer.hashed
+        )
+
+    def test_ambiguous_without_hashing(self):
+        mirrorer = FakeMirrorer({}, {}, can_hash=False)
+        moves = MoveDetector(mirrorer).find_moves(self.new_files, self.orphans)
+        self.assertEqual([("/new/a", "/old/a")], moves)
+        self.assertEqual([], mirrorer.hashed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tracemalloc
+import unittest
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp.profiler import (
+    RunProfiler,
+    format_bytes,
+    profiled_phase,
+    profiled_run,
+)
+
+
+class ProfiledRunner:
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.kept = []
+
+    @profiled_run
+    def run(self):
+        with self.profiler.phase("allocate"):
+            self.kept.append([str(number) for number in range(50000)])
+        with self.profiler.phase("spin"):
+            sum(number * number for number in range(100000))
+
+    @profiled_phase
+    def check(self):
+        with self.profiler.phase("inner"):
+            sum(number * number for number in range(100000))
+
+
+class TestRunProfiler(unittest.TestCase):
+    def test_it_records_each_phase_of_a_run(self):
+        runner = ProfiledRunner(RunProfiler())
+        runner.run()
+        profiler = runner.profiler
+        self.assertEqual("run", profiler.run_name)
+        self.assertEqual(["allocate", "spin"], [p.name for p in profiler.phases])
+        for phase in profiler.phases:
+            self.assertLess(0, phase.wall_seconds)
+            self.assertLessEqual(0, phase.cpu_seconds)
+            self.assertIsNone(phase.traced_peak_bytes)
+            self.assertEqual([], phase.top_allocators)
+        self.assertLessEqual(
+            sum(p.wall_seconds for p in profiler.phases), profiler.run_wall_seconds
+        )
+
+    def test_it_starts_each_run_over(self):
+        runner = ProfiledRunner(RunProfiler())
+        runner.run()
+        runner.run()
+        self.assertEqual(2, len(runner.profiler.phases))
+
+    def test_it_adds_phases_to_the_last_run(self):
+        with TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, "profile.json")
+            runner = ProfiledRunner(RunProfiler(report_path=report_path))
+            runner.run()
+            runner.check()
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+        self.assertEqual("run", report["run"])
+        # The inner phase only counts toward the check
+        self.assertEqual(
+            ["allocate", "spin", "check"],
+            [phase["name"] for phase in report["phases"]],
+        )
+
+    def test_it_profiles_phases_before_any_run_as_a_run(self):
+        runner = ProfiledRunner(RunProfiler())
+        runner.check()
+        self.assertEqual("check", runner.profiler.run_name)
+        self.assertEqual(["check"], [p.name for p in runner.profiler.phases])
+
+    def test_it_traces_the_top_allocators(self):
+        runner = ProfiledRunner(RunProfiler(trace_memory=True, top_allocators=3))
+        runner.run()
+        allocate_phase = runner.profiler.phases[0]
+        self.assertLess(50000, allocate_phase.traced_peak_bytes)
+        self.assertEqual(3, len(allocate_phase.top_allocators))
+        location, size, count = allocate_phase.top_allocators[0]
+        self.assertIn("profiler_test.py", location)
+        self.assertLess(0, size)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_it_writes_reports(self):
+        with TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, "profile.json")
+            runner = ProfiledRunner(RunProfiler(report_path=report_path))
+            runner.run()
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+        self.assertEqual("run", report["run"])
+        self.assertEqual(
+            ["allocate", "spin"], [phase["name"] for phase in report["phases"]]
+        )
+        text_report = runner.profiler.report()
+        self.assertIn("allocate", text_report)
+        self.assertIn("spin", text_report)
+
+    def test_it_formats_bytes(self):
+        self.assertEqual("-", format_bytes(None))
+        self.assertEqual("512B", format_bytes(512))
+        self.assertEqual("1.5KB", format_bytes(1536))
+        self.assertEqual("2.0GB", format_bytes(2 * 1024**3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import unittest
+from os import stat
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from durasftp.common.sftp.segmented import (
+    SegmentedUpload,
+    preallocate,
+    split_segments,
+)
+
+
+class ShortWriteConnection:
+    """
+    Writes every segment but the last in full
+    """
+
+    def __init__(self, file_size):
+        self.file_size = file_size
+        self.renamed = False
+
+    def create_sized(self, remotepath, size):
+        pass
+
+    def put_range(self, localpath, remotepath, offset, length, callback=None):
+        if offset + length == self.file_size:
+            return length - 1
+        return length
+
+    def rename_into_place(self, remote_src, remote_dest):
+        self.renamed = True
+
+
+class TestSegments(unittest.TestCase):
+    def test_it_splits_files_into_segments(self):
+        self.assertEqual(
+            [(0, 0, 4), (1, 4, 4), (2, 8, 2)], split_segments(10, segment_size=4)
+        )
+        self.assertEqual([(0, 0, 4)], split_segments(4, segment_size=4))
+        self.assertEqual([], split_segments(0, segment_size=4))
+
+    def test_it_preallocates_files(self):
+        with TemporaryDirectory() as temp_dir:
+            path = join(temp_dir, "big.bin")
+            preallocate(path, 12345)
+            self.assertEqual(12345, stat(path).st_size)
+            preallocate(path, 0)
+            self.assertEqual(0, stat(path).st_size)
+
+
+class TestSegmentedUpload(unittest.TestCase):
+    def test_it_does_not_rename_short_uploads(self):
+        with TemporaryDirectory() as temp_dir:
+            path = join(temp_dir, "big.bin")
+            preallocate(path, 10)
+            conn = ShortWriteConnection(10)
+            upload = SegmentedUpload(
+                None, path, "/big.bin", max_connections=1, segment_size=4
+            )
+            with self.assertRaises(IOError):
+                upload.run(conn)
+            self.assertFalse(conn.renamed)
+
+
+if __name__ == "__main__":
+    unittest.main()